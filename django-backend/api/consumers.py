@@ -1,36 +1,67 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 import json
 import asyncio
+import logging
+import time
+import uuid
+from api.services import metrics
+from api.services.account_events import AccountSnapshot, get_account_events
 from api.services.user_service import UserService
+from api.services.history_service import ConversationHistory
+from api.services.intent_parser import intent_parser
+from api.services.timing import StageTimings
+from api.services.turn_queue import TurnQueue
 from .services.openai_service import OpenAIService
 
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between partial frames of a streamed reply
+STREAM_FLUSH_INTERVAL = 0.05
+
+QUEUE_FULL_MESSAGE = "You're sending messages faster than I can answer. Please wait for my reply and try again."
+
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        print("Attempting to connect...")
+        logger.debug("Attempting to connect...")
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f'chat_{self.room_name}'
         self.openai_service = OpenAIService()
         self.user_service = UserService()
 
         # Initialize message history and user context
-        self.message_history = []
+        self.history = ConversationHistory(
+            settings.CHAT_HISTORY_TOKEN_BUDGET,
+            summarizer=self.openai_service.summarize_history if settings.CHAT_HISTORY_SUMMARIZE else None
+        )
         self.current_user = None  # Store current user's name
         self.current_iban = None  # Store current user's IBAN
+        self.current_account_id = None
+        self.account = None  # AccountSnapshot of the current user, see _cached_account
+        self._account_seen = 0  # Newest ledger entry announced for the account
+        self._unsubscribe_account = None
+        self.account_events = get_account_events()
+        self.last_timings = None  # StageTimings of the latest turn
+        self.queue = TurnQueue(
+            settings.CHAT_QUEUE_SIZE,
+            overflow=settings.CHAT_QUEUE_OVERFLOW,
+            merge=self._merge_turns
+        )
+        self.worker = None
+        self._replied = False  # whether the turn being answered got its reply
         
-        print(f"Room name: {self.room_name}")
+        logger.debug("Room name: %s", self.room_name)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        print("Group added, accepting connection...")
+        logger.debug("Group added, accepting connection...")
         await self.accept()
+        self.worker = asyncio.create_task(self._worker())
         
         # Store and send initial bot message
         initial_message = 'Register by typing your full name and your current account balance'
-        self.message_history.append({
-            'role': 'assistant',
-            'content': initial_message
-        })
+        self.history.append('assistant', initial_message)
         
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -42,29 +73,126 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def receive(self, text_data):
+        timings = StageTimings()
         text_data_json = json.loads(text_data)
         message = text_data_json['message']
         username = text_data_json.get('username', 'Anonymous')
         
-        # Add user message to history
-        self.message_history.append({
-            'role': 'user',
-            'content': message
-        })
-        
-        # Process the incoming message with history by calling OpenAI
-        processed_result = await self.openai_service.process_message(message, self.message_history)
-        
-        # Send the original message to the group
-        await self.channel_layer.group_send(
+        # Send the original message to the group right away; replies wait for it
+        echo = asyncio.create_task(timings.timed('echo', self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
                 'message': message,
                 'username': username
             }
+        )))
+
+        turn = {'message': message, 'echoes': [echo], 'timings': timings}
+        outcome = self.queue.offer(turn)
+        if outcome == 'rejected':
+            # Only to this socket, through the channel layer so it follows the echo
+            await echo
+            await self.channel_layer.send(
+                self.channel_name,
+                {
+                    'type': 'chat_message',
+                    'message': QUEUE_FULL_MESSAGE,
+                    'username': 'Bot'
+                }
+            )
+        elif outcome == 'dropped':
+            logger.info("Dropped a message in room %s, %d turns already waiting", self.room_name, len(self.queue))
+
+    @staticmethod
+    def _merge_turns(waiting, turn):
+        """
+        Coalesce a new message into the newest waiting turn.
+        A reply carries at most one banking operation, so a recognized command
+        on either side is never merged and the new turn is rejected instead.
+        """
+        if intent_parser.is_operation(waiting['message']) or intent_parser.is_operation(turn['message']):
+            return None
+        waiting['message'] = f"{waiting['message']}\n{turn['message']}"
+        waiting['echoes'] = waiting['echoes'] + turn['echoes']
+        return waiting
+
+    async def _worker(self):
+        """
+        Answer queued turns one at a time, in order, off the consumer's
+        dispatch loop which would otherwise hold back the echo and streamed
+        frames to this socket until the turn ends. Turns share the history
+        and user context, so they never run concurrently.
+        """
+        while True:
+            turn = await self.queue.get()
+            timings = turn['timings']
+            timings.stages['queue'] = (0.0, timings.elapsed)
+            echo = asyncio.gather(*turn['echoes'])
+            self._replied = False
+            try:
+                await self.respond(turn['message'], echo, timings)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.errors.inc(1, 'chat_turn')
+                logger.exception("Chat turn failed in room %s", self.room_name)
+                # Every turn gets a reply, even when it failed before one was sent
+                if not self._replied:
+                    try:
+                        await self._reply(f"Error processing request: {str(e)}", uuid.uuid4().hex, echo, timings)
+                    except Exception:
+                        logger.exception("Could not send the error reply in room %s", self.room_name)
+            else:
+                # From receive() to the final reply, including the wait in the queue
+                metrics.observe('turn', timings.elapsed)
+
+    async def _reply(self, bot_response, bot_message_id, echo, timings):
+        """Add the bot reply to history and send it once the user's echo went out"""
+        self.history.append('assistant', bot_response)
+        self._replied = True
+
+        await echo
+        await timings.timed('reply', self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_message',
+                'message': bot_response,
+                'username': 'Bot',
+                'message_id': bot_message_id
+            }
+        ))
+
+    async def respond(self, message, echo, timings):
+        """Process one user message and send the bot reply"""
+        # Earlier turns go to the model; process_message adds the current message itself
+        history = self.history.window()
+        self.history.append('user', message)
+
+        # Most banking actions need the current user; unless the snapshot is
+        # usable, read it while the model runs
+        user_prefetch = None
+        if self.current_user and self._cached_account() is None:
+            user_prefetch = asyncio.create_task(timings.timed('user_prefetch', self._load_account()))
+
+        # Partial frames and the final reply share an id so clients can merge them
+        bot_message_id = uuid.uuid4().hex
+        on_delta = self._stream_sender(bot_message_id, echo) if settings.OPENAI_STREAM_RESPONSES else None
+
+        # Process the incoming message with history by calling OpenAI
+        processed_result = await self.openai_service.process_message(
+            message, history, on_delta=on_delta, timings=timings, session=self.channel_name
         )
 
+        async def current_user():
+            """The cached or prefetched account of the current user"""
+            account = self._cached_account()
+            if account is not None:
+                return account
+            if user_prefetch is None:
+                return await self._load_account()
+            return await user_prefetch
+
         # Process only if the Request to OPEN AI was a success
         if processed_result['status'] == 'success':
             processed_message = processed_result['processed_message']
@@ -87,6 +215,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         # Store user context after successful registration
                         self.current_user = user.name
                         self.current_iban = user.iban
+                        self._track_account(AccountSnapshot.from_user(user))
                         bot_response = f"Successfully registered user {user.name} with IBAN: {user.iban} and initial balance: {user.balance}"
                     else:
                         bot_response = f"Failed to register user: {message}"
@@ -95,7 +224,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 elif action == 'BALANCE':
                     if self.current_user:
                         try:
-                            user = await self.user_service.get_user_by_name(self.current_user)
+                            user = await current_user()
                             if user:
                                 bot_response = f"Current balance for {user.name}: {user.balance} euros\nYour IBAN: {user.iban}"
                             else:
@@ -109,7 +238,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 elif action == 'IBAN':
                     if self.current_user:
                         try:
-                            user = await self.user_service.get_user_by_name(self.current_user)
+                            user = await current_user()
                             if user:
                                 bot_response = f"Your IBAN is: {user.iban}"
                             else:
@@ -122,10 +251,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 # Handle withdrawal
                 elif action == 'WITHDRAW':
                     if self.current_user and operation.get('amount'):
-                        success, message = await self.user_service.withdraw(
+                        success, message, entry = await self.user_service.withdraw(
                             self.current_user,
                             operation.get('amount')
                         )
+                        self._account_applied(entry)
                         bot_response = message
                     else:
                         bot_response = "Please register first and specify an amount to withdraw."
@@ -133,10 +263,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 # Handle deposit
                 elif action == 'DEPOSIT':
                     if self.current_user and operation.get('amount'):
-                        success, message = await self.user_service.deposit(
+                        success, message, entry = await self.user_service.deposit(
                             self.current_user,
                             operation.get('amount')
                         )
+                        self._account_applied(entry)
                         bot_response = message
                     else:
                         bot_response = "Please register first and specify an amount to deposit."
@@ -145,13 +276,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 elif action == 'TRANSFER':
                     if self.current_user and operation.get('amount') and operation.get('iban'):
                         try:
-                            user = await self.user_service.get_user_by_name(self.current_user)
+                            user = await current_user()
                             if user:
-                                success, message = await self.user_service.transfer_money(
+                                success, message, entry = await self.user_service.transfer_money(
                                     user,
                                     operation.get('amount'),
                                     operation.get('iban')
                                 )
+                                self._account_applied(entry)
                                 bot_response = message
                             else:
                                 bot_response = "Could not find your account. Please register first."
@@ -164,38 +296,111 @@ class ChatConsumer(AsyncWebsocketConsumer):
             elif processed_message.get('type') == 'general_inquiry':
                 bot_response = processed_message.get('response', "I couldn't process that request")
 
-            # Add bot response to history
-            self.message_history.append({
-                'role': 'assistant',
-                'content': bot_response
-            })
-            
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': bot_response,
-                    'username': 'Bot'
-                }
-            )
+            await self._reply(bot_response, bot_message_id, echo, timings)
         else:
             error_message = f"Error processing request: {processed_result['error']}"
-            # Add error message to history
-            self.message_history.append({
-                'role': 'assistant',
-                'content': error_message
-            })
-            
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': error_message,
-                    'username': 'Bot'
-                }
-            )
+            await self._reply(error_message, bot_message_id, echo, timings)
+
+        if user_prefetch is not None:
+            if user_prefetch.done():
+                # Mark a failed read that no action used as retrieved
+                user_prefetch.exception()
+            else:
+                # Not needed for this reply; the thread finishes the read on its own
+                user_prefetch.cancel()
+        self.last_timings = timings
+        logger.debug("Chat turn timings: %s", timings)
+
+        # Off the reply's critical path: fold any dropped turns into the summary
+        await self.history.summarize()
+
+    def _track_account(self, account):
+        """Cache the account of a newly registered user and follow its changes"""
+        if self._unsubscribe_account is not None:
+            self._unsubscribe_account()
+        self.current_account_id = account.id
+        self.account = account
+        self._account_seen = account.version
+        self._unsubscribe_account = self.account_events.subscribe(account.id, self._account_changed)
+
+    def _account_changed(self, balance, version):
+        """Apply a committed change of the current account, or forget the snapshot"""
+        if balance is None:
+            self.account = None
+            return
+        self._account_seen = max(self._account_seen, version)
+        # Deliveries can repeat or arrive out of order; the newest entry wins
+        if self.account is not None and version > self.account.version:
+            self.account.balance = balance
+            self.account.version = version
+
+    def _account_applied(self, entry):
+        """
+        Apply the ledger entry of a change this session made, so the
+        snapshot doesn't wait for its account event
+        """
+        if entry is not None:
+            self._account_changed(entry.balance_after, entry.id)
+
+    def _cached_account(self):
+        """
+        The snapshot of the current account, or None when it has to be read.
+        Deposits, withdrawals and transfers from any session update it
+        through account events, so it is only trusted while those arrive.
+        """
+        if self.account is not None and self.account_events.live():
+            return self.account
+        return None
+
+    async def _load_account(self):
+        """Read the current account and cache it unless a newer change came in meanwhile"""
+        account = await self.user_service.get_account(self.current_account_id)
+        if account is not None and account.version >= self._account_seen:
+            self.account = account
+        return account
+
+    def _stream_sender(self, message_id, echo):
+        """
+        Build the on_delta callback for a streamed reply.
+        Deltas are coalesced so at most one partial frame goes out per
+        STREAM_FLUSH_INTERVAL; the final frame carries the complete text,
+        so anything still pending when the stream ends is not lost.
+        Nothing is sent before the echo of the user's message.
+        """
+        pending = []
+        last_sent = 0.0
+
+        async def send_delta(delta):
+            nonlocal last_sent
+            pending.append(delta)
+            now = time.monotonic()
+            if now - last_sent < STREAM_FLUSH_INTERVAL:
+                return
+            last_sent = now
+            text = ''.join(pending)
+            pending.clear()
+            await echo
+            with metrics.span('partial'):
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'chat_message',
+                        'message': '',
+                        'delta': text,
+                        'partial': True,
+                        'username': 'Bot',
+                        'message_id': message_id
+                    }
+                )
+
+        return send_delta
 
     async def disconnect(self, close_code):
+        if self.worker is not None:
+            self.worker.cancel()
+        self.queue.clear()
+        if self._unsubscribe_account is not None:
+            self._unsubscribe_account()
         # Simply clean up the group connection when disconnecting
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -203,10 +408,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
     async def chat_message(self, event):
-        message = event['message']
-        username = event['username']
+        payload = {
+            'message': event['message'],
+            'username': event['username']
+        }
+        # Streaming fields, only present on bot replies
+        for key in ('message_id', 'partial', 'delta'):
+            if key in event:
+                payload[key] = event[key]
 
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'username': username
-        }))
+        await self.send(text_data=json.dumps(payload))
@@ -0,0 +1,164 @@
+"""Banking FAQ cases shared by the tests, evaluate_rag and benchmark_chat"""
+
+# Test cases organized by category
+TEST_CASES = {
+    # Account Management test cases
+    "account": [
+        {
+            "query": "Register John with 1000 euros",
+            "relevant_docs": ["Simply tell the chatbot your name and optional initial deposit amount. For example, say \"Register John with 1000 euros\" or just \"Register John\" for an account with zero balance."],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "REGISTER",
+                    "user_name": "John",
+                    "amount": 1000
+                }
+            }
+        },
+        {
+            "query": "I'd like to open an account for Maria please",
+            "relevant_docs": ["Simply tell the chatbot your name and optional initial deposit amount. For example, say \"Register John with 1000 euros\" or just \"Register John\" for an account with zero balance."],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "REGISTER",
+                    "user_name": "Maria",
+                    "amount": 0
+                }
+            }
+        },
+        {
+            "query": "Can I create multiple accounts under the same name?",
+            "relevant_docs": ["No, the system allows only one account per name."],
+            "expected_response": {
+                "type": "general_inquiry",
+                "response": "No, the system allows only one account per name."
+            }
+        }
+    ],
+    
+    # Balance and IBAN test cases
+    "balance": [
+        {
+            "query": "Show John's balance",
+            "relevant_docs": ["You can ask \"What's my balance?\", \"Show my balance\", or \"Check balance\". The system will show your current balance along with your IBAN for reference."],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "BALANCE",
+                    "user_name": "John"
+                }
+            }
+        },
+        {
+            "query": "Could you tell me how much money I have in my account?",
+            "relevant_docs": ["You can ask \"What's my balance?\", \"Show my balance\", or \"Check balance\". The system will show your current balance along with your IBAN for reference."],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "BALANCE",
+                    "user_name": "John"
+                }
+            }
+        },
+        {
+            "query": "I forgot my account number, can you help?",
+            "relevant_docs": ["You can check your IBAN by asking \"What's my IBAN?\""],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "IBAN",
+                    "user_name": "John"
+                }
+            }
+        }
+    ],
+    
+    # Transaction test cases
+    "transactions": [
+        {
+            "query": "Transfer 300 euros to GR1234567890",
+            "relevant_docs": ["Say \"Transfer [amount] to [IBAN]\". For example, \"Transfer 300 euros to GR1234567890\". Make sure you have sufficient balance and the recipient's IBAN is correct."],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "TRANSFER",
+                    "amount": 300,
+                    "iban": "GR1234567890"
+                }
+            }
+        },
+        {
+            "query": "I need to send 50 euros to GR9876543210 and then deposit 200 euros",
+            "relevant_docs": [
+                "Say \"Transfer [amount] to [IBAN]\". For example, \"Transfer 300 euros to GR1234567890\". Make sure you have sufficient balance and the recipient's IBAN is correct.",
+                "To deposit money, simply say \"Deposit [amount]\". For example, \"Deposit 500 euros\". The minimum deposit is 1 euro, and the transaction is processed instantly."
+            ],
+            "expected_response": {
+                "type": "banking_operation",
+                "operation": {
+                    "action": "TRANSFER",
+                    "amount": 50,
+                    "iban": "GR9876543210"
+                }
+            }
+        },
+        {
+            "query": "Can I send money to my own account GR1111111111?",
+            "relevant_docs": ["Self-transfers are not allowed. The system will reject transfers where the sender and recipient IBANs are the same."],
+            "expected_response": {
+                "type": "general_inquiry",
+                "response": "Self-transfers are not allowed. The system will reject transfers where the sender and recipient IBANs are the same."
+            }
+        },
+        {
+            "query": "Take out 0.5 euros from my account",
+            "relevant_docs": [
+                "To withdraw money, say \"Withdraw [amount]\". For example, \"Withdraw 200 euros\". You must have sufficient balance, and the minimum withdrawal is 1 euro.",
+                "The minimum transaction amount is 1 euro. The maximum withdrawal or transfer amount is limited by your current balance."
+            ],
+            "expected_response": {
+                "type": "general_inquiry",
+                "response": "The minimum transaction amount is 1 euro. You cannot withdraw less than 1 euro from your account."
+            }
+        }
+    ],
+    
+    # Security and Error Handling test cases
+    "security": [
+        {
+            "query": "What happens if I try to withdraw more than my balance?",
+            "relevant_docs": [
+                "The withdrawal will be rejected with an \"Insufficient balance\" message. Your balance will remain unchanged.",
+                "No, overdrafts are not allowed. You can only withdraw or transfer up to your available balance."
+            ],
+            "expected_response": {
+                "type": "general_inquiry",
+                "response": "The withdrawal will be rejected with an \"Insufficient balance\" message. Your balance will remain unchanged. No, overdrafts are not allowed. You can only withdraw or transfer up to your available balance."
+            }
+        },
+        {
+            "query": "Is my money safe if a transaction fails halfway?",
+            "relevant_docs": [
+                "All transactions are atomic (they either complete fully or not at all) and are processed in real-time. Each session maintains your identity securely until you disconnect.",
+                "Failed transactions (like insufficient balance or invalid IBAN) are completely reversed and don't affect your balance. The system will provide a clear error message explaining what went wrong."
+            ],
+            "expected_response": {
+                "type": "general_inquiry",
+                "response": "Yes, your money is safe. All transactions are atomic (they either complete fully or not at all) and are processed in real-time. Failed transactions are completely reversed and don't affect your balance. The system will provide a clear error message explaining what went wrong."
+            }
+        },
+        {
+            "query": "What's the maximum amount I can transfer?",
+            "relevant_docs": [
+                "The minimum transaction amount is 1 euro. The maximum withdrawal or transfer amount is limited by your current balance.",
+                "You can only withdraw or transfer up to your available balance."
+            ],
+            "expected_response": {
+                "type": "general_inquiry",
+                "response": "The maximum amount you can transfer is limited by your current balance. You can only transfer up to your available balance. The minimum transaction amount is 1 euro."
+            }
+        }
+    ]
+}
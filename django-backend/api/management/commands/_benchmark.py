@@ -0,0 +1,50 @@
+import statistics
+import uuid
+from api.models import User, Transaction
+from api.services.ledger_service import ledger_service
+from api.services.user_service import UserService
+
+
+def create_accounts(count: int, balance: int) -> list:
+    """Throwaway accounts named bench-<run>-<n>, in primary key order"""
+    service = UserService()
+    run = uuid.uuid4().hex[:8]
+    User.objects.bulk_create([
+        User(name=f"bench-{run}-{index}", iban=service.generate_iban(), balance=balance)
+        for index in range(count)
+    ])
+    # bulk_create doesn't set primary keys on every backend
+    accounts = list(User.objects.filter(name__startswith=f"bench-{run}-").order_by('id'))
+    if balance:
+        ledger_service.record([
+            ledger_service.entry(account.id, Transaction.OPENING, balance, balance) for account in accounts
+        ])
+    return accounts
+
+
+def latency_summary(latencies: list) -> str:
+    latencies = sorted(latencies)
+    if not latencies:
+        return "latency ms: no samples"
+    return (
+        f"latency ms: p50={statistics.median(latencies) * 1000:.1f} "
+        f"p99={latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000:.1f} max={latencies[-1] * 1000:.1f}"
+    )
+
+
+def latency_percentiles(latencies: list) -> dict:
+    """p50, p90, p95, p99 and max in milliseconds, for JSON reports"""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+
+    def at(fraction):
+        return round(latencies[max(int(len(latencies) * fraction) - 1, 0)] * 1000, 1)
+
+    return {
+        'p50': round(statistics.median(latencies) * 1000, 1),
+        'p90': at(0.90),
+        'p95': at(0.95),
+        'p99': at(0.99),
+        'max': round(latencies[-1] * 1000, 1),
+    }
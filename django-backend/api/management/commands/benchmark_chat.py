@@ -0,0 +1,384 @@
+import asyncio
+import json
+import os
+import random
+import re
+import secrets
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import websockets
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.models import User
+from api.evaluation.cases import TEST_CASES
+from ._benchmark import latency_percentiles
+
+FAQ_QUERIES = [
+    case['query']
+    for cases in TEST_CASES.values()
+    for case in cases
+    if case['expected_response']['type'] == 'general_inquiry'
+]
+
+# Turns of a conversation after registering, with their relative weights
+TURNS = {
+    'deposit': 20,
+    'withdraw': 10,
+    'transfer': 15,
+    'balance': 20,
+    'iban': 10,
+    'faq': 25,
+}
+
+REGISTERED = re.compile(r"IBAN: (\w+)")
+ERROR_REPLY = re.compile(r"^(Error|Failed|Could not|Please register)")
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED = [
+    ('throughput_per_s', True),
+    ('latency_ms.p50', False),
+    ('latency_ms.p95', False),
+    ('latency_ms.p99', False),
+    ('first_frame_ms.p50', False),
+    ('error_rate', False),
+]
+
+
+def letters(number: int) -> str:
+    """0 -> A, 25 -> Z, 26 -> Ba: names must be words for the intent parser"""
+    word = ''
+    while True:
+        number, digit = divmod(number, 26)
+        word = string.ascii_lowercase[digit] + word
+        if not number:
+            return word.capitalize()
+
+
+def conversation(rng: random.Random, name: str, peers: list):
+    """
+    Endless scripted conversation of one session as (kind, message) pairs:
+    registration first, then a weighted mix of operations and FAQs.
+    peers is the shared list of registered IBANs transfers are sent to.
+    """
+    yield 'register', f"Register {name} with 1000 euros"
+    kinds, weights = zip(*TURNS.items())
+    while True:
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'deposit':
+            yield kind, f"Deposit {rng.randint(1, 100)}"
+        elif kind == 'withdraw':
+            yield kind, f"Withdraw {rng.randint(1, 20)}"
+        elif kind == 'transfer' and peers:
+            yield kind, f"Transfer {rng.randint(1, 10)} to {rng.choice(peers)}"
+        elif kind == 'balance':
+            yield kind, "What's my balance?"
+        elif kind == 'iban':
+            yield kind, "What's my IBAN?"
+        else:
+            yield 'faq', rng.choice(FAQ_QUERIES)
+
+
+def summarize_turns(turns: list, elapsed: float) -> dict:
+    """
+    Throughput, latency percentiles and error counts of a run. Every turn
+    is a dict of kind, outcome (ok, error_reply, rejected, timeout or
+    closed), latency and first_frame in seconds.
+    """
+    ok = [turn for turn in turns if turn['outcome'] == 'ok']
+    outcomes = {}
+    for turn in turns:
+        if turn['outcome'] != 'ok':
+            outcomes[turn['outcome']] = outcomes.get(turn['outcome'], 0) + 1
+    kinds = {}
+    for turn in turns:
+        kinds.setdefault(turn['kind'], []).append(turn)
+    return {
+        'turns': len(turns),
+        'throughput_per_s': round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': latency_percentiles([turn['latency'] for turn in ok]),
+        'first_frame_ms': latency_percentiles([turn['first_frame'] for turn in ok]),
+        'errors': outcomes,
+        'error_rate': round(sum(outcomes.values()) / len(turns), 4) if turns else 0.0,
+        'kinds': {
+            kind: {
+                'turns': len(group),
+                'errors': sum(1 for turn in group if turn['outcome'] != 'ok'),
+                'latency_ms': latency_percentiles([turn['latency'] for turn in group if turn['outcome'] == 'ok']),
+            }
+            for kind, group in sorted(kinds.items())
+        },
+    }
+
+
+def compare(previous: dict, current: dict) -> list:
+    """Lines contrasting the COMPARED metrics of two reports"""
+    def value(report, path):
+        for key in path.split('.'):
+            report = (report or {}).get(key)
+        return report
+
+    lines = [f"{'':20} {previous['run'].get('commit') or '?':>12.12} {current['run'].get('commit') or '?':>12.12}"]
+    for path, higher_is_better in COMPARED:
+        before, after = value(previous, path), value(current, path)
+        if before is None or after is None:
+            continue
+        change = ''
+        if before:
+            delta = (after - before) / before * 100
+            change = f" {delta:+6.1f}%"
+            # Smaller changes are within the noise of a run
+            if abs(delta) >= 5:
+                change += ' better' if (delta > 0) == higher_is_better else ' worse'
+        lines.append(f"{path:20} {before:>12} {after:>12}{change}")
+    return lines
+
+
+def git_commit() -> dict:
+    """Commit of the tree under test and whether it has uncommitted changes"""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+
+    try:
+        return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f"Nothing listening on port {port} after {timeout:g}s")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chat WebSocket: open concurrent sessions to ws/chat/<room>/, replay scripted "
+        "conversations at a target rate and report turn latency, throughput and errors as JSON. "
+        "Without --url a single uvicorn worker is started against the offline OpenAI stand-in "
+        "with an in-memory channel layer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=50, help="Concurrent WebSocket connections")
+        parser.add_argument('--rate', type=float, default=20.0,
+                            help="Target turns per second over all sessions, 0 sends each next message "
+                                 "as soon as the reply arrives")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to keep sending turns")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Seconds to wait for a reply")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for conversations and think times")
+        parser.add_argument('--url', help="Benchmark a running server instead, e.g. ws://127.0.0.1:8000")
+        parser.add_argument('--latency-scale', type=float, default=1.0,
+                            help="Latency multiplier of the OpenAI stand-in, 0 answers immediately")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of OpenAI stand-in requests failing with 429, 500 or 503")
+        parser.add_argument('--output', metavar='PATH', help="Write the JSON report here instead of stdout")
+        parser.add_argument('--compare', metavar='PATH', help="Report of an earlier run to compare with")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark accounts afterwards")
+
+    def handle(self, *args, **options):
+        if options['sessions'] < 1:
+            raise CommandError("--sessions must be at least 1")
+        if options['rate'] < 0:
+            raise CommandError("--rate can't be negative")
+        if options['compare'] and not os.path.exists(options['compare']):
+            raise CommandError(f"Report {options['compare']} does not exist")
+        run = letters(secrets.randbelow(26 ** 5) + 26 ** 4)
+
+        processes = []
+        # Output of the servers started here, kept if the run fails
+        log = None if options['url'] else tempfile.NamedTemporaryFile('w', prefix='benchmark_chat-', suffix='.log',
+                                                                       delete=False)
+        try:
+            url = options['url'] or self.start_servers(options, processes, log)
+            started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            turns, connect_errors, elapsed = asyncio.run(self.load(url.rstrip('/'), run, options))
+            if connect_errors == options['sessions']:
+                raise CommandError(f"No session could connect to {url}")
+        except BaseException:
+            if log:
+                self.stderr.write(f"Server output is in {log.name}")
+            raise
+        else:
+            if log:
+                os.unlink(log.name)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            if log:
+                log.close()
+            if not options['keep']:
+                User.objects.filter(name__startswith=f"Bench {run} ").delete()
+
+        report = {
+            'run': {
+                **git_commit(),
+                'started_at': started_at,
+                'target': options['url'] or 'local uvicorn worker, in-memory channel layer, fake OpenAI',
+                'sessions': options['sessions'],
+                'rate': options['rate'],
+                'duration_s': options['duration'],
+                'latency_scale': None if options['url'] else options['latency_scale'],
+                'error_rate': None if options['url'] else options['error_rate'],
+                'seed': options['seed'],
+                'elapsed_s': round(elapsed, 3),
+                'connect_errors': connect_errors,
+            },
+            **summarize_turns(turns, elapsed),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(
+                f"{report['turns']} turns over {options['sessions']} sessions in {elapsed:.1f}s: "
+                f"{report['throughput_per_s']}/s, p50 {report['latency_ms'].get('p50')}ms "
+                f"p95 {report['latency_ms'].get('p95')}ms p99 {report['latency_ms'].get('p99')}ms, "
+                f"error rate {report['error_rate']} -> {options['output']}"
+            )
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.stdout.write('\n'.join(compare(json.load(f), report)))
+
+    def start_servers(self, options, processes, log) -> str:
+        """Start the OpenAI stand-in and one uvicorn worker; returns the worker's URL"""
+        fake_port, port = free_port(), free_port()
+        manage = [sys.executable, str(settings.BASE_DIR / 'manage.py')]
+        fake = subprocess.Popen(
+            [*manage, 'fake_openai', '--port', str(fake_port), '--latency-scale', str(options['latency_scale']),
+             '--error-rate', str(options['error_rate']), '--seed', str(options['seed'])],
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+        processes.append(fake)
+        wait_for_port(fake_port, fake)
+
+        env = {
+            **os.environ,
+            'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY', 'fake'),
+            'OPENAI_BASE_URL': f"http://127.0.0.1:{fake_port}/v1",
+            'CHANNEL_LAYER_BACKEND': 'memory',
+            'ACCOUNT_EVENTS_REDIS': 'False',
+            'EMBEDDING_CACHE_REDIS': 'False',
+            'DJANGO_LOG_LEVEL': 'WARNING',
+            'API_LOG_LEVEL': 'WARNING',
+        }
+        worker = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app.asgi:application', '--host', '127.0.0.1',
+             '--port', str(port), '--workers', '1', '--log-level', 'warning'],
+            cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        processes.append(worker)
+        wait_for_port(port, worker)
+        return f"ws://127.0.0.1:{port}"
+
+    async def load(self, url: str, run: str, options) -> tuple:
+        """Run every session until the deadline; returns (turns, connect errors, elapsed seconds)"""
+        sessions = options['sessions']
+        # Mean time between the messages of one session, so all of them
+        # together send at the target rate as long as replies keep up
+        interval = sessions / options['rate'] if options['rate'] else 0.0
+        peers, turns = [], []
+        connect_errors = 0
+        started = time.perf_counter()
+        deadline = started + options['duration']
+
+        async def pause(until):
+            await asyncio.sleep(max(min(until, deadline) - time.perf_counter(), 0))
+
+        async def session(index):
+            nonlocal connect_errors
+            rng = random.Random(f"{options['seed']}-{index}")
+            name = f"Bench {run} {letters(index)}"
+            try:
+                connection = await websockets.connect(f"{url}/ws/chat/bench{run}{index}/", max_size=None,
+                                                      open_timeout=options['timeout'])
+                # The greeting
+                await asyncio.wait_for(connection.recv(), options['timeout'])
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                connect_errors += 1
+                return
+            async with connection:
+                # Spread the first messages of the sessions over one interval
+                await pause(time.perf_counter() + rng.uniform(0, interval))
+                for kind, message in conversation(rng, name, peers):
+                    sent = time.perf_counter()
+                    if sent >= deadline:
+                        break
+                    turn = await self.turn(connection, kind, message, name, options['timeout'])
+                    turns.append(turn)
+                    if turn['outcome'] in ('timeout', 'closed'):
+                        # Late frames would be taken for replies to the next turns
+                        break
+                    if kind == 'register':
+                        registered = REGISTERED.search(turn['reply'])
+                        if not registered:
+                            break
+                        peers.append(registered.group(1))
+                    if interval:
+                        # Poisson arrivals; a session behind schedule sends at once
+                        await pause(sent + rng.expovariate(1 / interval))
+
+        await asyncio.gather(*(session(index) for index in range(sessions)))
+        for turn in turns:
+            turn.pop('reply')
+        return turns, connect_errors, time.perf_counter() - started
+
+    @staticmethod
+    async def turn(connection, kind: str, message: str, name: str, timeout: float) -> dict:
+        """Send one message and wait for the complete bot reply"""
+        started = time.perf_counter()
+        first_frame = None
+
+        async def reply():
+            nonlocal first_frame
+            while True:
+                frame = json.loads(await connection.recv())
+                if frame['username'] != 'Bot':
+                    # The echo of our own message
+                    continue
+                if first_frame is None:
+                    first_frame = time.perf_counter() - started
+                if not frame.get('partial'):
+                    return frame
+
+        try:
+            await connection.send(json.dumps({'message': message, 'username': name}))
+            frame = await asyncio.wait_for(reply(), timeout)
+        except (asyncio.TimeoutError, websockets.ConnectionClosed) as e:
+            outcome = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'closed'
+            return {'kind': kind, 'outcome': outcome, 'latency': None, 'first_frame': None, 'reply': ''}
+
+        reply = frame['message']
+        if 'message_id' not in frame:
+            outcome = 'rejected'
+        elif ERROR_REPLY.match(reply):
+            outcome = 'error_reply'
+        else:
+            outcome = 'ok'
+        return {'kind': kind, 'outcome': outcome, 'latency': time.perf_counter() - started,
+                'first_frame': first_frame, 'reply': reply}
@@ -0,0 +1,77 @@
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from api.models import User
+from api.services.ledger_service import ledger_service
+from api.services.user_service import UserService
+from ._benchmark import create_accounts, latency_summary
+
+
+class Command(BaseCommand):
+    help = "Measure sustained deposit throughput through the ledger and check every balance against it afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=8, help="Accounts to deposit into")
+        parser.add_argument('--workers', type=int, default=16, help="Concurrent threads")
+        parser.add_argument('--seconds', type=float, default=10.0, help="How long to keep depositing")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark accounts afterwards")
+
+    def handle(self, *args, **options):
+        service = UserService()
+        accounts = create_accounts(options['accounts'], 0)
+        deadline = time.perf_counter() + options['seconds']
+        latencies, completed_at, errors = [], [], []
+        lock = threading.Lock()
+
+        def worker(index):
+            account = accounts[index % len(accounts)]
+            sequence = 0
+            try:
+                while time.perf_counter() < deadline:
+                    sequence += 1
+                    started = time.perf_counter()
+                    try:
+                        _, error = service.change_balance(account.name, 1, idempotency_key=f"bench-{index}-{sequence}")
+                    except Exception as e:
+                        error = str(e)
+                    finished = time.perf_counter()
+                    with lock:
+                        if error:
+                            errors.append(error)
+                        else:
+                            latencies.append(finished - started)
+                            completed_at.append(finished)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['workers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        # Deposits per whole second of the run, to see whether throughput holds up
+        per_second = [0] * max(int(elapsed), 1)
+        for finished in completed_at:
+            per_second[min(int(finished - started), len(per_second) - 1)] += 1
+
+        ledger_service.take_snapshots()
+        inconsistent = [
+            result for result in (ledger_service.verify(account.id) for account in accounts)
+            if not result['consistent']
+        ]
+        if not options['keep']:
+            User.objects.filter(id__in=[account.id for account in accounts]).delete()
+
+        self.stdout.write(
+            f"{len(latencies)} deposits into {len(accounts)} accounts with {options['workers']} workers "
+            f"in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), {len(errors)} errors\n"
+            f"per second: min={min(per_second)} max={max(per_second)}\n"
+            f"{latency_summary(latencies)}"
+        )
+        if inconsistent:
+            raise CommandError(f"Balances don't match the ledger: {inconsistent}")
+        self.stdout.write(self.style.SUCCESS("Every balance matches its ledger"))
@@ -0,0 +1,76 @@
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from api.models import User
+from api.services import iban
+from api.services.user_service import UserService
+from ._benchmark import latency_summary
+
+
+class Command(BaseCommand):
+    help = "Register many users concurrently and check that every IBAN is valid and unique"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help="Users to register")
+        parser.add_argument('--workers', type=int, default=16, help="Concurrent threads")
+        parser.add_argument('--block-size', type=int, default=None,
+                            help="Account numbers reserved per sequence call (defaults to IBAN_BLOCK_SIZE)")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark users afterwards")
+
+    def handle(self, *args, **options):
+        allocator = iban.IbanAllocator(
+            settings.IBAN_BANK_CODE,
+            settings.IBAN_BRANCH_CODE,
+            block_size=options['block_size'] or settings.IBAN_BLOCK_SIZE
+        )
+        service = UserService()
+        service.generate_iban = allocator.allocate
+        run = uuid.uuid4().hex[:8]
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def worker(indexes):
+            try:
+                for index in indexes:
+                    started = time.perf_counter()
+                    try:
+                        user, message = service.register(f"bench-{run}-{index}")
+                        error = None if user else message
+                    except Exception as e:
+                        error = str(e)
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                        if error:
+                            errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(range(index, options['users'], options['workers']),))
+            for index in range(options['workers'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        users = User.objects.filter(name__startswith=f"bench-{run}-")
+        ibans = list(users.values_list('iban', flat=True))
+        invalid = [value for value in ibans if not iban.is_valid_iban(value)]
+        if not options['keep']:
+            users.delete()
+
+        self.stdout.write(
+            f"{len(ibans)} users registered with {options['workers']} workers and blocks of "
+            f"{allocator.block_size} in {elapsed:.2f}s ({len(ibans) / elapsed:.0f}/s), {len(errors)} errors\n"
+            f"{latency_summary(latencies)}"
+        )
+        if errors or invalid or len(set(ibans)) != len(ibans):
+            raise CommandError(f"{len(errors)} failed registrations, {len(invalid)} invalid IBANs, "
+                               f"{len(ibans) - len(set(ibans))} duplicates; first error: {errors[:1]}")
+        self.stdout.write(self.style.SUCCESS("Every IBAN is valid and unique"))
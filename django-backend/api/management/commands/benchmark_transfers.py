@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Min, Sum
+from api.models import User
+from api.services.user_service import UserService
+from ._benchmark import create_accounts, latency_summary
+
+
+class Command(BaseCommand):
+    help = "Run concurrent transfers between a few hot accounts and check that no money is lost or created"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=4, help="Accounts to transfer between")
+        parser.add_argument('--workers', type=int, default=16, help="Concurrent threads")
+        parser.add_argument('--transfers', type=int, default=2000, help="Total transfers")
+        parser.add_argument('--balance', type=int, default=1000, help="Initial balance of every account")
+        parser.add_argument('--max-amount', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark accounts afterwards")
+
+    def handle(self, *args, **options):
+        if options['accounts'] < 2:
+            raise CommandError("At least two accounts are needed")
+        service = UserService()
+        accounts = create_accounts(options['accounts'], options['balance'])
+        expected_total = options['balance'] * len(accounts)
+
+        rng = random.Random(options['seed'])
+        jobs = [
+            (*rng.sample(accounts, 2), rng.randint(1, options['max_amount']))
+            for _ in range(options['transfers'])
+        ]
+        latencies, outcomes = [], {'success': 0, 'insufficient': 0, 'error': 0}
+        lock = threading.Lock()
+
+        def worker(chunk):
+            try:
+                for sender, recipient, amount in chunk:
+                    started = time.perf_counter()
+                    try:
+                        success, message = service.transfer(sender.id, amount, recipient.iban)
+                        outcome = 'success' if success else 'insufficient' if message == "Insufficient balance" else 'error'
+                    except Exception as e:
+                        self.stderr.write(f"Transfer failed: {e}")
+                        outcome = 'error'
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                        outcomes[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(jobs[index::options['workers']],))
+            for index in range(options['workers'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        totals = User.objects.filter(id__in=[account.id for account in accounts]).aggregate(
+            total=Sum('balance'), lowest=Min('balance')
+        )
+        if not options['keep']:
+            User.objects.filter(id__in=[account.id for account in accounts]).delete()
+
+        self.stdout.write(
+            f"{len(jobs)} transfers over {len(accounts)} accounts with {options['workers']} workers in {elapsed:.2f}s "
+            f"({len(jobs) / elapsed:.0f}/s)\n"
+            f"outcomes: {outcomes}\n"
+            f"{latency_summary(latencies)}"
+        )
+        if totals['total'] != expected_total or totals['lowest'] < 0:
+            raise CommandError(
+                f"Balances are inconsistent: total {totals['total']} (expected {expected_total}), "
+                f"lowest {totals['lowest']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Total balance conserved at {expected_total}, no negative balances"))
@@ -0,0 +1,28 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.services.retrievers import RETRIEVERS, build_retriever
+
+
+class Command(BaseCommand):
+    help = "Build the document retrieval index and save it so workers can load it at startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=list(RETRIEVERS), default=None,
+                            help="Retriever backend (defaults to RAG_RETRIEVER)")
+        parser.add_argument('--output', default=None,
+                            help="Index file to write (defaults to RAG_INDEX_PATH)")
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.RAG_INDEX_PATH
+        if not output:
+            raise CommandError("No output path given and RAG_INDEX_PATH is not set")
+
+        retriever = build_retriever(options['backend'])
+        started = time.perf_counter()
+        retriever.prepare()
+        retriever.save(output)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(retriever)} documents with {retriever.kind} in {elapsed:.2f}s -> {output}"
+        ))
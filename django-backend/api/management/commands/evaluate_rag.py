@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import json
+import os
+import time
+import numpy as np
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from api.models import Document
+from api.services.clients import openai_clients
+from api.services.embedding_cache import EmbeddingCache
+from api.services.openai_service import OpenAIService
+from api.services.rag_service import RAGService
+from api.services.recorder import RecordingTransport, UsageTransport, usage
+from api.services.timing import StageTimings
+from api.evaluation.cases import TEST_CASES
+from ._benchmark import latency_percentiles
+
+FAQ_FILES = [
+    "banking_faqs_account.txt",
+    "banking_faqs_balance.txt",
+    "banking_faqs_transactions.txt",
+    "banking_faqs_security.txt",
+]
+
+METRICS = ["mrr", "precision_at_k", "ndcg", "context_relevance", "response_format_accuracy", "operation_accuracy"]
+
+
+def score_retrieval(contents: list, relevant_docs: list, k: int) -> dict:
+    """
+    MRR, precision@k and NDCG@k of the ranked document contents retrieved for a case.
+    A document is relevant when it contains one of the relevant_docs texts.
+    Precision is the share of relevant documents among the top k retrieved, and
+    the ideal ranking for NDCG puts one relevant document per relevant_docs text first.
+    """
+    relevance = [1.0 if any(doc in content for doc in relevant_docs) else 0.0 for content in contents[:k]]
+    first = next((rank for rank, relevant in enumerate(relevance, start=1) if relevant), None)
+    dcg = sum(relevant / np.log2(rank + 1) for rank, relevant in enumerate(relevance, start=1))
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(len(relevant_docs), k) + 1))
+    return {
+        'mrr': 1.0 / first if first else 0.0,
+        'precision_at_k': sum(relevance) / len(relevance) if relevance else 0.0,
+        'ndcg': float(dcg / ideal) if ideal else 0.0,
+    }
+
+
+def score_response(actual: dict, expected: dict) -> tuple:
+    """(format accuracy, operation accuracy), scored as in TestBankingFAQsEvaluation"""
+    format_score = 1.0 if actual.get('type') == expected['type'] else 0.0
+    if expected['type'] == 'banking_operation':
+        expected_operation = expected['operation']
+        operation = actual.get('operation') or {}
+        params = [param for param in ('user_name', 'amount', 'iban') if param in expected_operation]
+        correct = int(operation.get('action') == expected_operation['action'])
+        correct += sum(operation.get(param) == expected_operation[param] for param in params)
+        return format_score, correct / (1 + len(params))
+    if expected['type'] == 'general_inquiry':
+        return format_score, 1.0 if actual.get('response') == expected['response'] else 0.0
+    return format_score, 0.0
+
+
+def add_usage(totals: dict, tokens: dict):
+    for endpoint, counts in tokens.items():
+        bucket = totals.setdefault(endpoint, dict.fromkeys(counts, 0))
+        for name, value in counts.items():
+            bucket[name] += value
+
+
+def summarize(results: list) -> dict:
+    """Average scores, latency percentiles and token usage of a group of cases"""
+    summary = {
+        'queries': len(results),
+        'errors': sum(1 for result in results if result.get('error')),
+    }
+    for metric in METRICS:
+        summary[metric] = round(sum(result['scores'][metric] for result in results) / len(results), 4)
+    summary['latency_ms'] = latency_percentiles([result['latency_ms'] / 1000 for result in results])
+    stages = sorted({stage for result in results for stage in result['stages']})
+    summary['stages_ms'] = {
+        stage: latency_percentiles([
+            result['stages'][stage]['duration_ms'] / 1000 for result in results if stage in result['stages']
+        ])
+        for stage in stages
+    }
+    summary['tokens'] = {}
+    for result in results:
+        add_usage(summary['tokens'], result['tokens'])
+    return summary
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate retrieval and answers on the banking FAQ test cases concurrently "
+        "and print the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help="Cases evaluated at the same time")
+        parser.add_argument('--categories', nargs='*', choices=list(TEST_CASES), help="Only these categories")
+        parser.add_argument('--ingest', action='store_true',
+                            help="Add the FAQ documents first, skipping those already stored")
+        parser.add_argument('--no-fast-path', action='store_true',
+                            help="Send every case to the model instead of parsing simple commands locally")
+        parser.add_argument('--embedding-cache', default=os.path.join('.evaluation', 'embeddings.json'),
+                            help="File embeddings are kept in between runs")
+        parser.add_argument('--no-embedding-cache', action='store_true')
+        recording = parser.add_mutually_exclusive_group()
+        recording.add_argument('--record', metavar='PATH', help="Save every OpenAI response of this run")
+        recording.add_argument('--replay', metavar='PATH',
+                               help="Answer every OpenAI request from a recording, without network access")
+        parser.add_argument('--output', metavar='PATH', help="Write the JSON report here instead of stdout")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        if options['replay'] and not os.path.exists(options['replay']):
+            raise CommandError(f"Recording {options['replay']} does not exist")
+
+        if options['replay']:
+            layers = [RecordingTransport(options['replay'], offline=True)]
+        else:
+            layers = []
+            if not options['no_embedding_cache']:
+                layers.append(RecordingTransport(options['embedding_cache'], paths=('/embeddings',)))
+            if options['record']:
+                layers.append(RecordingTransport(options['record'], fresh=True))
+
+        def wrap(transport):
+            # Innermost layer first, so a recording also captures cached embeddings
+            for layer in layers:
+                if not layer.offline:
+                    layer.transport = transport
+                transport = layer
+            return UsageTransport(transport)
+
+        openai_clients.set_transport_wrapper(wrap)
+        fast_path = override_settings(FAST_PATH_ENABLED=False) if options['no_fast_path'] else contextlib.nullcontext()
+        try:
+            with fast_path:
+                report = asyncio.run(self.evaluate(options))
+        finally:
+            openai_clients.set_transport_wrapper(None)
+            for layer in layers:
+                layer.save()
+
+        report['run']['top_k'] = settings.RAG_TOP_K
+        report['run']['mode'] = 'replay' if options['replay'] else 'record' if options['record'] else 'live'
+        report['run']['recorded_hits'] = sum(layer.hits for layer in layers)
+        report['run']['recorded_misses'] = sum(layer.misses for layer in layers)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            overall = report['overall']
+            self.stdout.write(
+                f"{overall['queries']} cases in {report['run']['elapsed_s']}s: "
+                f"MRR {overall['mrr']:.3f}, precision@{report['run']['top_k']} {overall['precision_at_k']:.3f}, "
+                f"NDCG@{report['run']['top_k']} {overall['ndcg']:.3f}, operation accuracy {overall['operation_accuracy']:.3f}, "
+                f"p50 {overall['latency_ms'].get('p50')}ms -> {options['output']}"
+            )
+        else:
+            self.stdout.write(output)
+
+    async def evaluate(self, options) -> dict:
+        rag_service = RAGService()
+        # In-process only: Redis must not decide which requests a run sends
+        rag_service.embedding_cache = EmbeddingCache(max_size=4096)
+        openai_service = OpenAIService()
+        openai_service.rag_service = rag_service
+        openai_service.response_cache = None
+
+        if options['ingest']:
+            await self.ingest(rag_service)
+
+        cases = [
+            (category, case)
+            for category, category_cases in TEST_CASES.items()
+            if not options['categories'] or category in options['categories']
+            for case in category_cases
+        ]
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def bounded(category, case):
+            async with semaphore:
+                return await self.evaluate_case(rag_service, openai_service, category, case)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(bounded(category, case) for category, case in cases))
+        elapsed = time.perf_counter() - started
+
+        by_category = {}
+        for result in results:
+            by_category.setdefault(result['category'], []).append(result)
+        return {
+            'run': {'cases': len(results), 'concurrency': options['concurrency'], 'elapsed_s': round(elapsed, 3)},
+            'overall': summarize(results) if results else {},
+            'categories': {category: summarize(group) for category, group in by_category.items()},
+            'cases': results,
+        }
+
+    async def ingest(self, rag_service):
+        for name in FAQ_FILES:
+            with open(settings.BASE_DIR / 'api' / 'documents' / name) as f:
+                content = f.read()
+            if not await Document.objects.filter(content=content).aexists():
+                await rag_service.add_document(content)
+                self.stderr.write(f"Added {name}")
+
+    async def evaluate_case(self, rag_service, openai_service, category, case) -> dict:
+        """Run one case through the chat pipeline, then score its retrieval and answer"""
+        # gather() runs every case in its own task, so each collects only its own requests
+        tokens = {}
+        usage.set(tokens)
+        timings = StageTimings()
+        result = {'category': category, 'query': case['query'], 'scores': dict.fromkeys(METRICS, 0.0)}
+
+        started = time.perf_counter()
+        try:
+            response = await openai_service.process_message(case['query'], timings=timings)
+        except Exception as e:
+            response = {'status': 'error', 'error': str(e)}
+        result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        result['stages'] = timings.as_dict()
+        if response['status'] != 'success':
+            result['error'] = response['error']
+
+        try:
+            # The query embedding is cached by now, so this adds no request
+            query_embedding, _, document_ids = await rag_service.retrieve_context(case['query'])
+            documents = await database_sync_to_async(Document.objects.in_bulk)(document_ids)
+        except Exception as e:
+            result.setdefault('error', f"Retrieval failed: {e}")
+            query_embedding, document_ids, documents = None, [], {}
+        contents = [documents[doc_id].content for doc_id in document_ids if doc_id in documents]
+        result['scores'].update(score_retrieval(contents, case['relevant_docs'], settings.RAG_TOP_K))
+        result['document_ids'] = document_ids
+        document = documents.get(document_ids[0]) if document_ids else None
+        if document is not None and document.embedding is not None and query_embedding is not None:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            vector = document.vector
+            result['scores']['context_relevance'] = round(
+                float(np.dot(query, vector) / (np.linalg.norm(query) * np.linalg.norm(vector))), 4
+            )
+
+        actual = response.get('processed_message') or {}
+        if response['status'] == 'success':
+            result['scores']['response_format_accuracy'], result['scores']['operation_accuracy'] = \
+                score_response(actual, case['expected_response'])
+        result['response'] = actual
+        result['expected'] = case['expected_response']
+        result['tokens'] = tokens
+        return result
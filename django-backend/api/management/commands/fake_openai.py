@@ -0,0 +1,49 @@
+import asyncio
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api.services.fake_openai import FakeOpenAIServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the OpenAI API for load and latency testing; "
+        "point OPENAI_BASE_URL at the printed URL"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency-scale', type=float, default=1.0,
+                            help="Multiplier for the simulated latencies, 0 answers immediately")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Share of requests failing with 429, 500 or 503")
+        parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds sent with 429s")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for latencies and injected errors")
+        parser.add_argument('--script', metavar='PATH',
+                            help='JSON list of {"pattern": ..., "response": {...}} chat replies')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError("--error-rate must be between 0 and 1")
+        server = FakeOpenAIServer(
+            host=options['host'],
+            port=options['port'],
+            latency_scale=options['latency_scale'],
+            error_rate=options['error_rate'],
+            retry_after=options['retry_after'],
+            seed=options['seed'],
+        )
+        if options['script']:
+            with open(options['script']) as f:
+                for rule in json.load(f):
+                    server.script(rule['pattern'], rule['response'])
+
+        async def serve():
+            await server.start()
+            self.stdout.write(self.style.SUCCESS(f"Fake OpenAI API on {server.base_url}"))
+            await server.serve_forever()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            self.stdout.write(f"Served {server.stats()}")
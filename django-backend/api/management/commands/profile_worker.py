@@ -0,0 +1,56 @@
+import urllib.error
+import urllib.parse
+import urllib.request
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def top_functions(stacks: str, count: int) -> list:
+    """(samples, function) of the innermost frames seen most often"""
+    totals = {}
+    for line in stacks.splitlines():
+        stack, _, samples = line.rpartition(' ')
+        leaf = stack.rsplit(';', 1)[-1]
+        totals[leaf] = totals.get(leaf, 0) + int(samples)
+    return sorted(((samples, leaf) for leaf, samples in totals.items()), reverse=True)[:count]
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile a running worker through its /debug/profile endpoint (PROFILER_ENABLED) "
+        "and save the collapsed stacks for flamegraph.pl or speedscope"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Base URL of the worker")
+        parser.add_argument('--seconds', type=float, default=10.0, help="How long to sample")
+        parser.add_argument('--interval', type=float, default=0.01, help="Seconds between samples")
+        parser.add_argument('--token', default=settings.PROFILER_TOKEN, help="Defaults to PROFILER_TOKEN")
+        parser.add_argument('--output', metavar='PATH', help="Write the stacks here instead of stdout")
+        parser.add_argument('--top', type=int, default=15, help="Innermost functions to summarize")
+
+    def handle(self, *args, **options):
+        query = urllib.parse.urlencode({'seconds': options['seconds'], 'interval': options['interval']})
+        request = urllib.request.Request(f"{options['url'].rstrip('/')}/debug/profile?{query}")
+        if options['token']:
+            request.add_header('Authorization', f"Bearer {options['token']}")
+        try:
+            with urllib.request.urlopen(request, timeout=options['seconds'] + 30) as response:
+                stacks = response.read().decode()
+                samples = response.headers.get('X-Profile-Samples')
+        except urllib.error.HTTPError as e:
+            raise CommandError(f"{e.code} from {e.url}: {e.read().decode().strip()}")
+        except urllib.error.URLError as e:
+            raise CommandError(f"Could not reach {options['url']}: {e.reason}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(stacks)
+        else:
+            self.stdout.write(stacks, ending='')
+        # Keep stdout to the stacks alone, so it can be piped to flamegraph.pl
+        summary = self.stderr if not options['output'] else self.stdout
+        summary.write(f"{samples} samples of every thread")
+        total = sum(int(line.rpartition(' ')[2]) for line in stacks.splitlines()) or 1
+        for samples, function in top_functions(stacks, options['top']):
+            summary.write(f"{samples / total:6.1%}  {function}")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import User
+from api.services.ledger_service import ledger_service
+
+
+class Command(BaseCommand):
+    help = "Snapshot the balance of every account with new ledger entries; run periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Also check every materialized balance against its snapshot and ledger")
+
+    def handle(self, *args, **options):
+        created = ledger_service.take_snapshots()
+        self.stdout.write(f"Created {created} balance snapshots")
+        if not options['verify']:
+            return
+
+        mismatches = []
+        for account_id in User.objects.values_list('id', flat=True).iterator():
+            result = ledger_service.verify(account_id)
+            if not result['consistent']:
+                mismatches.append(result)
+                self.stderr.write(
+                    f"Account {account_id}: balance {result['balance']}, ledger says {result['ledger_balance']}"
+                )
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} accounts don't match their ledger")
+        self.stdout.write(self.style.SUCCESS("Every balance matches its ledger"))
@@ -0,0 +1,58 @@
+# Generated manually
+
+import json
+import numpy as np
+from django.db import migrations, models
+
+
+def json_to_binary(apps, schema_editor):
+    Document = apps.get_model('api', 'Document')
+    batch = []
+    for doc in Document.objects.exclude(embedding__isnull=True).only('id', 'embedding').iterator():
+        embedding = doc.embedding
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        doc.embedding_binary = np.asarray(embedding, dtype='<f4').tobytes()
+        batch.append(doc)
+        if len(batch) >= 500:
+            Document.objects.bulk_update(batch, ['embedding_binary'])
+            batch = []
+    if batch:
+        Document.objects.bulk_update(batch, ['embedding_binary'])
+
+
+def binary_to_json(apps, schema_editor):
+    Document = apps.get_model('api', 'Document')
+    batch = []
+    for doc in Document.objects.exclude(embedding_binary__isnull=True).only('id', 'embedding_binary').iterator():
+        doc.embedding = np.frombuffer(doc.embedding_binary, dtype='<f4').tolist()
+        batch.append(doc)
+        if len(batch) >= 500:
+            Document.objects.bulk_update(batch, ['embedding'])
+            batch = []
+    if batch:
+        Document.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('api', '0002_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='embedding_binary',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='document',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='document',
+            old_name='embedding_binary',
+            new_name='embedding',
+        ),
+    ]
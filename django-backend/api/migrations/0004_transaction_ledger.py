@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_ledgers(apps, schema_editor):
+    """Start the ledger of existing accounts with their current balance"""
+    User = apps.get_model('api', 'User')
+    Transaction = apps.get_model('api', 'Transaction')
+    Transaction.objects.bulk_create(
+        (
+            Transaction(account_id=user_id, kind='OPENING', amount=balance, balance_after=balance)
+            for user_id, balance in User.objects.exclude(balance=0).values_list('id', 'balance').iterator()
+        ),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_document_binary_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening balance'), ('DEPOSIT', 'Deposit'), ('WITHDRAW', 'Withdrawal'), ('TRANSFER_IN', 'Incoming transfer'), ('TRANSFER_OUT', 'Outgoing transfer')], max_length=16)),
+                ('amount', models.IntegerField()),
+                ('balance_after', models.IntegerField()),
+                ('idempotency_key', models.CharField(blank=True, max_length=64, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='api.user')),
+                ('counterparty', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='api.user')),
+                ('last_transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.transaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-created_at', '-id'], name='transaction_account_time'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', '-id'], name='transaction_account_latest'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key__isnull', False)), fields=('account', 'idempotency_key'), name='transaction_idempotency_key'),
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['account', '-last_transaction'], name='snapshot_account_latest'),
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated manually
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('api', '0004_transaction_ledger'),
+    ]
+
+    operations = [
+        # Blocks of IBAN account numbers, see api.services.iban.IbanAllocator
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS api_iban_block_seq",
+            "DROP SEQUENCE IF EXISTS api_iban_block_seq",
+        ),
+    ]
@@ -1,13 +1,29 @@
 from django.db import models
+from django.utils import timezone
+import numpy as np
 
 class Document(models.Model):
     content = models.TextField()
-    embedding = models.JSONField(null=True)  # Store vector embeddings as JSON
+    embedding = models.BinaryField(null=True)  # Store vector embeddings as raw float32 bytes
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"Document {self.id}: {self.content[:50]}..."
 
+    @staticmethod
+    def encode_embedding(vector) -> bytes:
+        """Pack an embedding vector into little-endian float32 bytes"""
+        return np.asarray(vector, dtype='<f4').tobytes()
+
+    @staticmethod
+    def decode_embedding(data) -> np.ndarray:
+        """View stored embedding bytes as a float32 array without copying"""
+        return np.frombuffer(data, dtype='<f4')
+
+    @property
+    def vector(self):
+        return self.decode_embedding(self.embedding) if self.embedding is not None else None
+
 class User(models.Model):
     iban = models.TextField(unique=True)
     name = models.TextField(unique=True)
@@ -15,3 +31,54 @@ class User(models.Model):
     
     def __str__(self):
         return self.iban
+
+class Transaction(models.Model):
+    """Append-only ledger entry of one account; amount is signed, credits are positive"""
+    OPENING = 'OPENING'
+    DEPOSIT = 'DEPOSIT'
+    WITHDRAW = 'WITHDRAW'
+    TRANSFER_IN = 'TRANSFER_IN'
+    TRANSFER_OUT = 'TRANSFER_OUT'
+    KIND_CHOICES = [
+        (OPENING, 'Opening balance'),
+        (DEPOSIT, 'Deposit'),
+        (WITHDRAW, 'Withdrawal'),
+        (TRANSFER_IN, 'Incoming transfer'),
+        (TRANSFER_OUT, 'Outgoing transfer'),
+    ]
+
+    account = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    amount = models.IntegerField()
+    balance_after = models.IntegerField()
+    counterparty = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-created_at', '-id'], name='transaction_account_time'),
+            models.Index(fields=['account', '-id'], name='transaction_account_latest'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'idempotency_key'],
+                condition=models.Q(idempotency_key__isnull=False),
+                name='transaction_idempotency_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.amount} on account {self.account_id}"
+
+class BalanceSnapshot(models.Model):
+    """Balance of an account as of one ledger entry, to check the materialized balance against"""
+    account = models.ForeignKey(User, on_delete=models.CASCADE, related_name='snapshots')
+    balance = models.IntegerField()
+    last_transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-last_transaction'], name='snapshot_account_latest'),
+        ]
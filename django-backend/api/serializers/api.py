@@ -1,13 +1,20 @@
 from rest_framework import serializers
-from api.models import User, Document
+from api.models import User, Document, Transaction
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'name', 'iban', 'balance']
+        # Balances only change through UserService, which writes the ledger
+        read_only_fields = ['balance']
 
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = ['id', 'content', 'created_at']
         read_only_fields = ['embedding']
+
+class TransactionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Transaction
+        fields = ['id', 'kind', 'amount', 'balance_after', 'counterparty', 'idempotency_key', 'created_at']
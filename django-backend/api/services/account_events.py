@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+import weakref
+from django.conf import settings
+from redis import Redis
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+
+class AccountSnapshot:
+    """
+    What a chat session remembers about its account between turns.
+    version is the id of the newest ledger entry the balance includes.
+    """
+
+    def __init__(self, id, name, iban, balance, version=0):
+        self.id = id
+        self.name = name
+        self.iban = iban
+        self.balance = balance
+        self.version = version
+
+    @classmethod
+    def from_user(cls, user, version=0):
+        return cls(user.id, user.name, user.iban, user.balance, version)
+
+
+class AccountEvents:
+    """
+    Fans committed balance changes out to the chat sessions caching them.
+    A change is delivered to sessions of this process right away and
+    published on a Redis channel for the other workers, each of which
+    keeps one subscription per event loop. Changes carry the new balance
+    and the id of the ledger entry behind it, so late or repeated
+    deliveries can be recognized. While a loop's subscription is down its
+    sessions can't trust their snapshots, see live().
+    """
+
+    # Seconds between attempts to restore a lost subscription, and to bypass publishing after an error
+    reconnect_delay = 5
+
+    def __init__(self, channel: str = 'account-changes', redis_host: str = None, redis_port: int = 6379):
+        self.channel = channel
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        # Tags what this process publishes; it has already delivered those itself
+        self.origin = uuid.uuid4().hex
+        self._subscribers = {}  # account id -> {token: (event loop, callback)}
+        self._lock = threading.Lock()
+        self._listeners = weakref.WeakKeyDictionary()  # event loop -> subscription task
+        self._live = weakref.WeakSet()  # event loops with a working subscription
+        self._outbox = queue.SimpleQueue()  # payloads for the publisher thread
+        self._publisher = None
+        self._redis_down_until = 0.0
+        self.published = 0
+        self.received = 0
+        self.publish_errors = 0
+
+    def subscribe(self, account_id: int, callback):
+        """
+        Call callback(balance, version) in the running loop whenever the
+        account changes, or callback(None, None) when changes may have been
+        missed. Returns a function that cancels the subscription.
+        """
+        loop = asyncio.get_running_loop()
+        token = object()
+        with self._lock:
+            self._subscribers.setdefault(account_id, {})[token] = (loop, callback)
+        if self.redis_host and loop not in self._listeners:
+            self._listeners[loop] = loop.create_task(self._listen(loop))
+
+        def unsubscribe():
+            with self._lock:
+                subscribers = self._subscribers.get(account_id, {})
+                subscribers.pop(token, None)
+                if not subscribers:
+                    self._subscribers.pop(account_id, None)
+
+        return unsubscribe
+
+    def live(self) -> bool:
+        """Whether sessions on the running loop hear about changes made by other workers"""
+        if not self.redis_host:
+            # Single process: every change is delivered locally
+            return True
+        return asyncio.get_running_loop() in self._live
+
+    def changed(self, account_id: int, balance: int, version: int):
+        """Report a committed balance change; safe to call from any thread"""
+        self._deliver(account_id, balance, version)
+        self._publish({'origin': self.origin, 'account_id': account_id, 'balance': balance, 'version': version})
+
+    def _deliver(self, account_id, balance, version, loop=None):
+        with self._lock:
+            targets = list(self._subscribers.get(account_id, {}).values())
+        for target_loop, callback in targets:
+            if loop is not None and target_loop is not loop:
+                continue
+            try:
+                target_loop.call_soon_threadsafe(callback, balance, version)
+            except RuntimeError:
+                # The session's loop is gone
+                pass
+
+    def _publish(self, payload):
+        """Hand the change to the publisher thread so commits never wait on Redis"""
+        if not self.redis_host:
+            return
+        with self._lock:
+            if self._publisher is None or not self._publisher.is_alive():
+                self._publisher = threading.Thread(target=self._run_publisher, name='account-events', daemon=True)
+                self._publisher.start()
+        self._outbox.put(payload)
+
+    def _run_publisher(self):
+        client = Redis(host=self.redis_host, port=self.redis_port,
+                       socket_timeout=0.5, socket_connect_timeout=0.5, retry=None)
+        while True:
+            payload = self._outbox.get()
+            if time.monotonic() < self._redis_down_until:
+                # Subscribers are cut off from Redis too and have stopped trusting their snapshots
+                self.publish_errors += 1
+                continue
+            try:
+                client.publish(self.channel, json.dumps(payload))
+                self.published += 1
+            except Exception as e:
+                self.publish_errors += 1
+                self._redis_down_until = time.monotonic() + self.reconnect_delay
+                logger.warning("Could not publish account change: %s", e)
+
+    async def _listen(self, loop):
+        """Keep this loop subscribed to the channel until the loop stops"""
+        while True:
+            client = aioredis.Redis(host=self.redis_host, port=self.redis_port,
+                                    socket_connect_timeout=0.5, retry=None)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self._live.add(loop)
+                    elif message['type'] == 'message':
+                        self._receive(message['data'], loop)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Account change subscription lost: %s", e)
+            finally:
+                self._live.discard(loop)
+                self._invalidate(loop)
+                try:
+                    await pubsub.aclose()
+                    await client.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _receive(self, data, loop):
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return
+        if payload.get('origin') == self.origin:
+            return
+        self.received += 1
+        self._deliver(payload['account_id'], payload['balance'], payload['version'], loop)
+
+    def _invalidate(self, loop):
+        """Tell every session on loop that its snapshot may be stale"""
+        with self._lock:
+            targets = [target for subscribers in self._subscribers.values() for target in subscribers.values()]
+        for target_loop, callback in targets:
+            if target_loop is loop:
+                # Behind any change already queued for the session
+                loop.call_soon(callback, None, None)
+
+    async def aclose(self):
+        """Drop the subscription of the running loop"""
+        listener = self._listeners.pop(asyncio.get_running_loop(), None)
+        if listener is not None:
+            listener.cancel()
+            try:
+                await listener
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = sum(len(subscribers) for subscribers in self._subscribers.values())
+        return {
+            'sessions': sessions,
+            'published': self.published,
+            'received': self.received,
+            'publish_errors': self.publish_errors,
+        }
+
+
+_account_events = None
+_account_events_lock = threading.Lock()
+
+
+def get_account_events() -> AccountEvents:
+    """Process-wide account change fan-out configured from settings"""
+    global _account_events
+    if _account_events is None:
+        with _account_events_lock:
+            if _account_events is None:
+                _account_events = AccountEvents(
+                    channel=settings.ACCOUNT_EVENTS_CHANNEL,
+                    redis_host=settings.REDIS_HOST if settings.ACCOUNT_EVENTS_REDIS else None,
+                    redis_port=settings.REDIS_PORT,
+                )
+    return _account_events
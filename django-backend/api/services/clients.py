@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import threading
+import weakref
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class OpenAIClientRegistry:
+    """
+    Process-wide AsyncOpenAI clients, one per event loop.
+    Every service in the process shares the client, and so the httpx
+    connection pool, of the loop it runs on instead of opening its own.
+    Connections are tied to a loop, hence one client per loop rather than
+    a single global one.
+    """
+
+    def __init__(self):
+        self._clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+        self._lock = threading.Lock()
+        self._http2 = None
+        self._transport_wrapper = None
+
+    def _build(self) -> AsyncOpenAI:
+        if self._http2 is None:
+            self._http2 = settings.OPENAI_HTTP2 and _http2_available()
+            if settings.OPENAI_HTTP2 and not self._http2:
+                logger.warning("OPENAI_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            http2=self._http2,
+        )
+        if self._transport_wrapper is not None:
+            transport = self._transport_wrapper(transport)
+        http_client = DefaultAsyncHttpxClient(transport=transport, timeout=settings.OPENAI_TIMEOUT)
+        # Retries are done by the request scheduler, which also paces them
+        return AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            http_client=http_client,
+            max_retries=0,
+        )
+
+    def set_transport_wrapper(self, wrapper):
+        """
+        Build clients on wrapper(transport) from now on, e.g. to record or
+        replay requests; None goes back to plain connections. Clients built
+        earlier are dropped, not closed.
+        """
+        with self._lock:
+            self._transport_wrapper = wrapper
+            self._clients = weakref.WeakKeyDictionary()
+
+    def get(self) -> AsyncOpenAI:
+        """Client for the running event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(loop)
+                if client is None:
+                    client = self._build()
+                    self._clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """Close the client of the running loop, e.g. on ASGI lifespan shutdown"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    @staticmethod
+    def _pool_stats(client: AsyncOpenAI) -> dict:
+        # httpx has no public pool API; read the httpcore pool when it's there
+        transport = getattr(client._client, '_transport', None)
+        # Look through a wrapping transport such as RecordingTransport
+        transport = getattr(transport, 'transport', None) or transport
+        pool = getattr(transport, '_pool', None)
+        connections = list(getattr(pool, 'connections', None) or [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {'connections': len(connections), 'idle': idle, 'active': len(connections) - idle}
+
+    def stats(self) -> dict:
+        """Connection pool utilization summed over every live client"""
+        totals = {'clients': 0, 'connections': 0, 'idle': 0, 'active': 0}
+        for client in list(self._clients.values()):
+            totals['clients'] += 1
+            for key, value in self._pool_stats(client).items():
+                totals[key] += value
+        totals['max_connections'] = settings.OPENAI_MAX_CONNECTIONS
+        totals['utilization'] = (
+            totals['active'] / (totals['clients'] * settings.OPENAI_MAX_CONNECTIONS)
+            if totals['clients'] else 0.0
+        )
+        return totals
+
+
+openai_clients = OpenAIClientRegistry()
+
+
+def get_openai_client() -> AsyncOpenAI:
+    return openai_clients.get()
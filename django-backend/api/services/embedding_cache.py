@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from redis import asyncio as aioredis
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?!.")
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of query embeddings.
+    An in-process LRU sits in front of a shared Redis tier, both keyed on a
+    hash of the normalized text and the embedding model. Redis errors are
+    counted and otherwise ignored so a cache outage never fails a chat turn.
+    """
+
+    key_prefix = "embedding:"
+    # Seconds to bypass Redis after an error instead of paying its timeout on every lookup
+    redis_retry_after = 30
+
+    def __init__(self, max_size: int = 1024, ttl: int = 86400, redis_host: str = None, redis_port: int = 6379):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self._local = OrderedDict()  # key -> (expires_at, embedding)
+        self._lock = threading.Lock()
+        self._clients = weakref.WeakKeyDictionary()  # event loop -> redis client
+        self.hits_local = 0
+        self.hits_redis = 0
+        self.misses = 0
+        self.redis_errors = 0
+        self._redis_down_until = 0.0
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        digest = hashlib.sha256(f"{model}\0{normalize_query(text)}".encode()).hexdigest()
+        return f"{EmbeddingCache.key_prefix}{model}:{digest}"
+
+    def _redis(self):
+        """Redis client bound to the running event loop"""
+        if not self.redis_host or time.monotonic() < self._redis_down_until:
+            return None
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = aioredis.Redis(host=self.redis_host, port=self.redis_port,
+                                    socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._clients[loop] = client
+        return client
+
+    def _redis_failed(self):
+        self.redis_errors += 1
+        self._redis_down_until = time.monotonic() + self.redis_retry_after
+
+    def _get_local(self, key: str):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, embedding = entry
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return embedding
+
+    def _set_local(self, key: str, embedding: list, ttl: float = None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), embedding)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    async def get(self, text: str, model: str):
+        """Return the cached embedding or None"""
+        key = self.make_key(text, model)
+        embedding = self._get_local(key)
+        if embedding is not None:
+            self.hits_local += 1
+            return embedding
+
+        client = self._redis()
+        if client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    data, ttl = await pipe.get(key).ttl(key).execute()
+            except Exception:
+                self._redis_failed()
+            else:
+                if data is not None:
+                    embedding = np.frombuffer(data, dtype='<f4').tolist()
+                    # Don't let the local copy outlive the shared entry
+                    self._set_local(key, embedding, ttl if ttl and ttl > 0 else None)
+                    self.hits_redis += 1
+                    return embedding
+
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, model: str, embedding: list):
+        key = self.make_key(text, model)
+        self._set_local(key, embedding)
+        client = self._redis()
+        if client is not None:
+            try:
+                await client.set(key, np.asarray(embedding, dtype='<f4').tobytes(), ex=self.ttl)
+            except Exception:
+                self._redis_failed()
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    async def aclose(self):
+        """Close the Redis client of the running loop"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self) -> dict:
+        lookups = self.hits_local + self.hits_redis + self.misses
+        return {
+            'size': len(self._local),
+            'hits_local': self.hits_local,
+            'hits_redis': self.hits_redis,
+            'misses': self.misses,
+            'redis_errors': self.redis_errors,
+            'hit_rate': (self.hits_local + self.hits_redis) / lookups if lookups else 0.0,
+        }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache configured from settings"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache(
+                    max_size=settings.EMBEDDING_CACHE_SIZE,
+                    ttl=settings.EMBEDDING_CACHE_TTL,
+                    redis_host=settings.REDIS_HOST if settings.EMBEDDING_CACHE_REDIS else None,
+                    redis_port=settings.REDIS_PORT,
+                )
+    return _embedding_cache
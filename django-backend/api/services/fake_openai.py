@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+import uuid
+import numpy as np
+from .history_service import count_tokens
+from .intent_parser import intent_parser
+from .openai_service import CONTEXT_PROMPT, SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 1536
+WORD = re.compile(r"[a-z0-9']+")
+
+# Text around the context section of a formatted SYSTEM_PROMPT, and around
+# the retrieved context within that section
+_PROMPT_PREFIX, _PROMPT_SUFFIX = SYSTEM_PROMPT.format(context='\0').split('\0')
+_CONTEXT_PREFIX, _CONTEXT_SUFFIX = CONTEXT_PROMPT.format(context='\0').split('\0')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests',
+           500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable'}
+
+
+def hashed_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list:
+    """
+    Deterministic bag-of-words embedding: every word adds +-1 to a dimension
+    picked by its hash, and the vector is L2 normalized. Texts sharing words
+    come out similar, which is enough for retrieval to behave sensibly.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        value = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), 'little')
+        vector[value % dimensions] += 1.0 if value >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if not norm:
+        # Empty text; any unit vector keeps cosine similarity defined
+        vector[0], norm = 1.0, 1.0
+    return (vector / norm).tolist()
+
+
+class LatencyModel:
+    """Log-normal delay around a median, plus a fixed cost per token"""
+
+    def __init__(self, median: float, sigma: float = 0.4, per_token: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.per_token = per_token
+
+    def sample(self, rng: random.Random, tokens: int = 0) -> float:
+        base = self.median * rng.lognormvariate(0, self.sigma) if self.median else 0.0
+        return base + self.per_token * tokens
+
+
+# Roughly what gpt-4o-mini and text-embedding-3-small take from Europe
+DEFAULT_LATENCY = {
+    'embeddings': LatencyModel(0.12, 0.35, per_token=0.00002),
+    'first_token': LatencyModel(0.45, 0.5, per_token=0.00005),
+    'token': LatencyModel(0.0, per_token=0.012),
+}
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the OpenAI embeddings and chat completions API.
+    Embeddings come from hashed_embedding. Chat completions answer in the
+    JSON schema of SYSTEM_PROMPT: scripted replies first, then the local
+    intent parser, otherwise a general_inquiry quoting the first sentence
+    of the context. Replies are delayed per DEFAULT_LATENCY times
+    latency_scale (0 answers at once), streamed when asked to, and a share
+    of requests given by error_rate fails with one of error_statuses.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_scale: float = 1.0,
+                 latency: dict = None, error_rate: float = 0.0, error_statuses=(429, 500, 503),
+                 retry_after: float = 1.0, seed: int = None):
+        self.host = host
+        self.port = port
+        self.latency_scale = latency_scale
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.rules = []  # (compiled pattern, response dict or callable)
+        self._failures = []  # statuses forced by fail_next
+        self.server = None
+        self.requests = {}
+        self.errors = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        await self.server.serve_forever()
+
+    def script(self, pattern: str, response):
+        """
+        Answer user messages matching pattern (case-insensitive search) with
+        response: a SYSTEM_PROMPT style dict, or a callable taking the
+        message and returning one
+        """
+        self.rules.append((re.compile(pattern, re.IGNORECASE), response))
+
+    def fail_next(self, *statuses: int):
+        """Fail the next requests with these statuses, in order"""
+        self._failures.extend(statuses)
+
+    def stats(self) -> dict:
+        return {'requests': dict(self.requests), 'errors': dict(self.errors)}
+
+    def _delay(self, name: str, tokens: int = 0) -> float:
+        return self.latency[name].sample(self.rng, tokens) * self.latency_scale
+
+    def _injected_error(self):
+        if self._failures:
+            return self._failures.pop(0)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self.rng.choice(self.error_statuses)
+        return None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                await self._route(method, path.split('?', 1)[0], body, writer)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes, writer):
+        endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if method != 'POST' or endpoint not in ('embeddings', 'completions'):
+            return await self._send_json(writer, 404, {'error': {'message': f"No route for {method} {path}",
+                                                                  'type': 'invalid_request_error'}})
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return await self._send_json(writer, 400, {'error': {'message': "Invalid JSON body",
+                                                                  'type': 'invalid_request_error'}})
+
+        status = self._injected_error()
+        if status is not None:
+            self.errors[status] = self.errors.get(status, 0) + 1
+            await asyncio.sleep(self._delay('embeddings') / 4)
+            headers = {'Retry-After': f"{self.retry_after:g}"} if status == 429 else {}
+            return await self._send_json(writer, status, {'error': {'message': f"Injected {status}",
+                                                                     'type': 'fake_error'}}, headers)
+
+        if endpoint == 'embeddings':
+            await self._embeddings(payload, writer)
+        else:
+            await self._chat(payload, writer)
+
+    async def _embeddings(self, payload: dict, writer):
+        inputs = payload.get('input', '')
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        tokens = sum(count_tokens(text) for text in inputs)
+        await asyncio.sleep(self._delay('embeddings', tokens))
+        await self._send_json(writer, 200, {
+            'object': 'list',
+            'model': payload.get('model'),
+            'data': [{'object': 'embedding', 'index': index, 'embedding': hashed_embedding(text)}
+                     for index, text in enumerate(inputs)],
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+    def reply(self, messages: list) -> str:
+        """Content of the assistant message for a chat request"""
+        system = next((message['content'] for message in messages if message.get('role') == 'system'), '')
+        user = next((message['content'] for message in reversed(messages) if message.get('role') == 'user'), '')
+        if not system.startswith(_PROMPT_PREFIX):
+            # Not the banking prompt, e.g. a history summary
+            return f"The customer said: {user[:200]}"
+
+        for pattern, response in self.rules:
+            if pattern.search(user):
+                return json.dumps(response(user) if callable(response) else response)
+        parsed = intent_parser.parse(user)
+        if parsed is not None:
+            return json.dumps(parsed)
+        context = system[len(_PROMPT_PREFIX):]
+        if context.endswith(_PROMPT_SUFFIX):
+            context = context[:-len(_PROMPT_SUFFIX)]
+        if context.startswith(_CONTEXT_PREFIX) and context.endswith(_CONTEXT_SUFFIX):
+            context = context[len(_CONTEXT_PREFIX):-len(_CONTEXT_SUFFIX)]
+        sentence = re.split(r"(?<=[.!?])\s", context.strip(), maxsplit=1)[0]
+        return json.dumps({
+            'type': 'general_inquiry',
+            'response': sentence or "I'm sorry, I don't have information about that.",
+        })
+
+    async def _chat(self, payload: dict, writer):
+        messages = payload.get('messages', [])
+        prompt_tokens = sum(count_tokens(str(message.get('content', ''))) for message in messages)
+        content = self.reply(messages)
+        completion_tokens = count_tokens(content)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        await asyncio.sleep(self._delay('first_token', prompt_tokens))
+
+        if not payload.get('stream'):
+            await asyncio.sleep(self._delay('token', completion_tokens))
+            return await self._send_json(writer, 200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens},
+            })
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+
+        async def event(delta: dict, finish_reason=None, **fields):
+            chunk = json.dumps({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                **fields,
+            })
+            await self._write_chunk(writer, f"data: {chunk}\n\n".encode())
+
+        await event({'role': 'assistant', 'content': ''})
+        # About four characters per token
+        for start in range(0, len(content), 4):
+            await asyncio.sleep(self._delay('token', 1))
+            await event({'content': content[start:start + 4]})
+        await event({}, 'stop')
+        if (payload.get('stream_options') or {}).get('include_usage'):
+            # Like the API: a last chunk without choices carrying the usage
+            await event(None, choices=[], usage={'prompt_tokens': prompt_tokens,
+                                                 'completion_tokens': completion_tokens,
+                                                 'total_tokens': prompt_tokens + completion_tokens})
+        await self._write_chunk(writer, b"data: [DONE]\n\n")
+        await self._write_chunk(writer, b"")
+
+    @staticmethod
+    async def _write_chunk(writer, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _send_json(writer, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode()
+        extra = ''.join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n{extra}\r\n".encode() + payload
+        )
+        await writer.drain()
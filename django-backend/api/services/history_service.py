@@ -0,0 +1,122 @@
+import logging
+import math
+
+try:
+    import tiktoken
+except ImportError:  # Optional, falls back to a character heuristic
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds around every message
+MESSAGE_TOKEN_OVERHEAD = 4
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise ~4 characters per token"""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            # Encoding files could not be loaded, stick to the heuristic
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def count_message_tokens(message: dict) -> int:
+    return count_tokens(message.get('content') or '') + MESSAGE_TOKEN_OVERHEAD
+
+
+class ConversationHistory:
+    """
+    Token-bounded message history of one chat connection.
+    System messages are always kept; other messages are dropped oldest
+    first once the budget is exceeded. With a summarizer, dropped turns are
+    folded into a cached summary that is sent in their place.
+    """
+
+    def __init__(self, token_budget: int, summarizer=None):
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self.messages = []
+        self.summary = None
+        self._summary_tokens = 0
+        self._pending = []  # dropped messages not yet folded into the summary
+        self._tokens = 0
+        self.trimmed_messages = 0
+        self.trimmed_tokens = 0
+        self.summaries = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def _summary_message(self):
+        return {'role': 'assistant', 'content': f"{SUMMARY_PREFIX}{self.summary}"} if self.summary else None
+
+    @property
+    def tokens(self) -> int:
+        return self._tokens + self._summary_tokens
+
+    def append(self, role: str, content: str):
+        message = {'role': role, 'content': content}
+        self.messages.append(message)
+        self._tokens += count_message_tokens(message)
+        self._trim()
+
+    def _trim(self):
+        trimmed, trimmed_tokens = 0, 0
+        position = 0
+        # Keep at least the newest message even if it alone exceeds the budget
+        while self.tokens > self.token_budget and position < len(self.messages) - 1:
+            if self.messages[position]['role'] == 'system':
+                position += 1
+                continue
+            message = self.messages.pop(position)
+            tokens = count_message_tokens(message)
+            self._tokens -= tokens
+            trimmed += 1
+            trimmed_tokens += tokens
+            if self.summarizer is not None:
+                self._pending.append(message)
+        if trimmed:
+            self.trimmed_messages += trimmed
+            self.trimmed_tokens += trimmed_tokens
+            logger.debug(
+                "Trimmed %d messages (%d tokens) from chat history, %d tokens kept",
+                trimmed, trimmed_tokens, self.tokens
+            )
+
+    def window(self) -> list:
+        """Messages to send to the model: the summary, if any, then the kept turns"""
+        summary = self._summary_message()
+        return ([summary] if summary else []) + list(self.messages)
+
+    async def summarize(self):
+        """Fold dropped turns into the summary; cheap no-op when nothing was dropped"""
+        if self.summarizer is None or not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            self.summary = await self.summarizer(self.summary, pending)
+            self._summary_tokens = count_message_tokens(self._summary_message()) if self.summary else 0
+            self.summaries += 1
+        except Exception as e:
+            # Keep the old summary, the dropped turns are simply lost
+            logger.warning("Failed to summarize chat history: %s", e)
+        self._trim()
+
+    def stats(self) -> dict:
+        return {
+            'messages': len(self.messages),
+            'tokens': self.tokens,
+            'token_budget': self.token_budget,
+            'trimmed_messages': self.trimmed_messages,
+            'trimmed_tokens': self.trimmed_tokens,
+            'summaries': self.summaries,
+        }
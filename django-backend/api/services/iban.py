@@ -0,0 +1,92 @@
+import os
+import threading
+from django.conf import settings
+from django.db import connection
+
+COUNTRY_CODE = "GR"
+ACCOUNT_NUMBER_DIGITS = 16
+# Postgres sequence handing out blocks of account numbers, see migration 0005
+BLOCK_SEQUENCE = "api_iban_block_seq"
+
+
+def _to_digits(text: str) -> str:
+    """ISO 13616 letter substitution: A=10 ... Z=35"""
+    return ''.join(str(int(char, 36)) for char in text.upper())
+
+
+def iban_check_digits(country_code: str, bban: str) -> str:
+    """mod-97 check digits for a BBAN"""
+    return f"{98 - int(_to_digits(bban + country_code + '00')) % 97:02d}"
+
+
+def is_valid_iban(iban: str) -> bool:
+    iban = iban.replace(' ', '').upper()
+    if len(iban) < 15 or not iban.isalnum():
+        return False
+    return int(_to_digits(iban[4:] + iban[:4])) % 97 == 1
+
+
+class IbanAllocator:
+    """
+    Hands out valid Greek IBANs without checking the database for collisions.
+    Account numbers come from blocks of block_size reserved with one
+    nextval() on a Postgres sequence, so workers never hand out the same
+    number and most registrations need no query at all. Numbers left in a
+    block when a process exits are simply never used. The unique
+    constraint on User.iban stays as the safety net.
+    """
+
+    def __init__(self, bank_code: str, branch_code: str, block_size: int = 100):
+        if len(bank_code) != 3 or len(branch_code) != 4 or not (bank_code + branch_code).isdigit():
+            raise ValueError("Greek IBANs need a 3 digit bank code and a 4 digit branch code")
+        self.bank_code = bank_code
+        self.branch_code = branch_code
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def _reserve_block(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [BLOCK_SEQUENCE])
+            block = cursor.fetchone()[0]
+        # Sequences start at 1
+        self._next = (block - 1) * self.block_size
+        self._end = self._next + self.block_size
+        self._pid = os.getpid()
+
+    def next_account_number(self) -> int:
+        with self._lock:
+            # A forked worker must not reuse its parent's block
+            if self._next >= self._end or self._pid != os.getpid():
+                self._reserve_block()
+            number = self._next
+            self._next += 1
+        if number >= 10 ** ACCOUNT_NUMBER_DIGITS:
+            raise OverflowError("IBAN account numbers are exhausted")
+        return number
+
+    def format(self, account_number: int) -> str:
+        bban = f"{self.bank_code}{self.branch_code}{account_number:0{ACCOUNT_NUMBER_DIGITS}d}"
+        return f"{COUNTRY_CODE}{iban_check_digits(COUNTRY_CODE, bban)}{bban}"
+
+    def allocate(self) -> str:
+        return self.format(self.next_account_number())
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_iban_allocator() -> IbanAllocator:
+    """Process-wide allocator configured from settings"""
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = IbanAllocator(
+                    bank_code=settings.IBAN_BANK_CODE,
+                    branch_code=settings.IBAN_BRANCH_CODE,
+                    block_size=settings.IBAN_BLOCK_SIZE,
+                )
+    return _allocator
@@ -0,0 +1,96 @@
+import re
+import threading
+from collections import Counter
+
+# Whole euro amounts only; anything else (decimals, ranges, words) goes to the LLM
+AMOUNT = r"(?:€\s*)?(?P<amount>\d{1,3}(?:,\d{3})+|\d+)(?!\s*[.,]\d)\s*(?:euros?|eur|€)?"
+IBAN = r"(?P<iban>[A-Za-z]{2}\d{2}[A-Za-z0-9]{6,30})"
+NAME = r"(?P<user_name>[A-Za-z][A-Za-z'\-]*(?:\s+[A-Za-z][A-Za-z'\-]*){0,3}?)"
+POLITE = r"(?:(?:please|pls|kindly|can you|could you|i want to|i'd like to|i would like to)\s+)?"
+END = r"\s*(?:please)?\s*[.!?]*$"
+MY_ACCOUNT = r"(?:\s+(?:to|into|in|from|out of)\s+my\s+account)?"
+
+# Words that can't be part of a user name, so e.g. "Deposit 500" isn't a registration
+RESERVED_WORDS = {
+    'deposit', 'withdraw', 'transfer', 'send', 'balance', 'iban', 'register', 'add', 'put',
+    'take', 'show', 'check', 'what', 'my', 'the', 'please', 'pay', 'get', 'give', 'euro', 'euros',
+    'me', 'i', 'a', 'an', 'new', 'account', 'for', 'to', 'with',
+}
+
+RULES = [
+    ('TRANSFER', re.compile(rf"^{POLITE}(?:transfer|send|pay)\s+{AMOUNT}\s+to\s+{IBAN}{END}", re.IGNORECASE)),
+    ('DEPOSIT', re.compile(rf"^{POLITE}(?:deposit|add|put\s+in|put)\s+{AMOUNT}{MY_ACCOUNT}{END}", re.IGNORECASE)),
+    ('WITHDRAW', re.compile(rf"^{POLITE}(?:withdraw|take\s+out)\s+{AMOUNT}{MY_ACCOUNT}{END}", re.IGNORECASE)),
+    ('BALANCE', re.compile(rf"^{POLITE}(?:(?:what'?s|what\s+is|show(?:\s+me)?|check|get)\s+)?(?:my|{NAME}'s)\s+(?:account\s+)?balance{END}", re.IGNORECASE)),
+    ('BALANCE', re.compile(rf"^{POLITE}(?:check|show)?\s*balance{END}", re.IGNORECASE)),
+    ('IBAN', re.compile(rf"^{POLITE}(?:(?:what'?s|what\s+is|show(?:\s+me)?|get|tell\s+me)\s+)?my\s+iban{END}", re.IGNORECASE)),
+    ('REGISTER', re.compile(rf"^{POLITE}register\s+(?:me\s+as\s+)?{NAME}(?:\s+with\s+{AMOUNT})?{END}", re.IGNORECASE)),
+]
+
+
+class IntentParser:
+    """
+    Rule-based extractor for simple banking commands.
+    Emits the same banking_operation JSON as SYSTEM_PROMPT describes when a
+    message matches one of the rules exactly, and None otherwise so the
+    caller falls back to the LLM. Keeps match-rate counters.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = rules or RULES
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.matches = Counter()
+
+    def _extract(self, message: str):
+        text = re.sub(r"\s+", " ", message.strip())
+        for action, pattern in self.rules:
+            match = pattern.match(text)
+            if not match:
+                continue
+            groups = match.groupdict()
+            operation = {'action': action}
+            user_name = groups.get('user_name')
+            if user_name:
+                if set(user_name.lower().split()) & RESERVED_WORDS:
+                    continue
+                operation['user_name'] = user_name
+            if groups.get('amount'):
+                amount = int(groups['amount'].replace(',', ''))
+                if amount <= 0:
+                    # Let the LLM explain the minimum amount
+                    return None
+                operation['amount'] = amount
+            if groups.get('iban'):
+                operation['iban'] = groups['iban'].upper()
+            return operation
+        return None
+
+    def is_operation(self, message: str) -> bool:
+        """Whether the message is a command the rules recognize, without counting it"""
+        return self._extract(message) is not None
+
+    def parse(self, message: str):
+        """Return a banking_operation response dict or None"""
+        operation = self._extract(message)
+        with self._lock:
+            self.attempts += 1
+            if operation is not None:
+                self.matches[operation['action']] += 1
+        if operation is None:
+            return None
+        return {'type': 'banking_operation', 'operation': operation}
+
+    def stats(self) -> dict:
+        with self._lock:
+            matched = sum(self.matches.values())
+            return {
+                'attempts': self.attempts,
+                'matches': matched,
+                'match_rate': matched / self.attempts if self.attempts else 0.0,
+                'by_action': dict(self.matches),
+            }
+
+
+# Shared by every OpenAIService in this process
+intent_parser = IntentParser()
@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from api.models import User, Transaction, BalanceSnapshot
+
+
+class LedgerService:
+    """
+    Append-only ledger behind the materialized User.balance.
+    Every balance change writes Transaction rows in the same database
+    transaction that updates the balance, so reading a balance stays a
+    single row lookup while the history is kept. Callers lock the account
+    row first; entries of one account are therefore written in order and
+    balance_after is exact.
+    """
+
+    @staticmethod
+    def find(account_id, idempotency_key):
+        """Entry already written for this key, or None"""
+        if not idempotency_key:
+            return None
+        return Transaction.objects.filter(account_id=account_id, idempotency_key=idempotency_key).first()
+
+    @staticmethod
+    def entry(account_id, kind, amount, balance_after, counterparty_id=None, idempotency_key=None) -> Transaction:
+        return Transaction(
+            account_id=account_id,
+            kind=kind,
+            amount=amount,
+            balance_after=balance_after,
+            counterparty_id=counterparty_id,
+            idempotency_key=idempotency_key or None
+        )
+
+    @staticmethod
+    def record(entries: list) -> list:
+        """Insert entries with a single bulk INSERT"""
+        return Transaction.objects.bulk_create(entries, batch_size=1000)
+
+    @staticmethod
+    def history(account_id, since=None, until=None):
+        """Entries of an account, newest first"""
+        entries = Transaction.objects.filter(account_id=account_id)
+        if since is not None:
+            entries = entries.filter(created_at__gte=since)
+        if until is not None:
+            entries = entries.filter(created_at__lt=until)
+        return entries.order_by('-created_at', '-id')
+
+    def take_snapshots(self) -> int:
+        """Snapshot every account with entries newer than its latest snapshot"""
+        latest_entry = Transaction.objects.filter(account=OuterRef('pk')).order_by('-id')
+        latest_snapshot = BalanceSnapshot.objects.filter(account=OuterRef('pk')).order_by('-last_transaction')
+        accounts = User.objects.annotate(
+            entry_id=Subquery(latest_entry.values('id')[:1]),
+            entry_balance=Subquery(latest_entry.values('balance_after')[:1]),
+            snapshot_entry_id=Subquery(latest_snapshot.values('last_transaction')[:1]),
+        ).filter(entry_id__isnull=False).filter(
+            Q(snapshot_entry_id__isnull=True) | Q(snapshot_entry_id__lt=F('entry_id'))
+        ).values_list('id', 'entry_id', 'entry_balance')
+
+        snapshots = [
+            BalanceSnapshot(account_id=account_id, last_transaction_id=entry_id, balance=balance)
+            for account_id, entry_id, balance in accounts.iterator()
+        ]
+        BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+        return len(snapshots)
+
+    def verify(self, account_id) -> dict:
+        """
+        Compare the materialized balance with the latest snapshot plus the
+        entries written after it.
+        """
+        with transaction.atomic():
+            balance = User.objects.select_for_update().values_list('balance', flat=True).get(id=account_id)
+            snapshot = BalanceSnapshot.objects.filter(account_id=account_id).order_by('-last_transaction').first()
+            entries = Transaction.objects.filter(account_id=account_id)
+            if snapshot is not None:
+                entries = entries.filter(id__gt=snapshot.last_transaction_id)
+            ledger_balance = (snapshot.balance if snapshot else 0) + (entries.aggregate(total=Sum('amount'))['total'] or 0)
+        return {'account_id': account_id, 'balance': balance, 'ledger_balance': ledger_balance,
+                'consistent': balance == ledger_balance}
+
+
+ledger_service = LedgerService()
@@ -0,0 +1,230 @@
+import functools
+import importlib
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+
+# Upper bounds in seconds, from a cached parse to a slow completion
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(f"{self.name}_total{_labels(self.labelnames, labels)}", value)
+                    for labels, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Bucketed observations per label combination, rendered as cumulative buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [per bucket counts (last is +Inf), sum]
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> list:
+        samples = []
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                samples.append((f"{self.name}_bucket{_labels(self.labelnames, labels, le)}", cumulative))
+            samples.append((f"{self.name}_sum{_labels(self.labelnames, labels)}", total))
+            samples.append((f"{self.name}_count{_labels(self.labelnames, labels)}", cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics rendered in the Prometheus text format. Besides
+    its own counters and histograms it exports the stats() of the services
+    through collectors, read only when the metrics are scraped. Every
+    worker process has its own registry, so scrape each worker.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []  # (prefix, stats function, counter keys)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, prefix: str, stats, counters: tuple = ()):
+        """
+        Export the numbers of stats(), a dict or None when there is nothing
+        to report yet, as <prefix>_<key> gauges, or counters for the keys in
+        counters. Nested dicts become one series per key.
+        """
+        self._collectors.append((prefix, stats, frozenset(counters)))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{sample} {_number(value)}" for sample, value in metric.samples())
+        for prefix, stats, counters in self._collectors:
+            values = stats()
+            for key, value in sorted((values or {}).items()):
+                counter = key in counters
+                name = f"{prefix}_{key}"
+                if isinstance(value, dict):
+                    series = [(f'{{key="{_escape(label)}"}}', number) for label, number in sorted(value.items())]
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    series = [('', value)]
+                else:
+                    continue
+                lines.append(f"# TYPE {name} {'counter' if counter else 'gauge'}")
+                suffix = '_total' if counter else ''
+                lines.extend(f"{name}{suffix}{labels} {_number(number)}" for labels, number in series)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+spans = registry.histogram('span_seconds', "Duration of instrumented operations", ('span',))
+tokens = registry.counter('openai_tokens', "Tokens reported by the OpenAI API", ('model', 'kind'))
+errors = registry.counter('errors', "Failures on the chat path", ('source',))
+retrievals = registry.counter('rag_retrievals', "Context retrievals by RAG_RETRIEVAL_MODE path taken", ('mode',))
+loop_lag = registry.histogram('event_loop_lag_seconds', "How late the event loop ran a timer (LOOP_LAG_THRESHOLD)")
+
+
+def observe(name: str, seconds: float):
+    """Record a span timed elsewhere, e.g. a StageTimings stage"""
+    if settings.METRICS_ENABLED:
+        spans.observe(seconds, name)
+
+
+class span:
+    """
+    Time the block into span_seconds{span=name}. A plain class rather than
+    a @contextmanager generator, which costs several times more per use.
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+def timed(name: str):
+    """Decorator timing every call of a function or coroutine function as a span"""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_usage(model: str, response):
+    """Add the token usage of an OpenAI response or stream chunk, when it has one, to openai_tokens"""
+    usage = getattr(response, 'usage', None)
+    if usage is None or not settings.METRICS_ENABLED:
+        return
+    for kind in ('prompt', 'completion'):
+        count = getattr(usage, f'{kind}_tokens', None)
+        if isinstance(count, int) and count:
+            tokens.inc(count, model, kind)
+
+
+def _service_stats(module: str, attribute: str):
+    """stats() of a lazily created service singleton, None until it exists"""
+    def stats():
+        service = getattr(importlib.import_module(f'api.services.{module}'), attribute)
+        return service.stats() if service is not None else None
+    return stats
+
+
+registry.collector('chat_queue', _service_stats('turn_queue', 'queue_metrics'),
+                   counters=('queued', 'dropped', 'rejected', 'coalesced'))
+registry.collector('openai_scheduler', _service_stats('scheduler', '_scheduler'),
+                   counters=('completed', 'retries', 'failures'))
+registry.collector('openai_pool', _service_stats('clients', 'openai_clients'))
+registry.collector('embedding_cache', _service_stats('embedding_cache', '_embedding_cache'),
+                   counters=('hits_local', 'hits_redis', 'misses', 'redis_errors'))
+registry.collector('response_cache', _service_stats('response_cache', '_response_cache'),
+                   counters=('hits', 'misses', 'stores', 'evictions', 'invalidations'))
+registry.collector('fast_path', _service_stats('intent_parser', 'intent_parser'),
+                   counters=('attempts', 'matches', 'by_action'))
+registry.collector('account_events', _service_stats('account_events', '_account_events'),
+                   counters=('published', 'received', 'publish_errors'))
+registry.collector('event_loop', _service_stats('profiler', '_loop_monitor'), counters=('stalls',))
@@ -1,13 +1,27 @@
-from openai import AsyncOpenAI
 from django.conf import settings
+import asyncio
 import json
+import logging
 from .rag_service import RAGService
+from .clients import get_openai_client
+from .streaming import IncrementalResponseParser
+from .intent_parser import intent_parser
+from .history_service import SUMMARY_PREFIX, count_message_tokens
+from .scheduler import get_scheduler, BULK, INTERACTIVE
+from .response_cache import get_response_cache
+from .timing import StageTimings
+from . import metrics
 
-SYSTEM_PROMPT = """You are a customer support agent of a Bank in Greece. Your role is to process user requests and extract relevant information.
+logger = logging.getLogger(__name__)
 
-Here is some relevant context that might help answer the user's question:
-{context}
+CHAT_MODEL = "gpt-4o-mini"
+CHAT_MAX_TOKENS = 1500
 
+SUMMARY_PROMPT = """Summarize the conversation between a bank customer and the support agent below in at most {max_words} words.
+Keep the customer's name, IBANs, amounts and the outcome of every banking operation. Reply with the summary only."""
+
+SYSTEM_PROMPT = """You are a customer support agent of a Bank in Greece. Your role is to process user requests and extract relevant information.
+{context}
 RESPONSE TYPES:
 1. For banking operations, you MUST return a JSON response with the following schema:
 {{
@@ -52,44 +66,195 @@ RULES:
 - If the user's question is general and can be answered using the context, use the general_inquiry response type
 - If unsure about the action type, use general_inquiry and provide a helpful response"""
 
+# Inserted into SYSTEM_PROMPT only when retrieval found something relevant
+CONTEXT_PROMPT = """
+Here is some relevant context that might help answer the user's question:
+{context}
+"""
+
+def system_prompt(context: str) -> str:
+    """SYSTEM_PROMPT with the retrieved context, or without the context section when there is none"""
+    return SYSTEM_PROMPT.format(context=CONTEXT_PROMPT.format(context=context) if context else '')
+
 class OpenAIService:
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
         self.rag_service = RAGService()
+        self.response_cache = get_response_cache() if settings.RESPONSE_CACHE_ENABLED else None
 
-    async def process_message(self, message: str, message_history: list = None) -> dict:
-        # Get relevant context from RAG service
-        context = await self.rag_service.get_relevant_context(message)
-        # Ensure context is a string, use empty string if None
-        context = context if context is not None else ""
+    @property
+    def client(self):
+        """Shared client of the running event loop"""
+        return get_openai_client()
+
+    @staticmethod
+    def _request_tokens(messages: list, max_tokens: int) -> int:
+        """Tokens a completion counts against the rate limit: prompt plus max_tokens"""
+        return sum(count_message_tokens(msg) for msg in messages) + max_tokens
+
+    async def summarize_history(self, previous_summary: str, messages: list) -> str:
+        """Fold older chat turns, and any earlier summary, into a short summary"""
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPT.format(max_words=settings.CHAT_HISTORY_SUMMARY_MAX_WORDS)},
+            {"role": "user", "content": transcript}
+        ]
+        max_tokens = settings.CHAT_HISTORY_SUMMARY_MAX_WORDS * 2
+        # Summaries aren't awaited by the user, let chat replies go first
+        response = await get_scheduler().run(
+            lambda: self.client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=messages,
+                temperature=0,
+                max_tokens=max_tokens
+            ),
+            priority=BULK,
+            tokens=self._request_tokens(messages, max_tokens)
+        )
+        metrics.count_usage(CHAT_MODEL, response)
+        return response.choices[0].message.content.strip()
+
+    async def _stream_completion(self, messages: list, on_delta) -> str:
+        """
+        Stream a completion, passing general inquiry response text to
+        on_delta as it arrives. Returns the complete message content.
+        """
+        parser = IncrementalResponseParser()
+        sent = False
+        stream = await self.client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=0,
+            max_tokens=CHAT_MAX_TOKENS,
+            stream=True,
+            # The last chunk then carries the token usage, without choices
+            stream_options={'include_usage': True}
+        )
         try:
-            # Initialize messages array
-            messages = []
-            
-            # Add message history if provided, otherwise add system prompt
-            if message_history:
-                # Only add system prompt if it's not already in history
-                if not any(msg.get('role') == 'system' for msg in message_history):
-                    messages.append({"role": "system", "content": SYSTEM_PROMPT.format(context=context)})
-                messages.extend(message_history)
-            else:
-                messages.append({"role": "system", "content": SYSTEM_PROMPT.format(context=context)})
-            
+            async for chunk in stream:
+                metrics.count_usage(CHAT_MODEL, chunk)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                delta = parser.feed(chunk.choices[0].delta.content)
+                if delta:
+                    await on_delta(delta)
+                    sent = True
+        except Exception as e:
+            if sent:
+                # Text already reached the client, a retry would repeat it
+                raise RuntimeError(f"Stream interrupted: {str(e)}") from e
+            raise
+        return parser.buffer
+
+    @staticmethod
+    def _cache_scope(message_history: list, session: str = None):
+        """
+        Response cache scope of a turn: '' when the history holds nothing the
+        user said, so the answer can't carry their details and any session may
+        reuse it, else the session, or None to skip the cache without one
+        """
+        personal = any(
+            msg.get('role') == 'user' or (msg.get('content') or '').startswith(SUMMARY_PREFIX)
+            for msg in message_history
+        )
+        return session if personal else ''
+
+    async def process_message(self, message: str, message_history: list = None, on_delta=None,
+                              timings: StageTimings = None, session: str = None) -> dict:
+        """
+        Run a user message through retrieval and the chat model.
+        When on_delta is given the completion is streamed and the text of a
+        general inquiry answer is passed to it as it is generated; banking
+        operations are still only returned once the JSON object is complete.
+        Stage durations are recorded on timings when given. session
+        identifies the conversation for the response cache.
+        """
+        timings = timings or StageTimings()
+
+        # Simple commands are parsed locally, skipping the embedding and LLM calls
+        if settings.FAST_PATH_ENABLED:
+            with timings.stage('fast_path'):
+                fast_path_response = intent_parser.parse(message)
+            if fast_path_response is not None:
+                return {
+                    'status': 'success',
+                    'processed_message': fast_path_response,
+                    'original_message': message
+                }
+
+        # Get relevant context from RAG service, building the rest of the
+        # prompt while the embedding request is in flight
+        retrieval = asyncio.create_task(timings.timed('retrieval', self.rag_service.retrieve_context(message)))
+        await asyncio.sleep(0)
+        with timings.stage('prompt'):
+            history_messages = list(message_history or [])
+            # Only add system prompt if it's not already in history
+            needs_system_prompt = not any(msg.get('role') == 'system' for msg in history_messages)
             # Add current message
-            messages.append({
+            history_messages.append({
                 "role": "user",
                 "content": message
             })
+            history_tokens = self._request_tokens(history_messages, CHAT_MAX_TOKENS)
+
+        try:
+            query_embedding, context, document_ids = await retrieval
+        except Exception as e:
+            logger.warning("Retrieval failed: %s", e)
+            metrics.errors.inc(1, 'retrieval')
+            return {
+                'status': 'error',
+                'error': f"OpenAI API error: {str(e)}",
+                'original_message': message
+            }
+        # Ensure context is a string, use empty string if None
+        context = context if context is not None else ""
+
+        # Near-duplicate questions over the same context reuse an earlier answer;
+        # lexical retrieval leaves no embedding to compare
+        cache_scope = self._cache_scope(message_history or [], session)
+        use_cache = self.response_cache is not None and query_embedding is not None and cache_scope is not None
+        if use_cache:
+            cached_response = self.response_cache.get(query_embedding, context, cache_scope)
+            if cached_response is not None:
+                return {
+                    'status': 'success',
+                    'processed_message': cached_response,
+                    'original_message': message
+                }
+        try:
+            messages = history_messages
+            tokens = history_tokens
+            if needs_system_prompt:
+                system_message = {"role": "system", "content": system_prompt(context)}
+                messages.insert(0, system_message)
+                tokens += count_message_tokens(system_message)
             
             try:
-                response = await self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages,
-                    temperature=0,
-                    max_tokens=1500
-                )
+                with timings.stage('completion'):
+                    if on_delta is not None:
+                        content = await get_scheduler().run(
+                            lambda: self._stream_completion(messages, on_delta),
+                            priority=INTERACTIVE,
+                            tokens=tokens
+                        )
+                    else:
+                        response = await get_scheduler().run(
+                            lambda: self.client.chat.completions.create(
+                                model=CHAT_MODEL,
+                                messages=messages,
+                                temperature=0,
+                                max_tokens=CHAT_MAX_TOKENS
+                            ),
+                            priority=INTERACTIVE,
+                            tokens=tokens
+                        )
+                        metrics.count_usage(CHAT_MODEL, response)
+                        content = response.choices[0].message.content
             except Exception as e:
-                print(f"OpenAI API error: {str(e)}")
+                logger.warning("OpenAI API error: %s", e)
+                metrics.errors.inc(1, 'completion')
                 return {
                     'status': 'error',
                     'error': f"OpenAI API error: {str(e)}",
@@ -97,20 +262,26 @@ class OpenAIService:
                 }
             
             try:
-                processed_response = response.choices[0].message.content
                 # Parse the JSON response
-                processed_response = json.loads(processed_response)
+                with timings.stage('parse'):
+                    processed_response = json.loads(content)
             except json.JSONDecodeError:
                 # Log error without printing the context
-                print("Failed to parse JSON response")
+                logger.warning("Failed to parse JSON response")
+                metrics.errors.inc(1, 'parse')
                 processed_response = {"type": "general_inquiry", "response": "I apologize, but I couldn't process your request properly. Could you please rephrase it?"}
             except Exception as e:
-                print(f"Error processing response: {str(e)}")
+                logger.warning("Error processing response: %s", e)
+                metrics.errors.inc(1, 'parse')
                 return {
                     'status': 'error',
                     'error': f"Error processing response: {str(e)}",
                     'original_message': message
                 }
+            else:
+                # Only general inquiries are stored, banking operations are skipped
+                if use_cache:
+                    self.response_cache.set(query_embedding, context, processed_response, document_ids, cache_scope)
             
             return {
                 'status': 'success',
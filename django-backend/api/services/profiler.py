@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(code) -> str:
+    # Function and its first line, so samples anywhere in it add up
+    path = code.co_filename.split(os.sep)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for a live process: a background thread reads the
+    stack of every other thread each interval seconds and counts identical
+    stacks. Nothing is traced, so the profiled code runs at full speed; the
+    cost is the sampling thread holding the GIL briefly each interval.
+    The result is in the collapsed format of flamegraph.pl and speedscope:
+    one "thread;outer;...;inner count" line per distinct stack.
+    """
+
+    _lock = threading.Lock()  # one profile per process at a time
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = {}
+        self._labels = {}  # code object -> label
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running in this process")
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks"""
+        self._stop.set()
+        self._thread.join()
+        self._lock.release()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _frame_label(code)
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stack = ';'.join(reversed(labels))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+
+async def profile(seconds: float, interval: float = 0.01) -> tuple:
+    """Sample the process for seconds without blocking the event loop; returns (collapsed stacks, samples)"""
+    profiler = SamplingProfiler(interval).start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stacks = profiler.stop()
+    return stacks, profiler.samples
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping interval
+    seconds into the event_loop_lag_seconds histogram. A watchdog thread
+    notices when the loop hasn't woken it for threshold seconds and logs
+    the loop thread's stack at that moment, which names the coroutine or
+    the synchronous call blocking it.
+    """
+
+    def __init__(self, threshold: float, interval: float = None):
+        self.threshold = threshold
+        self.interval = interval or min(threshold / 2, 0.1)
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._loop = None
+        self._loop_thread = None
+        self._heartbeat = 0.0
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start watching the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = self._loop.create_task(self._tick())
+        threading.Thread(target=self._watch, name='loop-lag-watchdog', daemon=True).start()
+        return self
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            metrics.loop_lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 4):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            # Once per stall, while it is still going on
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            logger.warning(
+                "Event loop blocked for %.0fms so far%s:\n%s",
+                blocked * 1000,
+                f" in task {task.get_name()} ({task.get_coro().__qualname__})" if task is not None else '',
+                ''.join(traceback.format_list(self._running_stack(frame, task))).rstrip()
+            )
+
+    @staticmethod
+    def _running_stack(frame, task) -> traceback.StackSummary:
+        """The stack from the running task's coroutine, or the event loop callback, inward"""
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        code = getattr(task.get_coro(), 'cr_code', None) if task is not None else None
+        for position, outer in enumerate(frames):
+            if code is not None and outer.f_code is code:
+                frames = frames[position:]
+                break
+            # Not in a task: start at the callback asyncio's Handle._run called
+            if code is None and outer.f_code.co_name == '_run' and \
+                    outer.f_code.co_filename.endswith(f'asyncio{os.sep}events.py'):
+                frames = frames[position + 1:]
+                break
+        return traceback.StackSummary.extract((frame, frame.f_lineno) for frame in frames)
+
+    def stats(self) -> dict:
+        return {'threshold': self.threshold, 'stalls': self.stalls, 'max_lag': self.max_lag}
+
+
+_loop_monitor = None
+
+
+async def start_loop_monitor(threshold: float):
+    """Watch the running loop of this worker, threshold seconds of lag and up are logged"""
+    global _loop_monitor
+    if _loop_monitor is None and threshold > 0:
+        _loop_monitor = LoopLagMonitor(threshold).start()
+
+
+async def stop_loop_monitor():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        await _loop_monitor.stop()
+        _loop_monitor = None
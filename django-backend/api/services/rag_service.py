@@ -1,47 +1,185 @@
-from openai import AsyncOpenAI
 from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+import asyncio
 import numpy as np
 from api.models import Document
+from api.services.retrievers import get_lexical_index, get_retriever, reciprocal_rank_fusion
+from api.services.embedding_cache import get_embedding_cache
+from api.services.clients import get_openai_client
+from api.services.history_service import count_tokens
+from api.services.scheduler import get_scheduler, BULK, INTERACTIVE
+from api.services import metrics
 from channels.db import database_sync_to_async
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Inputs per embeddings request allowed by the API
+EMBEDDING_API_MAX_INPUTS = 2048
+
+# Preferred split points, from strongest to weakest
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# Separator between chunks in the context text
+CONTEXT_SEPARATOR = "\n\n"
+# Candidates fetched per requested chunk, for MMR to choose from
+MMR_CANDIDATES = 3
+# Chunks this similar to an already picked one are overlapping duplicates
+DUPLICATE_SIMILARITY = 0.95
+
+def chunk_text(text: str, chunk_size: int, chunk_overlap: int = 0) -> list:
+    """
+    Split text into chunks of at most chunk_size characters.
+    Chunks end on the strongest separator found in their second half and
+    consecutive chunks share up to chunk_overlap characters.
+    """
+    text = text.strip()
+    if len(text) <= chunk_size:
+        return [text] if text else []
+    chunk_overlap = min(chunk_overlap, chunk_size // 2)
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            for separator in CHUNK_SEPARATORS:
+                split = text.rfind(separator, start + chunk_size // 2, end)
+                if split != -1:
+                    end = split + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        next_start = end - chunk_overlap
+        if chunk_overlap:
+            # Start the overlap on a word boundary
+            space = text.find(" ", next_start, end)
+            next_start = space + 1 if space != -1 else next_start
+        start = max(next_start, start + 1)
+    return chunks
+
+def select_chunks(candidates: list, top_k: int, min_similarity: float, token_budget: int,
+                  mmr_lambda: float) -> list:
+    """
+    Pick the documents to use as context from (document, similarity)
+    candidates, best first.
+    Candidates below min_similarity are dropped. The rest are chosen by
+    maximal marginal relevance, so a chunk repeating one already picked
+    loses to a slightly less similar one adding something new. A chunk
+    that would overflow token_budget is skipped in favour of smaller ones.
+    """
+    candidates = [(document, score) for document, score in candidates if score >= min_similarity]
+    if not candidates or top_k <= 0:
+        return []
+    vectors = np.array([document.vector for document, _ in candidates], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms, norms, 1.0)
+    scores = np.array([score for _, score in candidates], dtype=np.float32)
+    # Highest similarity of every candidate to the chunks picked so far
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+
+    selected, remaining = [], token_budget
+    while available.any() and len(selected) < top_k:
+        mmr = mmr_lambda * scores - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(np.where(available, mmr, -np.inf)))
+        available[best] = False
+        document = candidates[best][0]
+        tokens = count_tokens(document.content)
+        if tokens > remaining:
+            continue
+        selected.append(document)
+        remaining -= tokens
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        available &= redundancy < DUPLICATE_SIMILARITY
+    return selected
+
 class RAGService:
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.embedding_cache = get_embedding_cache()
+
+    @property
+    def client(self):
+        """Shared client of the running event loop"""
+        return get_openai_client()
     
-    async def create_embedding(self, text: str) -> list:
+    async def create_embedding(self, text: str, use_cache: bool = True) -> list:
         """Create an embedding vector for the given text"""
-        response = await self.client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
+        if use_cache:
+            cached = await self.embedding_cache.get(text, EMBEDDING_MODEL)
+            if cached is not None:
+                return cached
+
+        with metrics.span('embedding'):
+            response = await get_scheduler().run(
+                lambda: self.client.embeddings.create(model=EMBEDDING_MODEL, input=text),
+                priority=INTERACTIVE,
+                tokens=count_tokens(text)
+            )
+        metrics.count_usage(EMBEDDING_MODEL, response)
+        embedding = response.data[0].embedding
+        if use_cache:
+            await self.embedding_cache.set(text, EMBEDDING_MODEL, embedding)
+        return embedding
     
     @database_sync_to_async
     def store_document(self, content: str, embedding: list) -> Document:
         """Store a document and its embedding"""
         return Document.objects.create(
             content=content,
-            embedding=embedding
+            embedding=Document.encode_embedding(embedding)
         )
     
+    async def create_embeddings(self, texts: list, priority: int = BULK) -> list:
+        """Create embeddings for a batch of texts in a single API call"""
+        with metrics.span('embedding_batch'):
+            response = await get_scheduler().run(
+                lambda: self.client.embeddings.create(model=EMBEDDING_MODEL, input=texts),
+                priority=priority,
+                tokens=sum(count_tokens(text) for text in texts)
+            )
+        metrics.count_usage(EMBEDDING_MODEL, response)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
     @database_sync_to_async
+    def store_documents(self, rows: list) -> list:
+        """Store (content, embedding) pairs with a single bulk insert"""
+        with transaction.atomic():
+            documents = Document.objects.bulk_create(
+                [Document(content=content, embedding=Document.encode_embedding(embedding)) for content, embedding in rows],
+                batch_size=500
+            )
+            # bulk_create skips post_save; send it so the indexes see the rows
+            # without waiting for their next sync check
+            for document in documents:
+                post_save.send(sender=Document, instance=document, created=True)
+            return documents
+    
+    @database_sync_to_async
+    @metrics.timed('get_similar_documents')
     def get_similar_documents(self, query_embedding: list, num_results: int = 1) -> list:
-        """Find most similar documents using cosine similarity"""
-        documents = Document.objects.all()
-        if not documents:
+        """Find the (document, similarity) pairs most similar to the query using the configured retriever backend"""
+        retriever = get_retriever()
+        retriever.sync(max_age=settings.RAG_INDEX_SYNC_INTERVAL)
+        return self._load_matches(retriever.search(query_embedding, num_results))
+    
+    @database_sync_to_async
+    @metrics.timed('get_lexical_matches')
+    def get_lexical_matches(self, query: str, num_results: int = 1) -> list:
+        """Find the (document, normalized BM25 score) pairs matching the query text best"""
+        index = get_lexical_index()
+        index.sync(max_age=settings.RAG_INDEX_SYNC_INTERVAL)
+        return self._load_matches(index.search(query, num_results))
+    
+    @staticmethod
+    def _load_matches(matches: list) -> list:
+        if not matches:
             return []
-        
-        # Calculate cosine similarity for each document
-        similarities = []
-        for doc in documents:
-            if doc.embedding:
-                similarity = self._cosine_similarity(query_embedding, doc.embedding)
-                similarities.append((similarity, doc))
-        
-        # Sort by similarity and return top result
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        # Only return the single most relevant document
-        return [doc for _, doc in similarities[:num_results]]
+        documents = Document.objects.in_bulk([doc_id for doc_id, _ in matches])
+        # Keep the ranking order, skipping rows deleted since the search
+        return [(documents[doc_id], score) for doc_id, score in matches if doc_id in documents]
     
     def _cosine_similarity(self, vec1: list, vec2: list) -> float:
         """Calculate cosine similarity between two vectors"""
@@ -51,13 +189,130 @@ class RAGService:
     
     async def add_document(self, content: str) -> Document:
         """Add a new document with its embedding"""
-        embedding = await self.create_embedding(content)
+        # Document bodies are embedded once, keep them out of the query cache
+        embedding = await self.create_embedding(content, use_cache=False)
         return await self.store_document(content, embedding)
     
+    def _embedding_batches(self, texts: list) -> list:
+        """Group text positions into batches within the API input limits"""
+        max_inputs = min(settings.EMBEDDING_BATCH_SIZE, EMBEDDING_API_MAX_INPUTS)
+        # Rough 4 characters per token estimate
+        max_chars = settings.EMBEDDING_BATCH_MAX_TOKENS * 4
+        batches, batch, batch_chars = [], [], 0
+        for position, text in enumerate(texts):
+            if batch and (len(batch) >= max_inputs or batch_chars + len(text) > max_chars):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(position)
+            batch_chars += len(text)
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    async def add_documents(self, contents: list, chunk_size: int = None, chunk_overlap: int = None) -> list:
+        """
+        Chunk, embed and store many documents.
+        Embedding requests are batched and run with bounded concurrency.
+        Returns one result dict per input, in input order.
+        """
+        chunk_size = chunk_size or settings.RAG_CHUNK_SIZE
+        chunk_overlap = settings.RAG_CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+
+        results = [{'index': index, 'status': 'success', 'document_ids': []} for index in range(len(contents))]
+        owners, texts = [], []  # input index and text of every chunk
+        for index, content in enumerate(contents):
+            pieces = chunk_text(content, chunk_size, chunk_overlap)
+            if not pieces:
+                results[index].update(status='error', error='Content is required')
+            owners.extend([index] * len(pieces))
+            texts.extend(pieces)
+
+        semaphore = asyncio.Semaphore(settings.EMBEDDING_BATCH_CONCURRENCY)
+        embeddings = [None] * len(texts)
+
+        async def embed(batch):
+            async with semaphore:
+                try:
+                    vectors = await self.create_embeddings([texts[position] for position in batch])
+                except Exception as e:
+                    for position in batch:
+                        results[owners[position]].update(status='error', error=f'Embedding failed: {str(e)}')
+                    return
+            for position, vector in zip(batch, vectors):
+                embeddings[position] = vector
+
+        await asyncio.gather(*(embed(batch) for batch in self._embedding_batches(texts)))
+
+        # Only store items whose chunks were all embedded
+        positions = [position for position in range(len(texts)) if results[owners[position]]['status'] == 'success']
+        try:
+            documents = await self.store_documents([(texts[position], embeddings[position]) for position in positions])
+        except Exception as e:
+            for position in positions:
+                results[owners[position]].update(status='error', error=f'Failed to store document: {str(e)}')
+            return results
+        for position, document in zip(positions, documents):
+            results[owners[position]]['document_ids'].append(document.id)
+        return results
+    
+    async def retrieve_context(self, query: str) -> tuple:
+        """
+        Return the query embedding, the context text and the ids of the documents it came from.
+        The context is empty when no document is similar enough to the query, and the
+        embedding is None when a BM25 match answered the query without one (RAG_RETRIEVAL_MODE).
+        """
+        mode = settings.RAG_RETRIEVAL_MODE
+        num_candidates = settings.RAG_TOP_K * MMR_CANDIDATES
+        query_embedding, lexical = None, []
+        if mode != 'vector':
+            lexical = await self.get_lexical_matches(query, num_candidates)
+        confident = bool(lexical) and 0 < settings.RAG_LEXICAL_CONFIDENCE <= lexical[0][1]
+        if mode == 'lexical' or confident:
+            # BM25 scores, not cosine similarities
+            candidates, min_similarity = lexical, settings.RAG_LEXICAL_MIN_SCORE
+            metrics.retrievals.inc(1, 'lexical')
+        else:
+            min_similarity = settings.RAG_MIN_SIMILARITY
+            query_embedding = await self.create_embedding(query)
+            candidates = await self.get_similar_documents(query_embedding, num_candidates)
+            if lexical:
+                candidates = self._fuse(query_embedding, candidates, lexical)
+                # _fuse applied the threshold to the cosine similarities
+                min_similarity = 0.0
+            metrics.retrievals.inc(1, 'hybrid' if lexical else 'vector')
+
+        documents = select_chunks(
+            candidates,
+            top_k=settings.RAG_TOP_K,
+            min_similarity=min_similarity,
+            token_budget=settings.RAG_CONTEXT_TOKEN_BUDGET,
+            mmr_lambda=settings.RAG_MMR_LAMBDA
+        )
+        context = CONTEXT_SEPARATOR.join(doc.content for doc in documents)
+        return query_embedding, context, [doc.id for doc in documents]
+    
+    def _fuse(self, query_embedding: list, vector_matches: list, lexical_matches: list) -> list:
+        """
+        Rank vector and BM25 candidates together by reciprocal rank fusion.
+        Candidates still have to clear RAG_MIN_SIMILARITY by cosine similarity;
+        their score becomes the fused one relative to a document both rank first.
+        """
+        documents = {doc.id: doc for doc, _ in vector_matches + lexical_matches}
+        similarities = {doc.id: score for doc, score in vector_matches}
+        for doc_id, document in documents.items():
+            if doc_id not in similarities:
+                similarities[doc_id] = self._cosine_similarity(query_embedding, document.vector)
+        fused = reciprocal_rank_fusion(
+            [doc.id for doc, _ in vector_matches],
+            [doc.id for doc, _ in lexical_matches],
+            k=settings.RAG_RRF_K
+        )
+        best = 2.0 / (settings.RAG_RRF_K + 1)
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+        return [(documents[doc_id], score / best) for doc_id, score in ranked
+                if similarities[doc_id] >= settings.RAG_MIN_SIMILARITY]
+    
     async def get_relevant_context(self, query: str) -> str:
         """Get relevant context for a query"""
-        query_embedding = await self.create_embedding(query)
-        similar_docs = await self.get_similar_documents(query_embedding)
-        # Only use the most relevant document
-        context = similar_docs[0].content if similar_docs else ""
+        _, context, _ = await self.retrieve_context(query)
         return context
@@ -0,0 +1,144 @@
+import base64
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import httpx
+
+# Dict an evaluation case sets to collect the token usage of its requests,
+# see UsageTransport; requests made outside such a context are not counted
+usage = contextvars.ContextVar('openai_usage', default=None)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that stores OpenAI exchanges in a JSON file and answers
+    repeated requests from it. Requests match on method, path and body, so
+    a run is only replayed if it sends the same requests as the recorded
+    one. paths limits recording to endpoints ending in one of them, e.g.
+    ('/embeddings',) to keep an embedding cache on disk; anything else is
+    passed through. With offline=True nothing reaches the network and a
+    request without a recording fails.
+    """
+
+    def __init__(self, path: str, transport: httpx.AsyncBaseTransport = None, paths: tuple = None,
+                 offline: bool = False, fresh: bool = False):
+        self.path = path
+        self.transport = transport
+        self.paths = tuple(paths) if paths else None
+        self.offline = offline
+        self.exchanges = {} if fresh else self._load(path)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def key(request: httpx.Request) -> str:
+        return f"{request.method} {request.url.path} {hashlib.sha256(request.content).hexdigest()}"
+
+    def _records(self, request: httpx.Request) -> bool:
+        return self.paths is None or request.url.path.endswith(self.paths)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not self._records(request):
+            if self.offline or self.transport is None:
+                raise httpx.ConnectError(f"Offline, not sending {request.method} {request.url.path}", request=request)
+            return await self.transport.handle_async_request(request)
+
+        await request.aread()
+        key = self.key(request)
+        exchange = self.exchanges.get(key)
+        replayed = exchange is not None
+        if replayed:
+            self.hits += 1
+        else:
+            if self.offline or self.transport is None:
+                raise httpx.ConnectError(f"No recorded response for {request.method} {request.url.path}",
+                                         request=request)
+            self.misses += 1
+            response = await self.transport.handle_async_request(request)
+            try:
+                # Raw bytes, read off the stream itself since a response from
+                # another RecordingTransport is already marked as read;
+                # httpx decodes them when the client reads the new response
+                raw = b''.join([chunk async for chunk in response.stream])
+            finally:
+                await response.aclose()
+            replayed = response.extensions.get('replayed', False)
+            exchange = {
+                'status': response.status_code,
+                'headers': [[name, value] for name, value in response.headers.multi_items()
+                            if name.lower() not in ('content-length', 'transfer-encoding')],
+                'body': base64.b64encode(raw).decode(),
+            }
+            # Errors such as 429s are worth retrying on the next run, not replaying
+            if response.status_code < 400:
+                with self._lock:
+                    self.exchanges[key] = exchange
+                    self._dirty = True
+
+        return httpx.Response(exchange['status'], headers=exchange['headers'],
+                              content=base64.b64decode(exchange['body']),
+                              request=request, extensions={'replayed': replayed})
+
+    def save(self):
+        """Write new exchanges back to the file"""
+        if not self._dirty or not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.exchanges)
+            self._dirty = False
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(data)
+        os.replace(temporary, self.path)
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+
+
+class UsageTransport(httpx.AsyncBaseTransport):
+    """
+    Outermost transport adding the token usage OpenAI reports to the dict
+    in the usage context variable, per endpoint. Responses answered from a
+    recording are counted as replayed.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        totals = usage.get()
+        # Streamed completions don't report usage; leave them unread
+        if totals is None or response.status_code >= 400 \
+                or not response.headers.get('content-type', '').startswith('application/json'):
+            return response
+        await response.aread()
+        try:
+            reported = response.json().get('usage') or {}
+        except ValueError:
+            reported = {}
+        endpoint = request.url.path.rstrip('/').rsplit('/', 1)[-1]
+        bucket = totals.setdefault(endpoint, {'requests': 0, 'replayed': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+        bucket['requests'] += 1
+        bucket['replayed'] += int(response.extensions.get('replayed', False))
+        bucket['prompt_tokens'] += reported.get('prompt_tokens', 0)
+        bucket['completion_tokens'] += reported.get('completion_tokens', 0)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,135 @@
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+
+
+class ResponseCache:
+    """
+    Semantic cache of general inquiry answers.
+    A response is reused when a new query's embedding has cosine similarity
+    of at least threshold to a cached query and the retrieved context is
+    identical, so an edited or different context document never serves a
+    stale answer. Entries expire after ttl seconds and the least recently
+    used entry is evicted beyond max_size. Only general_inquiry responses
+    are stored; banking operations always go to the model.
+    An answer can draw on the conversation it was given in, so entries are
+    also keyed by a scope: '' for answers any session may reuse, otherwise
+    the session the answer belongs to.
+    """
+
+    def __init__(self, max_size: int = 512, threshold: float = 0.95, ttl: int = 3600):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries = OrderedDict()  # entry id -> (context key, expires_at, document ids, response)
+        self._buckets = {}  # context key -> {entry id: normalized query vector}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def context_key(context: str, scope: str = '') -> str:
+        return hashlib.sha256(f"{scope}\0{context}".encode()).hexdigest()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        context_key = self._entries.pop(entry_id)[0]
+        bucket = self._buckets[context_key]
+        del bucket[entry_id]
+        if not bucket:
+            del self._buckets[context_key]
+
+    def get(self, query_embedding, context: str, scope: str = ''):
+        """Cached response for a similar query with the same context and scope, or None"""
+        query = self._normalize(query_embedding)
+        context_key = self.context_key(context, scope)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(context_key)
+            best_id, best_score = None, self.threshold
+            for entry_id, vector in list((bucket or {}).items()):
+                if self._entries[entry_id][1] < now:
+                    self._remove(entry_id)
+                    continue
+                score = float(vector @ query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][3]
+
+    def set(self, query_embedding, context: str, response: dict, document_ids=(), scope: str = ''):
+        """Store a general inquiry response; anything else is ignored"""
+        if not isinstance(response, dict) or response.get('type') != 'general_inquiry':
+            return
+        context_key = self.context_key(context, scope)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (context_key, time.monotonic() + self.ttl, frozenset(document_ids), response)
+            self._buckets.setdefault(context_key, {})[entry_id] = self._normalize(query_embedding)
+            self.stores += 1
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_document(self, document_id):
+        """Drop every answer that was generated from the given document"""
+        with self._lock:
+            stale = [entry_id for entry_id, entry in self._entries.items() if document_id in entry[2]]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache configured from settings"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_size=settings.RESPONSE_CACHE_SIZE,
+                    threshold=settings.RESPONSE_CACHE_THRESHOLD,
+                    ttl=settings.RESPONSE_CACHE_TTL,
+                )
+    return _response_cache
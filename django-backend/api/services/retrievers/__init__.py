@@ -0,0 +1,52 @@
+import threading
+from django.conf import settings
+from .base import BaseRetriever
+from .brute_force import BruteForceRetriever
+from .ivf import IVFRetriever
+from .hnsw import HNSWRetriever
+from .lexical import BM25Index, reciprocal_rank_fusion
+
+RETRIEVERS = {
+    BruteForceRetriever.kind: BruteForceRetriever,
+    IVFRetriever.kind: IVFRetriever,
+    HNSWRetriever.kind: HNSWRetriever,
+}
+
+_retriever = None
+_lexical_index = None
+_retriever_lock = threading.Lock()
+
+
+def build_retriever(kind: str = None, **options) -> BaseRetriever:
+    """Instantiate a retriever backend, defaulting to the configured one"""
+    kind = kind or settings.RAG_RETRIEVER
+    if kind not in RETRIEVERS:
+        raise ValueError(f"Unknown retriever backend '{kind}'. Choose one of: {', '.join(RETRIEVERS)}")
+    return RETRIEVERS[kind](**{**settings.RAG_RETRIEVER_OPTIONS.get(kind, {}), **options})
+
+
+def get_retriever() -> BaseRetriever:
+    """
+    Process-wide retriever shared by every RAGService.
+    Restores a persisted index from RAG_INDEX_PATH when one matches the
+    configured backend, so workers don't rebuild it at startup.
+    """
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                retriever = build_retriever()
+                if settings.RAG_INDEX_PATH:
+                    retriever.load(settings.RAG_INDEX_PATH)
+                _retriever = retriever
+    return _retriever
+
+
+def get_lexical_index() -> BM25Index:
+    """Process-wide BM25 index over the same documents as get_retriever()"""
+    global _lexical_index
+    if _lexical_index is None:
+        with _retriever_lock:
+            if _lexical_index is None:
+                _lexical_index = BM25Index(k1=settings.RAG_BM25_K1, b=settings.RAG_BM25_B)
+    return _lexical_index
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from django.db.models import Count, Max
+from api.models import Document
+
+
+class BaseRetriever:
+    """
+    Common interface of the vector retrieval backends.
+    Subclasses implement add/remove/search over (document id, embedding)
+    pairs plus their own persistence arrays; this class keeps them in step
+    with the Document table and handles the on-disk format.
+    """
+
+    kind = None
+    # Document field passed to add() when syncing
+    field = 'embedding'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._max_id = 0
+        self._synced_at = None  # time.monotonic() of the last sync
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def doc_ids(self) -> set:
+        """Ids of every document currently in the index"""
+        raise NotImplementedError
+
+    def add(self, doc_id: int, embedding):
+        """Add or replace the embedding of a document"""
+        raise NotImplementedError
+
+    def remove(self, doc_id: int):
+        raise NotImplementedError
+
+    def search(self, query_embedding, k: int = 1) -> list:
+        """
+        Return up to k (document id, cosine similarity) pairs,
+        most similar first
+        """
+        raise NotImplementedError
+
+    def params(self) -> dict:
+        """Tuning parameters, stored alongside the index"""
+        return {}
+
+    def clear(self):
+        with self._lock:
+            self._loaded = False
+            self._max_id = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        if isinstance(vector, (bytes, memoryview)):
+            vector = Document.decode_embedding(vector)
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def sync(self, max_age: float = 0):
+        """
+        Bring the index up to date with the Document table.
+        Loads everything on first use; afterwards a cheap count/max(id)
+        check detects rows written by other workers or by bulk inserts
+        and only the difference is loaded. The check is skipped while the
+        last sync is less than max_age seconds old, relying on the
+        Document signals for this process's own writes meanwhile.
+        """
+        synced_at = self._synced_at
+        if self._loaded and synced_at is not None and time.monotonic() - synced_at < max_age:
+            return
+        stats = Document.objects.filter(embedding__isnull=False).aggregate(count=Count('id'), max_id=Max('id'))
+        with self._lock:
+            self._synced_at = time.monotonic()
+            if self._loaded and stats['count'] == len(self) and (stats['max_id'] or 0) == self._max_id:
+                return
+            if not self._loaded:
+                queryset = Document.objects.filter(embedding__isnull=False)
+            else:
+                db_ids = set(Document.objects.filter(embedding__isnull=False).values_list('id', flat=True))
+                indexed = self.doc_ids()
+                for doc_id in indexed - db_ids:
+                    self.remove(doc_id)
+                queryset = Document.objects.filter(id__in=db_ids - indexed)
+            for doc_id, value in queryset.values_list('id', self.field).iterator():
+                self.add(doc_id, value)
+            self._max_id = stats['max_id'] or 0
+            self._loaded = True
+
+    def prepare(self):
+        """Sync, then finish any work a backend defers to the background, e.g. before save()"""
+        self.sync()
+
+    # Persistence: a single .npz file holding the backend arrays plus a
+    # JSON header with the backend kind and its parameters.
+
+    def _state(self) -> dict:
+        raise NotImplementedError
+
+    def _restore(self, state):
+        raise NotImplementedError
+
+    def save(self, path: str):
+        """Atomically write the index to path"""
+        with self._lock:
+            header = json.dumps({'kind': self.kind, 'params': self.params(), 'max_id': self._max_id})
+            arrays = self._state()
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, header=np.array(header), **arrays)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Restore an index written by save().
+        Returns False, leaving the index untouched, when the file is missing
+        or was built by a different backend or with different parameters.
+        """
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(str(data['header']))
+            if header['kind'] != self.kind or header['params'] != self.params():
+                return False
+            with self._lock:
+                self._restore(data)
+                self._max_id = header['max_id']
+                self._loaded = True
+        return True
@@ -0,0 +1,127 @@
+import numpy as np
+from .base import BaseRetriever
+
+
+class BruteForceRetriever(BaseRetriever):
+    """
+    Exact retrieval.
+    Keeps every embedding in one pre-normalized float32 matrix so a query
+    is scored with a single matrix-vector product.
+    """
+
+    kind = 'brute_force'
+
+    def __init__(self, initial_capacity: int = 64):
+        super().__init__()
+        self._initial_capacity = initial_capacity
+        self._matrix = None  # (capacity, dim) float32, rows [0, size) are live
+        self._ids = np.empty(0, dtype=np.int64)
+        self._positions = {}  # document id -> row in the matrix
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def doc_ids(self) -> set:
+        return set(self._positions)
+
+    def _ensure_capacity(self, dim: int, needed: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, needed)
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            self._ids = np.zeros(capacity, dtype=np.int64)
+            return
+        if self._matrix.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match index dimension {self._matrix.shape[1]}")
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+    def _row_added(self, row: int):
+        """Hook for subclasses keeping per-row data"""
+
+    def _row_moved(self, src: int, dst: int):
+        """Hook for subclasses keeping per-row data"""
+
+    def add(self, doc_id: int, embedding):
+        if embedding is None or len(embedding) == 0:
+            self.remove(doc_id)
+            return
+        vector = self._normalize(embedding)
+        with self._lock:
+            row = self._positions.get(doc_id)
+            if row is None:
+                self._ensure_capacity(vector.shape[0], self._size + 1)
+                row = self._size
+                self._size += 1
+                self._positions[doc_id] = row
+                self._ids[row] = doc_id
+            self._matrix[row] = vector
+            self._row_added(row)
+            self._max_id = max(self._max_id, doc_id)
+
+    def remove(self, doc_id: int):
+        """Remove a document, moving the last row into its slot"""
+        with self._lock:
+            row = self._positions.pop(doc_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                self._positions[moved_id] = row
+                self._row_moved(last, row)
+            self._size = last
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._matrix = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._positions = {}
+            self._size = 0
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first"""
+        k = min(k, scores.shape[0])
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        return top[np.argsort(-scores[top])]
+
+    def search(self, query_embedding, k: int = 1) -> list:
+        query = self._normalize(query_embedding)
+        with self._lock:
+            if not self._size or k <= 0:
+                return []
+            scores = self._matrix[:self._size] @ query
+            ids = self._ids[:self._size].copy()
+        return [(int(ids[i]), float(scores[i])) for i in self._top_k(scores, k)]
+
+    def _state(self) -> dict:
+        if self._matrix is None:
+            return {'ids': np.empty(0, dtype=np.int64), 'vectors': np.empty((0, 0), dtype=np.float32)}
+        return {'ids': self._ids[:self._size].copy(), 'vectors': self._matrix[:self._size].copy()}
+
+    def _restore(self, state):
+        ids, vectors = state['ids'], state['vectors']
+        self._matrix = None
+        self._positions = {}
+        self._size = 0
+        if len(ids):
+            self._ensure_capacity(vectors.shape[1], len(ids))
+            self._matrix[:len(ids)] = vectors
+            self._ids[:len(ids)] = ids
+            self._positions = {int(doc_id): row for row, doc_id in enumerate(ids)}
+            self._size = len(ids)
@@ -0,0 +1,257 @@
+import heapq
+import math
+import random
+import numpy as np
+from .base import BaseRetriever
+
+
+class HNSWRetriever(BaseRetriever):
+    """
+    Hierarchical Navigable Small World graph retrieval.
+    Every embedding is a node linked to its nearest neighbours on one or
+    more layers; a search greedily walks from the top layer down.
+    Deleted documents are tombstoned and skipped; compact() rebuilds the
+    graph once they make up too much of it.
+
+    Knobs: m and ef_construction (build, higher = better graph, slower
+    inserts), ef_search (search, higher = better recall, slower).
+    """
+
+    kind = 'hnsw'
+
+    def __init__(self, m: int = 16, ef_construction: int = 100, ef_search: int = 50,
+                 max_tombstone_ratio: float = 0.2, seed: int = 0, initial_capacity: int = 64):
+        super().__init__()
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.max_tombstone_ratio = max_tombstone_ratio
+        self.seed = seed
+        self._initial_capacity = initial_capacity
+        self._level_mult = 1 / math.log(max(m, 2))
+        self._reset()
+
+    def _reset(self):
+        self._random = random.Random(self.seed)
+        self._vectors = None  # (capacity, dim) float32, one row per node
+        self._node_ids = np.empty(0, dtype=np.int64)  # document id of each node
+        self._nodes = {}  # document id -> live node
+        self._deleted = set()
+        self._graph = []  # per layer: {node: [neighbour nodes]}
+        self._count = 0  # nodes ever inserted, including tombstones
+        self._entry = None
+        self._max_level = -1
+
+    def params(self) -> dict:
+        return {'m': self.m, 'ef_construction': self.ef_construction, 'seed': self.seed}
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def doc_ids(self) -> set:
+        return set(self._nodes)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._reset()
+
+    def _ensure_capacity(self, dim: int):
+        if self._vectors is None:
+            self._vectors = np.zeros((self._initial_capacity, dim), dtype=np.float32)
+            self._node_ids = np.zeros(self._initial_capacity, dtype=np.int64)
+            return
+        if self._vectors.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match index dimension {self._vectors.shape[1]}")
+        capacity = self._vectors.shape[0]
+        if self._count < capacity:
+            return
+        vectors = np.zeros((capacity * 2, dim), dtype=np.float32)
+        vectors[:capacity] = self._vectors
+        node_ids = np.zeros(capacity * 2, dtype=np.int64)
+        node_ids[:capacity] = self._node_ids
+        self._vectors, self._node_ids = vectors, node_ids
+
+    def _max_degree(self, level: int) -> int:
+        return self.m * 2 if level == 0 else self.m
+
+    def _search_layer(self, query: np.ndarray, entry_points: list, ef: int, level: int) -> list:
+        """Best-first search of one layer, returns up to ef (similarity, node) pairs"""
+        visited = set(entry_points)
+        scores = (self._vectors[entry_points] @ query).tolist()
+        candidates = [(-score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [(score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        layer = self._graph[level]
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if -neg_score < results[0][0] and len(results) >= ef:
+                break
+            neighbours = [n for n in layer.get(node, ()) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for score, neighbour in zip((self._vectors[neighbours] @ query).tolist(), neighbours):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbour))
+                    heapq.heappush(results, (score, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return results
+
+    def _select_neighbours(self, candidates: list, m: int) -> list:
+        """
+        Neighbour selection heuristic: prefer candidates closer to the base
+        node than to any already selected neighbour, which keeps links
+        spread out across clusters. Pruned candidates fill remaining slots.
+        """
+        candidates = sorted(candidates, reverse=True)
+        selected, pruned = [], []
+        for score, node in candidates:
+            if len(selected) >= m:
+                break
+            if selected:
+                closest = float(np.max(self._vectors[[n for _, n in selected]] @ self._vectors[node]))
+                if closest > score:
+                    pruned.append((score, node))
+                    continue
+            selected.append((score, node))
+        selected.extend(pruned[:m - len(selected)])
+        return [node for _, node in selected]
+
+    def _insert(self, node: int):
+        vector = self._vectors[node]
+        level = int(-math.log(1 - self._random.random()) * self._level_mult)
+        while len(self._graph) <= level:
+            self._graph.append({})
+        for lc in range(level + 1):
+            self._graph[lc][node] = []
+        if self._entry is None:
+            self._entry, self._max_level = node, level
+            return
+
+        entry_points = [self._entry]
+        for lc in range(self._max_level, level, -1):
+            entry_points = [max(self._search_layer(vector, entry_points, 1, lc))[1]]
+        for lc in range(min(level, self._max_level), -1, -1):
+            found = self._search_layer(vector, entry_points, self.ef_construction, lc)
+            neighbours = self._select_neighbours(found, self.m)
+            self._graph[lc][node] = neighbours
+            max_degree = self._max_degree(lc)
+            for neighbour in neighbours:
+                links = self._graph[lc][neighbour]
+                links.append(node)
+                if len(links) > max_degree:
+                    scores = (self._vectors[links] @ self._vectors[neighbour]).tolist()
+                    self._graph[lc][neighbour] = self._select_neighbours(list(zip(scores, links)), max_degree)
+            entry_points = [n for _, n in found]
+        if level > self._max_level:
+            self._entry, self._max_level = node, level
+
+    def add(self, doc_id: int, embedding):
+        if embedding is None or len(embedding) == 0:
+            self.remove(doc_id)
+            return
+        vector = self._normalize(embedding)
+        with self._lock:
+            old = self._nodes.pop(doc_id, None)
+            if old is not None:
+                self._deleted.add(old)
+            self._ensure_capacity(vector.shape[0])
+            node = self._count
+            self._count += 1
+            self._vectors[node] = vector
+            self._node_ids[node] = doc_id
+            self._insert(node)
+            self._nodes[doc_id] = node
+            self._max_id = max(self._max_id, doc_id)
+            self._maybe_compact()
+
+    def remove(self, doc_id: int):
+        with self._lock:
+            node = self._nodes.pop(doc_id, None)
+            if node is None:
+                return
+            self._deleted.add(node)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._count >= 32 and len(self._deleted) > self._count * self.max_tombstone_ratio:
+            self.compact()
+
+    def compact(self):
+        """Rebuild the graph without tombstoned nodes"""
+        with self._lock:
+            live = [(doc_id, self._vectors[node].copy()) for doc_id, node in self._nodes.items()]
+            loaded, max_id = self._loaded, self._max_id
+            self._reset()
+            for doc_id, vector in live:
+                self._ensure_capacity(vector.shape[0])
+                node = self._count
+                self._count += 1
+                self._vectors[node] = vector
+                self._node_ids[node] = doc_id
+                self._insert(node)
+                self._nodes[doc_id] = node
+            self._loaded, self._max_id = loaded, max_id
+
+    def search(self, query_embedding, k: int = 1) -> list:
+        query = self._normalize(query_embedding)
+        with self._lock:
+            if not self._nodes or k <= 0:
+                return []
+            entry_points = [self._entry]
+            for lc in range(self._max_level, 0, -1):
+                entry_points = [max(self._search_layer(query, entry_points, 1, lc))[1]]
+            # Widen the beam by the tombstones it may have to skip over
+            ef = max(self.ef_search, k) + min(len(self._deleted), k)
+            found = self._search_layer(query, entry_points, ef, 0)
+            found = sorted((item for item in found if item[1] not in self._deleted), reverse=True)[:k]
+            return [(int(self._node_ids[node]), float(score)) for score, node in found]
+
+    def _state(self) -> dict:
+        edges = [
+            (level, node, neighbour)
+            for level, layer in enumerate(self._graph)
+            for node, neighbours in layer.items()
+            for neighbour in neighbours
+        ]
+        nodes_only = [(level, node) for level, layer in enumerate(self._graph) for node in layer]
+        dim = self._vectors.shape[1] if self._vectors is not None else 0
+        return {
+            'vectors': self._vectors[:self._count].copy() if self._vectors is not None else np.empty((0, dim), dtype=np.float32),
+            'node_ids': self._node_ids[:self._count].copy(),
+            'deleted': np.array(sorted(self._deleted), dtype=np.int64),
+            'layers': np.array(nodes_only, dtype=np.int64).reshape(-1, 2),
+            'edges': np.array(edges, dtype=np.int64).reshape(-1, 3),
+            'entry': np.array(-1 if self._entry is None else self._entry),
+            'max_level': np.array(self._max_level),
+        }
+
+    def _restore(self, state):
+        self._reset()
+        vectors, node_ids = state['vectors'], state['node_ids']
+        self._count = len(node_ids)
+        if self._count:
+            self._vectors = np.zeros((max(self._initial_capacity, self._count), vectors.shape[1]), dtype=np.float32)
+            self._vectors[:self._count] = vectors
+            self._node_ids = np.zeros(self._vectors.shape[0], dtype=np.int64)
+            self._node_ids[:self._count] = node_ids
+        self._deleted = set(state['deleted'].tolist())
+        self._nodes = {
+            int(doc_id): node for node, doc_id in enumerate(node_ids.tolist())
+            if node not in self._deleted
+        }
+        self._max_level = int(state['max_level'])
+        self._graph = [{} for _ in range(self._max_level + 1)]
+        for level, node in state['layers'].tolist():
+            self._graph[level][node] = []
+        for level, node, neighbour in state['edges'].tolist():
+            self._graph[level][node].append(neighbour)
+        entry = int(state['entry'])
+        self._entry = None if entry < 0 else entry
+        # Keep level sampling deterministic but distinct after a reload
+        self._random.seed(self.seed + self._count)
@@ -0,0 +1,194 @@
+import logging
+import threading
+import numpy as np
+from .brute_force import BruteForceRetriever
+
+logger = logging.getLogger(__name__)
+
+
+class IVFRetriever(BruteForceRetriever):
+    """
+    Inverted-file approximate retrieval.
+    A spherical k-means coarse quantizer splits the embeddings into nlist
+    cells; a query only scores the rows of its nprobe closest cells.
+    Until there are enough documents to train on, search is exact.
+    Once the index grows past retrain_growth times its trained size, sync()
+    retrains in a background thread; searches use the previous centroids
+    until the new ones are swapped in.
+
+    Knobs: nlist (build), nprobe (search, higher = better recall, slower).
+    """
+
+    kind = 'ivf'
+    assign_chunk_size = 4096
+
+    def __init__(self, nlist: int = 64, nprobe: int = 8, n_iter: int = 10,
+                 min_train_size: int = None, retrain_growth: float = 2.0, seed: int = 0):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.min_train_size = min_train_size or nlist * 8
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self._centroids = None
+        self._labels = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        self._train_lock = threading.Lock()  # one training at a time
+        self._training = None  # background training thread
+        self._touched = None  # ids added while a training runs
+
+    def params(self) -> dict:
+        return {'nlist': self.nlist, 'n_iter': self.n_iter, 'seed': self.seed}
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray = None) -> np.ndarray:
+        centroids = self._centroids if centroids is None else centroids
+        labels = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], self.assign_chunk_size):
+            chunk = vectors[start:start + self.assign_chunk_size]
+            labels[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return labels
+
+    def _row_added(self, row: int):
+        if self._labels.shape[0] < self._matrix.shape[0]:
+            labels = np.zeros(self._matrix.shape[0], dtype=np.int32)
+            labels[:self._labels.shape[0]] = self._labels
+            self._labels = labels
+        if self.is_trained:
+            self._labels[row] = int(np.argmax(self._centroids @ self._matrix[row]))
+        if self._touched is not None:
+            self._touched.add(int(self._ids[row]))
+
+    def _row_moved(self, src: int, dst: int):
+        self._labels[dst] = self._labels[src]
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._centroids = None
+            self._labels = np.empty(0, dtype=np.int32)
+            self._trained_size = 0
+
+    def _kmeans(self, data: np.ndarray) -> np.ndarray:
+        """Centroids of spherical k-means over data"""
+        n = data.shape[0]
+        k = min(self.nlist, n)
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(n, k, replace=False)].copy()
+        for _ in range(self.n_iter):
+            labels = self._assign(data, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            empty = np.bincount(labels, minlength=k) == 0
+            if empty.any():
+                # Re-seed empty cells from random points
+                sums[empty] = data[rng.choice(n, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = (sums / norms).astype(np.float32)
+        return centroids
+
+    def train(self):
+        """
+        Run spherical k-means over the current embeddings and swap the new
+        centroids in. The clustering works on a copy, so searches and
+        updates only wait for the copy and the swap.
+        """
+        with self._train_lock:
+            with self._lock:
+                if not self._size:
+                    return
+                ids = self._ids[:self._size].copy()
+                data = self._matrix[:self._size].copy()
+                self._touched = set()
+            try:
+                centroids = self._kmeans(data)
+                labels = self._assign(data, centroids)
+                order = np.argsort(ids)
+                ids, labels = ids[order], labels[order]
+            except BaseException:
+                with self._lock:
+                    self._touched = None
+                raise
+            with self._lock:
+                current = self._ids[:self._size]
+                positions = np.minimum(np.searchsorted(ids, current), len(ids) - 1)
+                # Rows added or replaced since the copy get their label from the new centroids
+                fresh = (ids[positions] == current) & ~np.isin(current, list(self._touched))
+                self._centroids = centroids
+                self._labels = np.zeros(self._matrix.shape[0], dtype=np.int32)
+                self._labels[:self._size][fresh] = labels[positions[fresh]]
+                stale = np.flatnonzero(~fresh)
+                if stale.size:
+                    self._labels[stale] = self._assign(self._matrix[stale])
+                self._trained_size = len(ids)
+                self._touched = None
+
+    def _needs_training(self) -> bool:
+        if not self.is_trained:
+            return self._size >= self.min_train_size
+        return self._size >= self._trained_size * self.retrain_growth
+
+    def maybe_train(self):
+        """Start a background training when the index has grown enough, unless one is running"""
+        with self._lock:
+            if not self._needs_training() or (self._training is not None and self._training.is_alive()):
+                return
+            self._training = threading.Thread(target=self._train_in_background, name='ivf-training', daemon=True)
+            self._training.start()
+
+    def _train_in_background(self):
+        try:
+            self.train()
+        except Exception:
+            logger.exception("IVF training failed, searching with the previous centroids")
+
+    def sync(self, max_age: float = 0):
+        super().sync(max_age)
+        self.maybe_train()
+
+    def prepare(self):
+        """Sync and train in the foreground, so a saved index has up to date centroids"""
+        super().sync()
+        training = self._training
+        if training is not None:
+            training.join()
+        if self._needs_training():
+            self.train()
+
+    def search(self, query_embedding, k: int = 1) -> list:
+        query = self._normalize(query_embedding)
+        with self._lock:
+            if not self.is_trained:
+                return super().search(query, k)
+            if not self._size or k <= 0:
+                return []
+            probe = self._top_k(self._centroids @ query, self.nprobe)
+            rows = np.flatnonzero(np.isin(self._labels[:self._size], probe))
+            scores = self._matrix[rows] @ query
+            ids = self._ids[rows]
+        return [(int(ids[i]), float(scores[i])) for i in self._top_k(scores, k)]
+
+    def _state(self) -> dict:
+        state = super()._state()
+        if self.is_trained:
+            state['centroids'] = self._centroids
+            state['labels'] = self._labels[:self._size].copy()
+        else:
+            state['centroids'] = np.empty((0, 0), dtype=np.float32)
+            state['labels'] = np.empty(0, dtype=np.int32)
+        state['trained_size'] = np.array(self._trained_size)
+        return state
+
+    def _restore(self, state):
+        super()._restore(state)
+        centroids = state['centroids']
+        self._centroids = centroids if centroids.size else None
+        capacity = self._matrix.shape[0] if self._matrix is not None else 0
+        self._labels = np.zeros(capacity, dtype=np.int32)
+        self._labels[:self._size] = state['labels'] if self._centroids is not None else 0
+        self._trained_size = int(state['trained_size'])
@@ -0,0 +1,121 @@
+import math
+import re
+from .base import BaseRetriever
+
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """Lowercase words and numbers; IBANs and amounts stay single terms"""
+    return WORD.findall(text.lower())
+
+
+class BM25Index(BaseRetriever):
+    """
+    In-memory BM25 inverted index over Document content.
+    Shares the Document table sync of the vector backends, but is queried
+    with text, so a query can be answered without embedding it first.
+    Scores are normalized by what a document holding every query term once
+    at average length would get, putting a full match near 1.0.
+    It isn't persisted: building it from the table is cheap.
+
+    Knobs: k1 (term frequency saturation), b (document length normalization).
+    """
+
+    kind = 'bm25'
+    field = 'content'
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # term -> {document id: term frequency}
+        self._terms = {}  # document id -> its distinct terms
+        self._lengths = {}  # document id -> number of terms
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def doc_ids(self) -> set:
+        return set(self._lengths)
+
+    def params(self) -> dict:
+        return {'k1': self.k1, 'b': self.b}
+
+    def add(self, doc_id: int, content):
+        if not content:
+            self.remove(doc_id)
+            return
+        terms = tokenize(content)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        with self._lock:
+            self.remove(doc_id)
+            for term, frequency in frequencies.items():
+                self._postings.setdefault(term, {})[doc_id] = frequency
+            self._terms[doc_id] = tuple(frequencies)
+            self._lengths[doc_id] = len(terms)
+            self._total_length += len(terms)
+            self._max_id = max(self._max_id, doc_id)
+
+    def remove(self, doc_id: int):
+        with self._lock:
+            length = self._lengths.pop(doc_id, None)
+            if length is None:
+                return
+            self._total_length -= length
+            for term in self._terms.pop(doc_id):
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._postings = {}
+            self._terms = {}
+            self._lengths = {}
+            self._total_length = 0
+
+    def _idf(self, document_frequency: int) -> float:
+        count = len(self._lengths)
+        return math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, query: str, k: int = 1) -> list:
+        """
+        Return up to k (document id, normalized BM25 score) pairs,
+        best first
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._lengths or not terms or k <= 0:
+                return []
+            average_length = self._total_length / len(self._lengths)
+            scores = {}
+            # Terms no document contains count towards a full match too
+            ideal = 0.0
+            for term in terms:
+                postings = self._postings.get(term, {})
+                idf = self._idf(len(postings))
+                ideal += idf
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(doc_id, min(score / ideal, 1.0)) for doc_id, score in ranked]
+
+
+def reciprocal_rank_fusion(*rankings, k: int = 60) -> dict:
+    """
+    Fuse ranked lists of document ids: every list adds 1 / (k + rank) to
+    the documents it holds. Only ranks count, so scores of different
+    scales combine without calibration.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return fused
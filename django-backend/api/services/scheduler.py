@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first
+INTERACTIVE = 0
+BULK = 10
+
+
+class TokenBucket:
+    """Refilling budget of rate units per minute; 0 disables the limit"""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount from the bucket, going into debt if needed.
+        Returns how many seconds the caller must wait before proceeding.
+        """
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= amount
+            return -self._available / self.rate if self._available < 0 else 0.0
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and dropped connections are worth retrying"""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    """
+    Gate in front of every outbound OpenAI call.
+    Limits the calls in flight, paces them with request and token buckets,
+    lets interactive chat jump ahead of bulk work, and retries 429/5xx
+    responses with jittered exponential backoff. A 429 also pauses new
+    dispatches for its Retry-After so the whole process backs off together.
+    Waiters may live on different event loops (async_to_sync in views), so
+    state is guarded by a thread lock and waiters are woken thread-safely.
+    """
+
+    def __init__(self, max_in_flight: int = 32, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_in_flight = max_in_flight
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = []  # heap of (priority, sequence, loop, future)
+        self._sequence = itertools.count()
+        self._cooldown_until = 0.0
+        self.completed = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def _acquire(self, priority: int):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                return
+            future = loop.create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as we were cancelled
+                    self._release_locked()
+                else:
+                    self._waiters = [waiter for waiter in self._waiters if waiter[3] is not future]
+                    heapq.heapify(self._waiters)
+            raise
+
+    def _release_locked(self):
+        while self._waiters:
+            _, _, loop, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            # The slot passes straight to the waiter, in_flight is unchanged
+            loop.call_soon_threadsafe(self._wake, future)
+            return
+        self._in_flight -= 1
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def _release(self):
+        with self._lock:
+            self._release_locked()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, tokens: int = 0):
+        """Hold one in-flight slot, waiting for rate limit budget first"""
+        await self._acquire(priority)
+        try:
+            delay = max(
+                self.requests.reserve(1),
+                self.tokens.reserve(tokens),
+                self._cooldown_until - time.monotonic(),
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            self._release()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            if getattr(error, 'status_code', None) == 429:
+                self._cooldown_until = max(self._cooldown_until, time.monotonic() + retry_after)
+        return delay
+
+    async def run(self, call, priority: int = INTERACTIVE, tokens: int = 0):
+        """Run call() (a coroutine factory) under the limits, retrying transient errors"""
+        attempt = 0
+        while True:
+            try:
+                async with self.slot(priority, tokens):
+                    result = await call()
+                self.completed += 1
+                return result
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self.retries += 1
+                logger.warning("OpenAI call failed (%s), retry %d in %.2fs", e, attempt, delay)
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self._in_flight,
+            'queued': len(self._waiters),
+            'max_in_flight': self.max_in_flight,
+            'completed': self.completed,
+            'retries': self.retries,
+            'failures': self.failures,
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    """Process-wide scheduler configured from settings"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler(
+                    max_in_flight=settings.OPENAI_MAX_IN_FLIGHT,
+                    requests_per_minute=settings.OPENAI_REQUESTS_PER_MINUTE,
+                    tokens_per_minute=settings.OPENAI_TOKENS_PER_MINUTE,
+                    max_retries=settings.OPENAI_MAX_RETRIES,
+                    base_delay=settings.OPENAI_RETRY_BASE_DELAY,
+                    max_delay=settings.OPENAI_RETRY_MAX_DELAY,
+                )
+    return _scheduler
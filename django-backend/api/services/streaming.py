@@ -0,0 +1,85 @@
+import re
+
+TYPE_PATTERN = re.compile(r'"type"\s*:\s*"([a-z_]+)"')
+RESPONSE_PATTERN = re.compile(r'"response"\s*:\s*"')
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '"': '"', '\\': '\\', '/': '/'}
+
+
+class IncrementalResponseParser:
+    """
+    Incremental reader for the JSON object the model streams back.
+    Detects the response type as soon as it appears and decodes the
+    "response" string of general inquiries piece by piece, so its text can
+    be forwarded before the object is complete. The full text is kept in
+    buffer for the final json.loads.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.response_type = None
+        self.response_text = ''
+        self._cursor = None  # buffer position inside the "response" string
+        self._response_done = False
+        self._emitted = 0
+
+    def feed(self, chunk: str) -> str:
+        """Add streamed text, returning any new general inquiry response text"""
+        self.buffer += chunk
+        if self.response_type is None:
+            match = TYPE_PATTERN.search(self.buffer)
+            if match:
+                self.response_type = match.group(1)
+        if not self._response_done:
+            if self._cursor is None:
+                match = RESPONSE_PATTERN.search(self.buffer)
+                if match:
+                    self._cursor = match.end()
+            if self._cursor is not None:
+                self.response_text += self._decode()
+
+        # Hold text back until we know it belongs to a general inquiry
+        if self.response_type != 'general_inquiry':
+            return ''
+        delta = self.response_text[self._emitted:]
+        self._emitted = len(self.response_text)
+        return delta
+
+    def _decode(self) -> str:
+        """Decode the JSON string from the cursor up to the end of the buffer"""
+        buffer = self.buffer
+        out = []
+        i = self._cursor
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self._response_done = True
+                i += 1
+                break
+            if char != '\\':
+                out.append(char)
+                i += 1
+                continue
+            # Escape sequences may be split across chunks, wait for the rest
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape != 'u':
+                out.append(ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            code = int(buffer[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # Surrogate pair
+                if i + 12 > len(buffer):
+                    break
+                if buffer[i + 6:i + 8] == '\\u':
+                    low = int(buffer[i + 8:i + 12], 16)
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            out.append(chr(code))
+            i += 6
+        self._cursor = i
+        return ''.join(out)
@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+from . import metrics
+
+
+class StageTimings:
+    """
+    Start offsets and durations of the stages of one chat turn.
+    Stages may overlap; listing them by start time shows which ones
+    ran concurrently and which one the reply actually waited for.
+    Every stage is also recorded as a span in the process metrics.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> (offset, duration) in seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.stages[name] = (start - self.started, duration)
+            metrics.observe(name, duration)
+
+    async def timed(self, name: str, awaitable):
+        """Await awaitable, recording it as a stage"""
+        with self.stage(name):
+            return await awaitable
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            name: {'start_ms': round(offset * 1000, 2), 'duration_ms': round(duration * 1000, 2)}
+            for name, (offset, duration) in sorted(self.stages.items(), key=lambda item: item[1][0])
+        }
+
+    def __str__(self):
+        stages = " ".join(
+            f"{name}={times['duration_ms']}ms@{times['start_ms']}"
+            for name, times in self.as_dict().items()
+        )
+        return f"{stages} total={round(self.elapsed * 1000, 2)}ms"
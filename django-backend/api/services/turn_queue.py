@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from collections import deque
+
+OVERFLOW_POLICIES = ('drop', 'reject', 'coalesce')
+
+
+class QueueMetrics:
+    """Depth and overflow counters summed over every chat connection of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.depth = 0
+        self.peak_depth = 0
+        self.queued = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    def record(self, outcome: str, depth_change: int = 0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.depth += depth_change
+            self.peak_depth = max(self.peak_depth, self.depth)
+
+    def taken(self, count: int = 1):
+        with self._lock:
+            self.depth -= count
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'depth': self.depth,
+                'peak_depth': self.peak_depth,
+                'queued': self.queued,
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'coalesced': self.coalesced,
+            }
+
+
+queue_metrics = QueueMetrics()
+
+
+class TurnQueue:
+    """
+    Bounded FIFO of the chat turns waiting on one connection.
+    When it is full, offer() applies the overflow policy: 'drop' discards
+    the new turn, 'reject' refuses it so the caller can tell the user, and
+    'coalesce' folds it into the newest waiting turn with merge(last, new),
+    and rejects it when merge returns None because the two can't be combined.
+    """
+
+    def __init__(self, max_size: int, overflow: str = 'reject', merge=None, metrics: QueueMetrics = queue_metrics):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if overflow == 'coalesce' and merge is None:
+            raise ValueError("The coalesce policy needs a merge function")
+        self.max_size = max_size
+        self.overflow = overflow
+        self.merge = merge
+        self.metrics = metrics
+        self._items = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._items)
+
+    def offer(self, item) -> str:
+        """Add item; returns 'queued', 'coalesced', 'dropped' or 'rejected'"""
+        if len(self._items) < self.max_size:
+            self._items.append(item)
+            self._ready.set()
+            self.metrics.record('queued', 1)
+            return 'queued'
+        if self.overflow == 'coalesce' and self._items:
+            merged = self.merge(self._items[-1], item)
+            if merged is not None:
+                self._items[-1] = merged
+                self.metrics.record('coalesced')
+                return 'coalesced'
+        outcome = 'rejected' if self.overflow in ('reject', 'coalesce') else 'dropped'
+        self.metrics.record(outcome)
+        return outcome
+
+    async def get(self):
+        """Oldest waiting item, waiting for one if the queue is empty"""
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        self.metrics.taken()
+        return self._items.popleft()
+
+    def clear(self):
+        """Discard the waiting items, e.g. when the connection closes"""
+        self.metrics.taken(len(self._items))
+        items = list(self._items)
+        self._items.clear()
+        return items
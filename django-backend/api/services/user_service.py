@@ -1,11 +1,21 @@
-from django.db import models, transaction
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Case, OuterRef, Subquery, Value, When
 from channels.db import database_sync_to_async
-from api.models import User
-import random
-import string
+from api.models import User, Transaction
+from api.services.account_events import AccountSnapshot, get_account_events
+from api.services.ledger_service import ledger_service
+from api.services.iban import get_iban_allocator
+from api.services.metrics import timed
+
+IDEMPOTENCY_KEY_REUSED = "Idempotency key was already used for a different operation"
+
+BULK_ACTIONS = {'DEPOSIT', 'WITHDRAW'}
+# Accounts locked and updated per database transaction by apply_balance_changes
+BULK_BATCH_ACCOUNTS = 500
 
 class UserService:
     @database_sync_to_async
+    @timed('user.get_user_by_name')
     def get_user_by_name(self, name):
         """
         Get user by name
@@ -15,142 +25,356 @@ class UserService:
             return User.objects.get(name=name)
         except User.DoesNotExist:
             return None
+
     @database_sync_to_async
-    def create_user(self, name, initial_balance=0):
+    @timed('user.get_account')
+    def get_account(self, account_id):
         """
-        Asynchronously create a new user with IBAN and balance
+        Read an account for a chat session's cache, versioned by its newest
+        ledger entry in the same query
+        Returns AccountSnapshot or None if not found
+        """
+        latest = Transaction.objects.filter(account=OuterRef('pk')).order_by('-id').values('id')[:1]
+        user = User.objects.filter(id=account_id).annotate(version=Subquery(latest)).first()
+        if user is None:
+            return None
+        return AccountSnapshot.from_user(user, user.version or 0)
+
+    @staticmethod
+    def _add_to_balance(account_id, amount, allow_negative=False):
+        """
+        Add amount to a balance with UPDATE ... RETURNING, so the new balance
+        comes from the row itself. Unless allow_negative, a change that
+        would take the balance below zero updates nothing.
+        Returns the new balance, or None if no row was updated
+        """
+        condition = "" if allow_negative else " AND balance + %s >= 0"
+        params = [amount, account_id] if allow_negative else [amount, account_id, amount]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {User._meta.db_table} SET balance = balance + %s WHERE id = %s{condition} RETURNING balance",
+                params
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _announce(entries):
+        """Push the new balances to chat sessions once the transaction commits"""
+        def send():
+            # Entries are in ledger order, so the last one of an account is its newest
+            latest = {entry.account_id: entry for entry in entries}
+            events = get_account_events()
+            for entry in latest.values():
+                events.changed(entry.account_id, entry.balance_after, entry.id)
+        if entries:
+            transaction.on_commit(send)
+
+    @timed('user.register')
+    def register(self, name, initial_balance=0):
+        """
+        Create a user with a freshly allocated IBAN and open its ledger.
+        Duplicate names and IBANs are caught by the unique constraints
+        instead of being looked up first.
         Returns tuple of (user, message)
         """
         try:
-            # Check if user with name already exists
+            with transaction.atomic():
+                user = User.objects.create(
+                    name=name,
+                    iban=self.generate_iban(),
+                    balance=initial_balance
+                )
+                if initial_balance:
+                    ledger_service.record([
+                        ledger_service.entry(user.id, Transaction.OPENING, initial_balance, initial_balance)
+                    ])
+        except IntegrityError:
             if User.objects.filter(name=name).exists():
                 return None, "User with this name already exists"
-            
-            # Generate IBAN and check if it exists
-            while True:
-                iban = self.generate_iban()
-                if not User.objects.filter(iban=iban).exists():
-                    break
-            
-            user = User.objects.create(
-                name=name,
-                iban=iban,
-                balance=initial_balance
-            )
-            return user, "User created successfully"
+            raise
+        return user, "User created successfully"
+
+    @database_sync_to_async
+    def create_user(self, name, initial_balance=0):
+        """
+        Asynchronously create a new user with IBAN and balance
+        Returns tuple of (user, message)
+        """
+        try:
+            return self.register(name, initial_balance)
         except Exception as e:
             return None, str(e)
 
-    @database_sync_to_async
-    def transfer_money(self, from_user, amount, to_iban):
+    def transfer(self, from_user_id, amount, to_iban, idempotency_key=None):
         """
-        Transfer money from one user to another using IBAN
+        Move amount from one account to the account with to_iban.
+        Both rows are locked with select_for_update in primary key order, so
+        opposing transfers between the same accounts queue up instead of
+        deadlocking, and the balance is checked on the locked row. Balances
+        change through UPDATE ... RETURNING rather than saving whole rows,
+        and both sides are written to the ledger with the returned balances.
+        A repeated idempotency_key returns the original outcome without
+        moving money again.
         Returns tuple of (success, message)
         """
-        try:
-            # Validate amount
-            if amount <= 0:
-                return False, "Amount must be positive"
+        return self._transfer(from_user_id, amount, to_iban, idempotency_key)[:2]
 
-            # Check if sender has sufficient balance
-            if from_user.balance < amount:
-                return False, "Insufficient balance"
+    @timed('user.transfer')
+    def _transfer(self, from_user_id, amount, to_iban, idempotency_key=None):
+        """transfer(), also returning the sender's ledger entry or None"""
+        # Validate amount
+        if amount <= 0:
+            return False, "Amount must be positive", None
 
+        with transaction.atomic():
             # Find recipient by IBAN
-            try:
-                to_user = User.objects.get(iban=to_iban)
-            except User.DoesNotExist:
-                return False, "Recipient IBAN not found"
+            to_user_id = User.objects.filter(iban=to_iban).values_list('id', flat=True).first()
+            if to_user_id is None:
+                return False, "Recipient IBAN not found", None
 
             # Don't allow transfers to self
-            if from_user.iban == to_iban:
-                return False, "Cannot transfer to self"
+            if to_user_id == from_user_id:
+                return False, "Cannot transfer to self", None
 
-            # Use transaction.atomic() to ensure both operations succeed or fail together
-            with transaction.atomic():
-                # Deduct from sender
-                from_user.balance -= amount
-                from_user.save()
+            accounts = {
+                user.id: user
+                for user in User.objects.select_for_update().filter(id__in=[from_user_id, to_user_id]).order_by('id')
+            }
+            if from_user_id not in accounts:
+                return False, "Sender account not found", None
+            if to_user_id not in accounts:
+                return False, "Recipient IBAN not found", None
+
+            previous = ledger_service.find(from_user_id, idempotency_key)
+            if previous is not None:
+                if previous.kind != Transaction.TRANSFER_OUT or previous.amount != -amount \
+                        or previous.counterparty_id != to_user_id:
+                    return False, IDEMPOTENCY_KEY_REUSED, None
+                return True, f"Successfully transferred {amount} to {accounts[to_user_id].name}", previous
+
+            # Check sufficient balance on the locked row
+            if accounts[from_user_id].balance < amount:
+                return False, "Insufficient balance", None
 
-                # Add to recipient
-                to_user.balance += amount
-                to_user.save()
+            entries = [
+                ledger_service.entry(from_user_id, Transaction.TRANSFER_OUT, -amount,
+                                     self._add_to_balance(from_user_id, -amount), to_user_id, idempotency_key),
+                ledger_service.entry(to_user_id, Transaction.TRANSFER_IN, amount,
+                                     self._add_to_balance(to_user_id, amount, allow_negative=True), from_user_id),
+            ]
+            ledger_service.record(entries)
+            self._announce(entries)
 
-            return True, f"Successfully transferred {amount} to {to_user.name}"
+        return True, f"Successfully transferred {amount} to {accounts[to_user_id].name}", entries[0]
 
+    @database_sync_to_async
+    def transfer_money(self, from_user, amount, to_iban, idempotency_key=None):
+        """
+        Transfer money from one user to another using IBAN
+        Returns tuple of (success, message, sender's ledger entry or None)
+        """
+        try:
+            return self._transfer(from_user.id, amount, to_iban, idempotency_key)
         except Exception as e:
-            return False, f"Transfer failed: {str(e)}"
-    
+            return False, f"Transfer failed: {str(e)}", None
+
+    @timed('user.change_balance')
+    def change_balance(self, username, amount, idempotency_key=None):
+        """
+        Credit (positive amount) or debit (negative amount) an account and
+        write the ledger entry. The balance check is part of the UPDATE and
+        balance_after is what it returns. With an idempotency_key the row is
+        locked first, so a repeated key returns the original entry without
+        applying the change again; otherwise the UPDATE's own row lock is
+        the only one taken.
+        Returns tuple of (entry or None, error message or None)
+        """
+        with transaction.atomic():
+            users = User.objects.select_for_update() if idempotency_key is not None else User.objects
+            user = users.only('id').get(name=username)
+
+            if idempotency_key is not None:
+                previous = ledger_service.find(user.id, idempotency_key)
+                if previous is not None:
+                    if previous.amount != amount:
+                        return None, IDEMPOTENCY_KEY_REUSED
+                    return previous, None
+
+            balance = self._add_to_balance(user.id, amount)
+            if balance is None:
+                return None, "Insufficient balance"
+
+            kind = Transaction.DEPOSIT if amount > 0 else Transaction.WITHDRAW
+            entry = ledger_service.entry(user.id, kind, amount, balance, idempotency_key=idempotency_key)
+            ledger_service.record([entry])
+            self._announce([entry])
+            return entry, None
+
     @database_sync_to_async
-    def withdraw(self, username, amount):
+    def withdraw(self, username, amount, idempotency_key=None):
         """
         Withdraw money from user's balance
-        Returns tuple of (success, message)
+        Returns tuple of (success, message, ledger entry or None)
         """
         try:
             # Validate amount
             if amount <= 0:
-                return False, "Withdrawal amount must be positive"
+                return False, "Withdrawal amount must be positive", None
 
             try:
-                with transaction.atomic():
-                    user = User.objects.select_for_update().get(name=username)
-                    
-                    # Check sufficient balance
-                    if user.balance < amount:
-                        return False, "Insufficient balance"
-                    
-                    # Perform withdrawal
-                    user.balance -= amount
-                    user.save()
-                    
-                    return True, f"Successfully withdrew {amount}. New balance: {user.balance}"
+                entry, error = self.change_balance(username, -amount, idempotency_key)
+                if error:
+                    return False, error, None
+                return True, f"Successfully withdrew {-entry.amount}. New balance: {entry.balance_after}", entry
                     
             except User.DoesNotExist:
-                return False, f"User {username} not found"
+                return False, f"User {username} not found", None
 
         except Exception as e:
-            return False, f"Withdrawal failed: {str(e)}"
+            return False, f"Withdrawal failed: {str(e)}", None
 
     @database_sync_to_async
-    def deposit(self, username, amount):
+    def deposit(self, username, amount, idempotency_key=None):
         """
         Deposit money to user's balance
-        Returns tuple of (success, message)
+        Returns tuple of (success, message, ledger entry or None)
         """
         try:
             # Validate amount
             if amount <= 0:
-                return False, "Deposit amount must be positive"
+                return False, "Deposit amount must be positive", None
 
             try:
-                with transaction.atomic():
-                    user = User.objects.select_for_update().get(name=username)
-                    
-                    # Perform deposit
-                    user.balance += amount
-                    user.save()
-                    
-                    return True, f"Successfully deposited {amount}. New balance: {user.balance}"
+                entry, error = self.change_balance(username, amount, idempotency_key)
+                if error:
+                    return False, error, None
+                return True, f"Successfully deposited {entry.amount}. New balance: {entry.balance_after}", entry
                     
             except User.DoesNotExist:
-                return False, f"User {username} not found"
+                return False, f"User {username} not found", None
 
         except Exception as e:
-                return False, f"Deposit failed: {str(e)}"
+                return False, f"Deposit failed: {str(e)}", None
     
+    @staticmethod
+    def _validate_operation(operation):
+        """Return (iban, signed amount, idempotency_key) or raise ValueError"""
+        if not isinstance(operation, dict):
+            raise ValueError("Operation must be an object")
+        action = str(operation.get('action', '')).upper()
+        if action not in BULK_ACTIONS:
+            raise ValueError("action must be DEPOSIT or WITHDRAW")
+        amount = operation.get('amount')
+        if isinstance(amount, bool) or not isinstance(amount, int) or amount <= 0:
+            raise ValueError("amount must be a positive integer")
+        key = operation.get('idempotency_key')
+        if not isinstance(key, str) or not key or len(key) > 64:
+            raise ValueError("idempotency_key must be a string of 1 to 64 characters")
+        iban = operation.get('iban')
+        if not isinstance(iban, str) or not iban:
+            raise ValueError("iban is required")
+        return iban, amount if action == 'DEPOSIT' else -amount, key
+
+    @timed('user.apply_balance_changes')
+    def apply_balance_changes(self, operations, batch_size=None):
+        """
+        Apply many deposits and withdrawals, each with an idempotency key.
+        Operations are grouped per account and accounts are processed in
+        primary key order, batch_size accounts per database transaction:
+        one SELECT ... FOR UPDATE locks the batch, one UPDATE applies the net
+        change of every account and one INSERT writes the ledger entries.
+        Within an account operations apply in request order and a
+        withdrawal that would overdraw the account fails on its own.
+        Returns one result dict per operation, in request order.
+        """
+        batch_size = batch_size or BULK_BATCH_ACCOUNTS
+        results = [{'index': index, 'status': 'error'} for index in range(len(operations))]
+        by_iban = {}
+        for index, operation in enumerate(operations):
+            try:
+                iban, amount, key = self._validate_operation(operation)
+            except ValueError as e:
+                results[index]['error'] = str(e)
+                continue
+            by_iban.setdefault(iban, []).append((index, amount, key))
+
+        accounts = dict(User.objects.filter(iban__in=list(by_iban)).values_list('iban', 'id'))
+        for iban in set(by_iban) - set(accounts):
+            for index, _, _ in by_iban.pop(iban):
+                results[index]['error'] = "Account not found"
+
+        account_ids = sorted(accounts[iban] for iban in by_iban)
+        ibans = {account_id: iban for iban, account_id in accounts.items()}
+        for start in range(0, len(account_ids), batch_size):
+            batch = {account_ids[position]: by_iban[ibans[account_ids[position]]]
+                     for position in range(start, min(start + batch_size, len(account_ids)))}
+            try:
+                self._apply_batch(batch, results)
+            except Exception as e:
+                # The batch rolled back as a whole
+                for operations in batch.values():
+                    for index, _, _ in operations:
+                        results[index] = {'index': index, 'status': 'error', 'error': f"Batch failed: {str(e)}"}
+        return results
+
+    def _apply_batch(self, batch, results):
+        """Apply the operations of one batch of accounts in a single transaction"""
+        with transaction.atomic():
+            balances = dict(
+                User.objects.select_for_update().filter(id__in=list(batch)).order_by('id').values_list('id', 'balance')
+            )
+            keys = {key for operations in batch.values() for _, _, key in operations}
+            previous = {
+                (entry.account_id, entry.idempotency_key): entry
+                for entry in Transaction.objects.filter(account_id__in=list(batch), idempotency_key__in=keys)
+            }
+
+            entries, changed, applied = [], {}, []
+            for account_id, operations in batch.items():
+                balance = balances.get(account_id)
+                if balance is None:
+                    # Deleted since the lookup
+                    for index, _, _ in operations:
+                        results[index]['error'] = "Account not found"
+                    continue
+                for index, amount, key in operations:
+                    entry = previous.get((account_id, key))
+                    if entry is not None:
+                        if entry.amount != amount:
+                            results[index]['error'] = IDEMPOTENCY_KEY_REUSED
+                        else:
+                            applied.append((index, 'duplicate', entry))
+                        continue
+                    if balance + amount < 0:
+                        results[index]['error'] = "Insufficient balance"
+                        continue
+                    balance += amount
+                    kind = Transaction.DEPOSIT if amount > 0 else Transaction.WITHDRAW
+                    entry = ledger_service.entry(account_id, kind, amount, balance, idempotency_key=key)
+                    # A repeated key later in the same request is a duplicate of this one
+                    previous[(account_id, key)] = entry
+                    entries.append(entry)
+                    applied.append((index, 'success', entry))
+                if balance != balances[account_id]:
+                    changed[account_id] = balance
+
+            if changed:
+                # Rows are locked, so the new balances can be set directly
+                User.objects.filter(id__in=list(changed)).update(balance=Case(
+                    *[When(id=account_id, then=Value(balance)) for account_id, balance in changed.items()],
+                    output_field=models.IntegerField()
+                ))
+            ledger_service.record(entries)
+            self._announce(entries)
+
+        # Ids of the new entries are known once they are inserted
+        for index, status, entry in applied:
+            results[index].update(status=status, balance_after=entry.balance_after, transaction_id=entry.id)
+
     def generate_iban(self):
         """
-        Generate a random IBAN
+        Allocate a new, valid IBAN
         Format: GR + 2 check digits + 3 bank code + 4 branch code + 16 account number
         """
-        # Country code for Greece
-        country_code = "GR"
-        
-        # Generate random numbers for each part
-        check_digits = ''.join(random.choices(string.digits, k=2))
-        bank_code = ''.join(random.choices(string.digits, k=3))
-        branch_code = ''.join(random.choices(string.digits, k=4))
-        account_number = ''.join(random.choices(string.digits, k=16))
-        
-        return f"{country_code}{check_digits}{bank_code}{branch_code}{account_number}"
+        return get_iban_allocator().allocate()
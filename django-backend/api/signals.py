@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from api.models import Document
+from api.services.retrievers import get_lexical_index, get_retriever
+from api.services.response_cache import get_response_cache
+
+
+@receiver(post_save, sender=Document)
+def index_document(sender, instance, **kwargs):
+    """Keep the in-memory retrieval indexes in step with saved documents"""
+    retriever = get_retriever()
+    # An index that hasn't been loaded yet picks the row up on its first sync
+    if retriever.is_loaded:
+        retriever.add(instance.id, instance.embedding)
+    lexical_index = get_lexical_index()
+    if lexical_index.is_loaded:
+        # Like the vector index, only documents with an embedding are searchable
+        if instance.embedding is not None:
+            lexical_index.add(instance.id, instance.content)
+        else:
+            lexical_index.remove(instance.id)
+
+
+@receiver(post_delete, sender=Document)
+def unindex_document(sender, instance, **kwargs):
+    """Drop deleted documents from the in-memory retrieval indexes"""
+    retriever = get_retriever()
+    if retriever.is_loaded:
+        retriever.remove(instance.id)
+    lexical_index = get_lexical_index()
+    if lexical_index.is_loaded:
+        lexical_index.remove(instance.id)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def invalidate_cached_responses(sender, instance, **kwargs):
+    """Forget answers generated from a document that changed or was removed"""
+    get_response_cache().invalidate_document(instance.id)
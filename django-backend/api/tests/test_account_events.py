@@ -0,0 +1,135 @@
+import asyncio
+import json
+import threading
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase, override_settings
+from django.urls import re_path
+from ..consumers import ChatConsumer
+from ..models import User
+from ..services.account_events import AccountEvents
+from ..services.openai_service import OpenAIService
+from ..services.user_service import UserService
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class TestAccountEvents(IsolatedAsyncioTestCase):
+    async def test_changes_reach_subscribers_from_any_thread(self):
+        events = AccountEvents()
+        received = asyncio.Queue()
+        unsubscribe = events.subscribe(1, lambda balance, version: received.put_nowait((balance, version)))
+        events.subscribe(2, lambda balance, version: self.fail("Wrong account"))
+
+        thread = threading.Thread(target=events.changed, args=(1, 50, 7))
+        thread.start()
+        thread.join()
+        self.assertEqual(await asyncio.wait_for(received.get(), timeout=1), (50, 7))
+
+        unsubscribe()
+        events.changed(1, 60, 8)
+        await asyncio.sleep(0.01)
+        self.assertTrue(received.empty())
+        self.assertEqual(events.stats()['sessions'], 1)
+
+    async def test_published_changes_are_delivered_once(self):
+        events = AccountEvents()
+        received = []
+        events.subscribe(1, lambda balance, version: received.append((balance, version)))
+        loop = asyncio.get_running_loop()
+        # This process delivered its own change already
+        events._receive(json.dumps({'origin': events.origin, 'account_id': 1, 'balance': 5, 'version': 1}), loop)
+        events._receive(json.dumps({'origin': 'other', 'account_id': 1, 'balance': 9, 'version': 2}), loop)
+        events._invalidate(loop)
+        await asyncio.sleep(0)
+        self.assertEqual(received, [(9, 2), (None, None)])
+        self.assertEqual(events.received, 1)
+
+
+class TestSessionAccountCache(TransactionTestCase):
+    def reply(self, operation):
+        return {'status': 'success', 'original_message': '',
+                'processed_message': {'type': 'banking_operation', 'operation': operation}}
+
+    async def test_balance_checks_use_the_snapshot(self):
+        replies = [
+            self.reply({'action': 'REGISTER', 'user_name': 'Maria', 'amount': 100}),
+            self.reply({'action': 'BALANCE'}),
+            self.reply({'action': 'DEPOSIT', 'amount': 50}),
+            self.reply({'action': 'BALANCE'}),
+            self.reply({'action': 'BALANCE'}),
+            self.reply({'action': 'IBAN'}),
+        ]
+
+        async def process_message(service, message, history, on_delta=None, timings=None, session=None):
+            return replies.pop(0)
+
+        reads = []
+        get_account = UserService.get_account
+
+        async def counted_get_account(service, account_id):
+            reads.append(account_id)
+            return await get_account(service, account_id)
+
+        application = URLRouter([re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi())])
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, OPENAI_STREAM_RESPONSES=False), \
+                patch('api.services.account_events._account_events', AccountEvents()), \
+                patch.object(OpenAIService, 'process_message', process_message), \
+                patch.object(UserService, 'get_account', counted_get_account):
+            communicator = WebsocketCommunicator(application, '/ws/chat/cache/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # welcome message
+
+            async def ask(text):
+                await communicator.send_json_to({'message': text, 'username': 'Maria'})
+                await communicator.receive_json_from()  # echo
+                return (await communicator.receive_json_from(timeout=5))['message']
+
+            await ask("Register Maria with 100")
+            self.assertTrue((await ask("Balance?")).startswith("Current balance for Maria: 100 euros"))
+            self.assertEqual(await ask("Deposit 50"), "Successfully deposited 50. New balance: 150")
+            self.assertTrue((await ask("Balance?")).startswith("Current balance for Maria: 150 euros"))
+
+            # Another session changes the account
+            await database_sync_to_async(UserService().change_balance)("Maria", -30)
+            self.assertTrue((await ask("Balance?")).startswith("Current balance for Maria: 120 euros"))
+            iban = await database_sync_to_async(lambda: User.objects.get(name="Maria").iban)()
+            self.assertEqual(await ask("IBAN?"), f"Your IBAN is: {iban}")
+            await communicator.disconnect()
+
+        self.assertEqual(reads, [])
+
+    async def test_own_changes_update_the_snapshot_without_events(self):
+        replies = [
+            self.reply({'action': 'REGISTER', 'user_name': 'Maria', 'amount': 100}),
+            self.reply({'action': 'BALANCE'}),
+            self.reply({'action': 'WITHDRAW', 'amount': 30}),
+            self.reply({'action': 'BALANCE'}),
+        ]
+
+        async def process_message(service, message, history, on_delta=None, timings=None, session=None):
+            return replies.pop(0)
+
+        application = URLRouter([re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi())])
+        # No account event is ever announced
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, OPENAI_STREAM_RESPONSES=False), \
+                patch('api.services.account_events._account_events', AccountEvents()), \
+                patch.object(OpenAIService, 'process_message', process_message), \
+                patch.object(UserService, '_announce', lambda service, entries: None):
+            communicator = WebsocketCommunicator(application, '/ws/chat/own/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # welcome message
+
+            async def ask(text):
+                await communicator.send_json_to({'message': text, 'username': 'Maria'})
+                await communicator.receive_json_from()  # echo
+                return (await communicator.receive_json_from(timeout=5))['message']
+
+            await ask("Register Maria with 100")
+            self.assertTrue((await ask("Balance?")).startswith("Current balance for Maria: 100 euros"))
+            self.assertEqual(await ask("Withdraw 30"), "Successfully withdrew 30. New balance: 70")
+            self.assertTrue((await ask("Balance?")).startswith("Current balance for Maria: 70 euros"))
+            await communicator.disconnect()
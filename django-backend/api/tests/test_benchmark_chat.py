@@ -0,0 +1,44 @@
+import itertools
+import random
+from unittest import TestCase
+from ..management.commands.benchmark_chat import compare, conversation, letters, summarize_turns
+from ..services.intent_parser import intent_parser
+
+IBAN = 'GR1600999000100000000000000001'
+
+
+class TestConversation(TestCase):
+    def test_script_is_reproducible_and_parsed_locally(self):
+        name = f"Bench Qwert {letters(27)}"
+        turns = list(itertools.islice(conversation(random.Random(1), name, [IBAN]), 200))
+        self.assertEqual(turns, list(itertools.islice(conversation(random.Random(1), name, [IBAN]), 200)))
+        self.assertEqual(turns[0], ('register', f"Register {name} with 1000 euros"))
+        self.assertEqual(intent_parser.parse(turns[0][1])['operation']['user_name'], name)
+        self.assertEqual({kind for kind, _ in turns},
+                         {'register', 'deposit', 'withdraw', 'transfer', 'balance', 'iban', 'faq'})
+        for kind, message in turns:
+            if kind != 'faq':
+                self.assertEqual(intent_parser.parse(message)['operation']['action'], kind.upper())
+
+    def test_no_transfers_without_peers(self):
+        kinds = {kind for kind, _ in itertools.islice(conversation(random.Random(1), 'Bench A', []), 200)}
+        self.assertNotIn('transfer', kinds)
+
+
+class TestReport(TestCase):
+    def test_summary_and_comparison(self):
+        turns = [
+            {'kind': 'deposit', 'outcome': 'ok', 'latency': 0.1, 'first_frame': 0.1},
+            {'kind': 'faq', 'outcome': 'ok', 'latency': 0.3, 'first_frame': 0.2},
+            {'kind': 'faq', 'outcome': 'timeout', 'latency': None, 'first_frame': None},
+        ]
+        summary = summarize_turns(turns, elapsed=2.0)
+        self.assertEqual((summary['turns'], summary['throughput_per_s']), (3, 1.0))
+        self.assertEqual(summary['errors'], {'timeout': 1})
+        self.assertEqual(summary['kinds']['faq']['errors'], 1)
+        self.assertEqual(summary['latency_ms']['max'], 300.0)
+
+        previous = {'run': {'commit': 'abc'}, **summary}
+        current = {'run': {'commit': 'def'}, **summary, 'throughput_per_s': 2.0}
+        lines = compare(previous, current)
+        self.assertIn('+100.0% better', next(line for line in lines if line.startswith('throughput_per_s')))
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase, TestCase
+from django.test import override_settings
+from ..services.rag_service import RAGService, chunk_text
+
+
+class TestChunkText(TestCase):
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(chunk_text("  Deposit 500 euros  ", 100, 20), ["Deposit 500 euros"])
+        self.assertEqual(chunk_text("   ", 100, 20), [])
+
+    def test_chunks_respect_size_and_separators(self):
+        text = "\n\n".join(f"Q: Question {i}?\nA: Answer number {i} is here." for i in range(20))
+        chunks = chunk_text(text, 120, 0)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 120 for chunk in chunks))
+        self.assertTrue(all(chunk.startswith("Q:") for chunk in chunks))
+        self.assertEqual(" ".join(chunks).split(), text.split())
+
+    def test_overlap(self):
+        text = " ".join(f"word{i}" for i in range(200))
+        chunks = chunk_text(text, 100, 30)
+        for previous, current in zip(chunks, chunks[1:]):
+            self.assertIn(current.split()[0], previous.split())
+
+
+class TestAddDocuments(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.service = RAGService()
+        self.calls = []
+
+        async def fake_embeddings(texts):
+            self.calls.append(list(texts))
+            if any("fail" in text for text in texts):
+                raise RuntimeError("boom")
+            return [[float(len(text)), 1.0] for text in texts]
+
+        async def fake_store(rows):
+            return [SimpleNamespace(id=i + 1, content=content) for i, (content, _) in enumerate(rows)]
+
+        self.service.create_embeddings = fake_embeddings
+        self.service.store_documents = fake_store
+
+    async def test_batches_and_per_item_results(self):
+        with override_settings(EMBEDDING_BATCH_SIZE=2):
+            results = await self.service.add_documents(["one", "two", "", "three four five six", "seven"], chunk_size=10, chunk_overlap=0)
+        self.assertTrue(all(len(batch) <= 2 for batch in self.calls))
+        self.assertEqual([r['status'] for r in results], ['success', 'success', 'error', 'success', 'success'])
+        self.assertEqual(len(results[3]['document_ids']), 3)
+        ids = [doc_id for result in results for doc_id in result['document_ids']]
+        self.assertEqual(sorted(ids), list(range(1, 7)))
+
+    async def test_failed_batch_only_fails_its_items(self):
+        with override_settings(EMBEDDING_BATCH_SIZE=1):
+            results = await self.service.add_documents(["ok", "fail", "fine"])
+        self.assertEqual([r['status'] for r in results], ['success', 'error', 'success'])
+        self.assertIn("Embedding failed", results[1]['error'])
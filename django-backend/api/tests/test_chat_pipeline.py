@@ -0,0 +1,158 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+from django.urls import re_path
+from ..consumers import ChatConsumer, QUEUE_FULL_MESSAGE
+from ..services.openai_service import OpenAIService
+from ..services.timing import StageTimings
+from ..services.turn_queue import TurnQueue, QueueMetrics
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class TestStageTimings(TestCase):
+    def test_stages_are_listed_by_start(self):
+        timings = StageTimings()
+        with timings.stage('b'):
+            pass
+        timings.stages['a'] = (0.0, 0.5)
+        self.assertEqual(list(timings.as_dict()), ['a', 'b'])
+        self.assertEqual(timings.as_dict()['a'], {'start_ms': 0.0, 'duration_ms': 500.0})
+        self.assertIn('a=500.0ms@0.0', str(timings))
+
+
+class TestTurnQueue(IsolatedAsyncioTestCase):
+    def make_queue(self, overflow):
+        self.metrics = QueueMetrics()
+        return TurnQueue(2, overflow=overflow, merge=lambda last, new: last + new, metrics=self.metrics)
+
+    async def test_fifo_and_depth(self):
+        queue = self.make_queue('reject')
+        self.assertEqual(queue.offer('a'), 'queued')
+        self.assertEqual(queue.offer('b'), 'queued')
+        self.assertEqual(self.metrics.stats()['depth'], 2)
+        self.assertEqual([await queue.get(), await queue.get()], ['a', 'b'])
+        self.assertEqual(self.metrics.stats()['depth'], 0)
+        self.assertEqual(self.metrics.stats()['peak_depth'], 2)
+
+    async def test_overflow_policies(self):
+        for overflow, outcome, waiting in (
+            ('reject', 'rejected', ['a', 'b']),
+            ('drop', 'dropped', ['a', 'b']),
+            ('coalesce', 'coalesced', ['a', 'bc']),
+        ):
+            queue = self.make_queue(overflow)
+            queue.offer('a')
+            queue.offer('b')
+            self.assertEqual(queue.offer('c'), outcome)
+            self.assertEqual(queue.clear(), waiting)
+            self.assertEqual(self.metrics.stats()[outcome], 1)
+            self.assertEqual(self.metrics.stats()['depth'], 0)
+
+    async def test_coalesce_rejects_what_merge_refuses(self):
+        queue = TurnQueue(1, overflow='coalesce', merge=lambda last, new: None, metrics=QueueMetrics())
+        queue.offer('a')
+        self.assertEqual(queue.offer('b'), 'rejected')
+        self.assertEqual(queue.clear(), ['a'])
+
+    def test_banking_commands_are_not_merged(self):
+        def turn(message):
+            return {'message': message, 'echoes': []}
+        self.assertIsNone(ChatConsumer._merge_turns(turn("deposit 50"), turn("withdraw 20")))
+        self.assertIsNone(ChatConsumer._merge_turns(turn("What are your fees?"), turn("withdraw 20")))
+        merged = ChatConsumer._merge_turns(turn("What are your fees?"), turn("And for transfers?"))
+        self.assertEqual(merged['message'], "What are your fees?\nAnd for transfers?")
+
+    async def test_get_waits_for_an_item(self):
+        queue = self.make_queue('reject')
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        self.assertFalse(getter.done())
+        queue.offer('a')
+        self.assertEqual(await asyncio.wait_for(getter, timeout=1), 'a')
+
+
+class TestReceivePipeline(IsolatedAsyncioTestCase):
+    async def test_echo_is_sent_while_the_model_runs(self):
+        echoed = asyncio.Event()
+
+        async def process_message(service, message, history, on_delta=None, timings=None, session=None):
+            # The echo must not wait for the model
+            await asyncio.wait_for(echoed.wait(), timeout=1)
+            return {'status': 'success', 'original_message': message,
+                    'processed_message': {'type': 'general_inquiry', 'response': 'Hello!'}}
+
+        application = URLRouter([re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi())])
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, OPENAI_STREAM_RESPONSES=False), \
+                patch.object(OpenAIService, 'process_message', process_message):
+            communicator = WebsocketCommunicator(application, '/ws/chat/test/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()  # welcome message
+
+            await communicator.send_json_to({'message': 'Hi there', 'username': 'Maria'})
+            echo = await communicator.receive_json_from()
+            echoed.set()
+            reply = await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        self.assertEqual(echo, {'message': 'Hi there', 'username': 'Maria'})
+        self.assertEqual(reply['message'], 'Hello!')
+        self.assertIn('message_id', reply)
+
+    async def test_messages_beyond_the_queue_are_rejected(self):
+        release = asyncio.Event()
+        answered = []
+
+        async def process_message(service, message, history, on_delta=None, timings=None, session=None):
+            await asyncio.wait_for(release.wait(), timeout=1)
+            answered.append(message)
+            return {'status': 'success', 'original_message': message,
+                    'processed_message': {'type': 'general_inquiry', 'response': f'Re: {message}'}}
+
+        application = URLRouter([re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi())])
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, OPENAI_STREAM_RESPONSES=False,
+                               CHAT_QUEUE_SIZE=1, CHAT_QUEUE_OVERFLOW='reject'), \
+                patch.object(OpenAIService, 'process_message', process_message):
+            communicator = WebsocketCommunicator(application, '/ws/chat/queue/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # welcome message
+
+            frames = []
+            for text in ('one', 'two', 'three'):
+                await communicator.send_json_to({'message': text, 'username': 'Maria'})
+                # Echo of every message, plus the notice for the one that didn't fit
+                frames.append(await communicator.receive_json_from())
+            frames.append(await communicator.receive_json_from())
+            release.set()
+            frames.append(await communicator.receive_json_from())
+            frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+
+        self.assertEqual([frame['message'] for frame in frames],
+                         ['one', 'two', 'three', QUEUE_FULL_MESSAGE, 'Re: one', 'Re: two'])
+        self.assertEqual(answered, ['one', 'two'])
+
+    async def test_failed_turn_still_gets_a_reply(self):
+        async def process_message(service, message, history, on_delta=None, timings=None, session=None):
+            raise RuntimeError("Connection error.")
+
+        application = URLRouter([re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi())])
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, OPENAI_STREAM_RESPONSES=False), \
+                patch.object(OpenAIService, 'process_message', process_message), \
+                self.assertLogs('api.consumers', 'ERROR'):
+            communicator = WebsocketCommunicator(application, '/ws/chat/failure/')
+            await communicator.connect()
+            await communicator.receive_json_from()  # welcome message
+
+            await communicator.send_json_to({'message': 'Hi there', 'username': 'Maria'})
+            echo = await communicator.receive_json_from()
+            reply = await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        self.assertEqual(echo['message'], 'Hi there')
+        self.assertEqual(reply['message'], "Error processing request: Connection error.")
+        self.assertEqual(reply['username'], 'Bot')
@@ -0,0 +1,49 @@
+import time
+from unittest import IsolatedAsyncioTestCase
+from ..services.embedding_cache import EmbeddingCache, normalize_query
+
+
+class TestEmbeddingCache(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = EmbeddingCache(max_size=2, ttl=60)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  What's my   BALANCE? "), "what's my balance")
+        self.assertEqual(
+            EmbeddingCache.make_key("Check balance!", "model-a"),
+            EmbeddingCache.make_key("check balance", "model-a")
+        )
+        self.assertNotEqual(
+            EmbeddingCache.make_key("check balance", "model-a"),
+            EmbeddingCache.make_key("check balance", "model-b")
+        )
+
+    async def test_hit_and_miss_counters(self):
+        self.assertIsNone(await self.cache.get("check balance", "m"))
+        await self.cache.set("check balance", "m", [0.1, 0.2])
+        self.assertEqual(await self.cache.get("Check balance?", "m"), [0.1, 0.2])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits_local'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    async def test_lru_eviction(self):
+        await self.cache.set("a", "m", [1.0])
+        await self.cache.set("b", "m", [2.0])
+        await self.cache.get("a", "m")
+        await self.cache.set("c", "m", [3.0])
+        self.assertIsNone(await self.cache.get("b", "m"))
+        self.assertEqual(await self.cache.get("a", "m"), [1.0])
+        self.assertEqual(await self.cache.get("c", "m"), [3.0])
+
+    async def test_ttl_expiry(self):
+        self.cache.ttl = 0.01
+        await self.cache.set("a", "m", [1.0])
+        time.sleep(0.02)
+        self.assertIsNone(await self.cache.get("a", "m"))
+
+    async def test_unreachable_redis_is_bypassed(self):
+        cache = EmbeddingCache(redis_host="127.0.0.1", redis_port=1)
+        self.assertIsNone(await cache.get("a", "m"))
+        await cache.set("a", "m", [1.0])
+        self.assertEqual(await cache.get("a", "m"), [1.0])
+        self.assertEqual(cache.stats()['redis_errors'], 1)
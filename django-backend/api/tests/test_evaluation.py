@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, TestCase
+import httpx
+import numpy as np
+from ..management.commands.evaluate_rag import score_response, score_retrieval, summarize, METRICS
+from ..services.recorder import RecordingTransport, UsageTransport, usage
+
+
+def openai_stub(calls):
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path.endswith('/embeddings'):
+            return httpx.Response(200, json={'data': [{'embedding': [0.1, 0.2]}], 'usage': {'prompt_tokens': 3}})
+        if len(calls) == 1:
+            return httpx.Response(429, json={'error': {'message': 'Slow down'}})
+        return httpx.Response(200, json={'choices': [], 'usage': {'prompt_tokens': 50, 'completion_tokens': 5}})
+    return httpx.MockTransport(handler)
+
+
+class TestRecordingTransport(IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'recording.json')
+
+    async def send(self, transport, path, body):
+        async with httpx.AsyncClient(transport=transport, base_url='https://api.test/v1') as client:
+            return await client.post(path, json=body)
+
+    async def test_record_then_replay_offline(self):
+        calls = []
+        recorder = RecordingTransport(self.path, openai_stub(calls))
+        self.assertEqual((await self.send(recorder, '/chat/completions', {'q': 1})).status_code, 429)
+        self.assertEqual((await self.send(recorder, '/chat/completions', {'q': 1})).status_code, 200)
+        await self.send(recorder, '/chat/completions', {'q': 1})
+        recorder.save()
+        # The error was retried, the success answered from the recording
+        self.assertEqual(len(calls), 2)
+
+        replay = RecordingTransport(self.path, offline=True)
+        response = await self.send(replay, '/chat/completions', {'q': 1})
+        self.assertEqual(response.json()['usage']['completion_tokens'], 5)
+        with self.assertRaises(httpx.ConnectError):
+            await self.send(replay, '/chat/completions', {'q': 2})
+
+    async def test_usage_counts_each_request_once(self):
+        calls = []
+        embeddings = RecordingTransport(self.path, openai_stub(calls), paths=('/embeddings',))
+        recording = RecordingTransport(None, embeddings, fresh=True)
+        transport = UsageTransport(recording)
+        totals = {}
+        usage.set(totals)
+        for _ in range(2):
+            await self.send(transport, '/embeddings', {'input': 'hello'})
+        await self.send(transport, '/chat/completions', {'q': 1})
+
+        self.assertEqual(calls, ['/v1/embeddings', '/v1/chat/completions'])
+        self.assertEqual(totals['embeddings'], {'requests': 2, 'replayed': 1, 'prompt_tokens': 6, 'completion_tokens': 0})
+        self.assertEqual(totals['completions']['requests'], 1)
+        embeddings.save()
+        with open(self.path) as f:
+            self.assertEqual(len(json.load(f)), 1)
+
+
+class TestScoring(TestCase):
+    def test_operation_accuracy_counts_parameters(self):
+        expected = {'type': 'banking_operation', 'operation': {'action': 'REGISTER', 'user_name': 'John', 'amount': 1000}}
+        actual = {'type': 'banking_operation', 'operation': {'action': 'REGISTER', 'user_name': 'John', 'amount': 10}}
+        self.assertEqual(score_response(actual, expected), (1.0, 2 / 3))
+        self.assertEqual(score_response({'type': 'general_inquiry', 'response': 'x'}, expected), (0.0, 0.0))
+
+    def test_retrieval_scores_use_the_ranking(self):
+        contents = ["Cards arrive in a week.", "The minimum deposit is 10 euros.", "Fees are listed online."]
+        scores = score_retrieval(contents, ["minimum deposit"], k=3)
+        self.assertEqual(scores['mrr'], 0.5)
+        self.assertAlmostEqual(scores['precision_at_k'], 1 / 3)
+        self.assertAlmostEqual(scores['ndcg'], 1 / np.log2(3))
+        self.assertEqual(score_retrieval(contents[1:], ["minimum deposit"], k=1),
+                         {'mrr': 1.0, 'precision_at_k': 1.0, 'ndcg': 1.0})
+        self.assertEqual(score_retrieval([], ["minimum deposit"], k=3), {'mrr': 0.0, 'precision_at_k': 0.0, 'ndcg': 0.0})
+
+    def test_summary(self):
+        result = {
+            'scores': dict.fromkeys(METRICS, 1.0), 'latency_ms': 100.0,
+            'stages': {'completion': {'start_ms': 0.0, 'duration_ms': 80.0}},
+            'tokens': {'completions': {'requests': 1, 'replayed': 0, 'prompt_tokens': 10, 'completion_tokens': 2}},
+        }
+        summary = summarize([result, dict(result, scores=dict.fromkeys(METRICS, 0.0), error='Timeout')])
+        self.assertEqual((summary['queries'], summary['errors'], summary['mrr']), (2, 1, 0.5))
+        self.assertEqual(summary['latency_ms']['p50'], 100.0)
+        self.assertEqual(summary['stages_ms']['completion']['max'], 80.0)
+        self.assertEqual(summary['tokens']['completions']['prompt_tokens'], 20)
@@ -0,0 +1,88 @@
+import json
+import random
+from unittest import IsolatedAsyncioTestCase, TestCase
+import numpy as np
+from openai import AsyncOpenAI, RateLimitError
+from ..services.fake_openai import FakeOpenAIServer, LatencyModel, hashed_embedding, EMBEDDING_DIMENSIONS
+from ..services.openai_service import system_prompt
+
+
+class TestHashedEmbedding(TestCase):
+    def test_deterministic_unit_vectors(self):
+        vector = hashed_embedding("How do I transfer money?")
+        self.assertEqual(len(vector), EMBEDDING_DIMENSIONS)
+        self.assertEqual(vector, hashed_embedding("how do I TRANSFER money"))
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+        self.assertAlmostEqual(float(np.linalg.norm(hashed_embedding(""))), 1.0, places=5)
+
+    def test_shared_words_are_similar(self):
+        query = np.array(hashed_embedding("transfer money to another account"))
+        related = np.array(hashed_embedding("You can transfer money to any account with its IBAN"))
+        unrelated = np.array(hashed_embedding("Passwords are never stored in plain text"))
+        self.assertGreater(query @ related, query @ unrelated)
+
+    def test_latency_model(self):
+        rng = random.Random(1)
+        samples = sorted(LatencyModel(0.1, 0.5).sample(rng) for _ in range(1001))
+        self.assertAlmostEqual(samples[500], 0.1, delta=0.02)
+        self.assertEqual(LatencyModel(0.0, per_token=0.01).sample(rng, 10), 0.1)
+
+
+class TestFakeOpenAIServer(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await FakeOpenAIServer(latency_scale=0, retry_after=0, seed=0).start()
+        self.client = AsyncOpenAI(api_key='test', base_url=self.server.base_url, max_retries=0)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    def messages(self, text, context="Transfers are free of charge. They arrive instantly."):
+        return [{'role': 'system', 'content': system_prompt(context)},
+                {'role': 'user', 'content': text}]
+
+    async def ask(self, text, **kwargs):
+        response = await self.client.chat.completions.create(model='gpt-4o-mini', messages=self.messages(text), **kwargs)
+        return json.loads(response.choices[0].message.content), response.usage
+
+    async def test_embeddings(self):
+        response = await self.client.embeddings.create(model='text-embedding-3-small', input=['a b', 'c'])
+        self.assertEqual([item.embedding for item in response.data], [hashed_embedding('a b'), hashed_embedding('c')])
+        self.assertGreater(response.usage.prompt_tokens, 0)
+
+    async def test_chat_follows_the_system_prompt_schema(self):
+        reply, usage = await self.ask("Deposit 500")
+        self.assertEqual(reply, {'type': 'banking_operation', 'operation': {'action': 'DEPOSIT', 'amount': 500}})
+        self.assertGreater(usage.prompt_tokens, usage.completion_tokens)
+
+        reply, _ = await self.ask("Do transfers cost anything?")
+        self.assertEqual(reply, {'type': 'general_inquiry', 'response': "Transfers are free of charge."})
+
+        self.server.script(r"open an account for (\w+)", lambda message: {
+            'type': 'banking_operation', 'operation': {'action': 'REGISTER', 'user_name': message.split()[-1]}
+        })
+        reply, _ = await self.ask("I'd like to open an account for Maria")
+        self.assertEqual(reply['operation'], {'action': 'REGISTER', 'user_name': 'Maria'})
+
+    async def test_prompt_without_context(self):
+        response = await self.client.chat.completions.create(
+            model='gpt-4o-mini', messages=self.messages("Do transfers cost anything?", context=''))
+        reply = json.loads(response.choices[0].message.content)
+        self.assertEqual(reply['response'], "I'm sorry, I don't have information about that.")
+        self.assertNotIn('relevant context', self.messages("Hi", context='')[0]['content'])
+
+    async def test_streaming(self):
+        stream = await self.client.chat.completions.create(model='gpt-4o-mini', messages=self.messages("Deposit 5"),
+                                                          stream=True)
+        content = ''.join([chunk.choices[0].delta.content or '' async for chunk in stream])
+        self.assertEqual(json.loads(content)['operation']['amount'], 5)
+
+    async def test_injected_errors(self):
+        self.server.fail_next(429)
+        with self.assertRaises(RateLimitError):
+            await self.client.embeddings.create(model='text-embedding-3-small', input='hi')
+        self.server.error_rate = 1.0
+        self.server.error_statuses = (503,)
+        with self.assertRaises(Exception):
+            await self.client.embeddings.create(model='text-embedding-3-small', input='hi')
+        self.assertEqual(self.server.stats()['errors'], {429: 1, 503: 1})
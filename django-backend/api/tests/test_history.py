@@ -0,0 +1,53 @@
+from unittest import IsolatedAsyncioTestCase
+from ..services.history_service import ConversationHistory, count_message_tokens, SUMMARY_PREFIX
+
+
+class TestConversationHistory(IsolatedAsyncioTestCase):
+    def test_keeps_recent_turns_within_budget(self):
+        history = ConversationHistory(token_budget=60)
+        for i in range(20):
+            history.append('user' if i % 2 == 0 else 'assistant', f"message number {i} " * 3)
+        self.assertLessEqual(history.tokens, 60)
+        self.assertEqual(history.messages[-1]['content'], "message number 19 " * 3)
+        self.assertEqual(history.tokens, sum(count_message_tokens(m) for m in history.messages))
+        self.assertEqual(history.trimmed_messages + len(history), 20)
+        self.assertGreater(history.stats()['trimmed_tokens'], 0)
+
+    def test_system_messages_are_pinned(self):
+        history = ConversationHistory(token_budget=40)
+        history.append('system', "You are a bank assistant")
+        for i in range(10):
+            history.append('user', f"deposit {i} euros please")
+        self.assertEqual(history.messages[0]['role'], 'system')
+        self.assertLessEqual(history.tokens, 40)
+
+    def test_newest_message_is_kept_even_when_too_large(self):
+        history = ConversationHistory(token_budget=5)
+        history.append('user', "x" * 400)
+        self.assertEqual(len(history), 1)
+
+    async def test_dropped_turns_are_summarized(self):
+        calls = []
+
+        async def summarizer(previous, messages):
+            calls.append((previous, [m['content'] for m in messages]))
+            return f"{len(messages)} earlier messages"
+
+        history = ConversationHistory(token_budget=50, summarizer=summarizer)
+        for i in range(8):
+            history.append('user', f"turn {i} " * 4)
+        await history.summarize()
+        self.assertEqual(len(calls), 1)
+        self.assertIsNone(calls[0][0])
+        window = history.window()
+        self.assertTrue(window[0]['content'].startswith(SUMMARY_PREFIX))
+        self.assertLessEqual(history.tokens, 50)
+
+        # Room taken by the summary pushes out more turns, which are folded
+        # into the existing summary on the next call
+        self.assertGreater(history.trimmed_messages, len(calls[0][1]))
+        await history.summarize()
+        self.assertEqual(calls[1][0], f"{len(calls[0][1])} earlier messages")
+
+        await history.summarize()
+        self.assertEqual(len(calls), 2)
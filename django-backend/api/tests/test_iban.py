@@ -0,0 +1,39 @@
+from unittest import TestCase
+from django.test import TestCase as DatabaseTestCase
+from ..models import User
+from ..services.iban import IbanAllocator, is_valid_iban, iban_check_digits
+from ..services.user_service import UserService
+
+
+class TestIbanCheckDigits(TestCase):
+    def test_known_iban(self):
+        self.assertTrue(is_valid_iban("GR16 0110 1250 0000 0001 2300 695"))
+        self.assertFalse(is_valid_iban("GR17 0110 1250 0000 0001 2300 695"))
+        self.assertEqual(iban_check_digits("GR", "01101250000000012300695"), "16")
+
+    def test_formatted_ibans_are_valid(self):
+        allocator = IbanAllocator("999", "0001")
+        for number in (0, 1, 42, 10 ** 16 - 1):
+            value = allocator.format(number)
+            self.assertEqual(len(value), 27)
+            self.assertTrue(is_valid_iban(value), value)
+
+    def test_bank_code_is_checked(self):
+        with self.assertRaises(ValueError):
+            IbanAllocator("99", "0001")
+
+
+class TestIbanAllocation(DatabaseTestCase):
+    def test_blocks_never_overlap(self):
+        first, second = IbanAllocator("999", "0001", block_size=3), IbanAllocator("999", "0001", block_size=3)
+        numbers = [allocator.next_account_number() for _ in range(4) for allocator in (first, second)]
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    def test_register(self):
+        service = UserService()
+        user, message = service.register("Maria", 100)
+        self.assertEqual(message, "User created successfully")
+        self.assertTrue(is_valid_iban(user.iban))
+        self.assertEqual(user.transactions.get().balance_after, 100)
+        self.assertEqual(service.register("Maria"), (None, "User with this name already exists"))
+        self.assertEqual(User.objects.count(), 1)
@@ -0,0 +1,66 @@
+from unittest import TestCase
+from ..services.intent_parser import IntentParser
+from ..evaluation.cases import TEST_CASES
+
+
+class TestIntentParser(TestCase):
+    def setUp(self):
+        self.parser = IntentParser()
+
+    def test_banking_faq_cases(self):
+        """Whatever the fast path answers must match the expected LLM output"""
+        matched = []
+        for cases in TEST_CASES.values():
+            for case in cases:
+                result = self.parser.parse(case["query"])
+                if result is not None:
+                    self.assertEqual(result, case["expected_response"], case["query"])
+                    matched.append(case["query"])
+        self.assertIn("Register John with 1000 euros", matched)
+        self.assertIn("Show John's balance", matched)
+        self.assertIn("Transfer 300 euros to GR1234567890", matched)
+
+    def test_simple_commands(self):
+        cases = {
+            "Deposit 500 euros": {"action": "DEPOSIT", "amount": 500},
+            "please withdraw €200.": {"action": "WITHDRAW", "amount": 200},
+            "Transfer 300 to gr1234567890": {"action": "TRANSFER", "amount": 300, "iban": "GR1234567890"},
+            "What's my IBAN?": {"action": "IBAN"},
+            "check balance": {"action": "BALANCE"},
+            "deposit 1,000 euros into my account": {"action": "DEPOSIT", "amount": 1000},
+        }
+        for message, operation in cases.items():
+            self.assertEqual(self.parser.parse(message), {"type": "banking_operation", "operation": operation}, message)
+
+    def test_falls_back_when_unsure(self):
+        for message in [
+            "Take out 0.5 euros from my account",
+            "Withdraw 0",
+            "What is the minimum deposit?",
+            "I need to send 50 euros to GR9876543210 and then deposit 200 euros",
+            "Register me",
+        ]:
+            self.assertIsNone(self.parser.parse(message), message)
+
+    def test_bare_name_and_amount_is_not_a_registration(self):
+        """A registration needs its verb, a capitalized word before an amount may be anything"""
+        for message in [
+            "Withdrawal 200",
+            "Payment 50",
+            "Refund 20 euros",
+            "Hello 100",
+            "Thanks 5",
+            "Pin 1234",
+            "Loan 5000",
+            "Mortgage 200000",
+            "Giannis Papadopoulos 2500",
+        ]:
+            self.assertIsNone(self.parser.parse(message), message)
+
+    def test_match_rate(self):
+        self.parser.parse("Deposit 5")
+        self.parser.parse("How do transfers work?")
+        stats = self.parser.stats()
+        self.assertEqual((stats["attempts"], stats["matches"]), (2, 1))
+        self.assertEqual(stats["match_rate"], 0.5)
+        self.assertEqual(stats["by_action"], {"DEPOSIT": 1})
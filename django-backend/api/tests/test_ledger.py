@@ -0,0 +1,136 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+from ..models import User, Transaction, BalanceSnapshot
+from ..services.ledger_service import ledger_service
+from ..services.user_service import UserService, IDEMPOTENCY_KEY_REUSED
+
+
+class TestLedger(TestCase):
+    def setUp(self):
+        self.service = UserService()
+        self.alice = User.objects.create(name="Alice", iban="GR0000000000000000000000001", balance=0)
+        self.bob = User.objects.create(name="Bob", iban="GR0000000000000000000000002", balance=0)
+
+    def balance(self, user):
+        return User.objects.get(id=user.id).balance
+
+    def test_changes_are_recorded(self):
+        self.service.change_balance("Alice", 100)
+        self.service.change_balance("Alice", -30)
+        self.service.transfer(self.alice.id, 20, self.bob.iban)
+        entries = list(self.alice.transactions.order_by('id').values_list('kind', 'amount', 'balance_after'))
+        self.assertEqual(entries, [
+            (Transaction.DEPOSIT, 100, 100),
+            (Transaction.WITHDRAW, -30, 70),
+            (Transaction.TRANSFER_OUT, -20, 50),
+        ])
+        incoming = self.bob.transactions.get()
+        self.assertEqual((incoming.kind, incoming.amount, incoming.counterparty_id), (Transaction.TRANSFER_IN, 20, self.alice.id))
+        self.assertEqual((self.balance(self.alice), self.balance(self.bob)), (50, 20))
+
+    def test_idempotency_keys(self):
+        first, _ = self.service.change_balance("Alice", 100, idempotency_key="refund-1")
+        again, error = self.service.change_balance("Alice", 100, idempotency_key="refund-1")
+        self.assertIsNone(error)
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(self.balance(self.alice), 100)
+        self.assertEqual(self.service.change_balance("Alice", 5, idempotency_key="refund-1"), (None, IDEMPOTENCY_KEY_REUSED))
+
+        self.assertTrue(self.service.transfer(self.alice.id, 40, self.bob.iban, idempotency_key="t-1")[0])
+        self.assertTrue(self.service.transfer(self.alice.id, 40, self.bob.iban, idempotency_key="t-1")[0])
+        self.assertEqual((self.balance(self.alice), self.balance(self.bob)), (60, 40))
+
+    def test_insufficient_balance_writes_nothing(self):
+        self.assertEqual(self.service.change_balance("Alice", -1), (None, "Insufficient balance"))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_snapshots_and_verify(self):
+        self.service.change_balance("Alice", 100)
+        self.assertEqual(ledger_service.take_snapshots(), 1)
+        self.assertEqual(ledger_service.take_snapshots(), 0)
+        self.service.change_balance("Alice", -10)
+        self.assertTrue(ledger_service.verify(self.alice.id)['consistent'])
+        self.assertEqual(BalanceSnapshot.objects.get().balance, 100)
+
+        User.objects.filter(id=self.alice.id).update(balance=1000)
+        self.assertFalse(ledger_service.verify(self.alice.id)['consistent'])
+
+    def test_balance_is_read_only_over_the_api(self):
+        self.service.change_balance("Alice", 100)
+        client = APIClient()
+        response = client.patch(f'/api/users/{self.alice.id}/', {'balance': 1000000, 'name': 'Alicia'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['balance'], 100)
+        response = client.post('/api/users/', {'name': 'Carol', 'iban': 'GR0000000000000000000000003',
+                                               'balance': 500}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['balance'], 0)
+        for user in User.objects.all():
+            report = ledger_service.verify(user.id)
+            self.assertEqual(report['balance'], report['ledger_balance'])
+
+    def test_transactions_endpoint(self):
+        for amount in range(1, 6):
+            self.service.change_balance("Alice", amount)
+        client = APIClient()
+        response = client.get(f'/api/users/{self.alice.id}/transactions/', {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['amount'] for entry in response.data['results']], [5, 4, 3])
+        response = client.get(response.data['next'])
+        self.assertEqual([entry['amount'] for entry in response.data['results']], [2, 1])
+        self.assertIsNone(response.data['next'])
+
+        response = client.get(f'/api/users/{self.alice.id}/transactions/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestBulkBalance(TestCase):
+    def setUp(self):
+        self.service = UserService()
+        self.accounts = [
+            User.objects.create(name=f"User {index}", iban=f"GR00000000000000000000000{index}", balance=100)
+            for index in range(3)
+        ]
+
+    def operation(self, account, action, amount, key):
+        return {'iban': account.iban, 'action': action, 'amount': amount, 'idempotency_key': key}
+
+    def balances(self):
+        return list(User.objects.order_by('id').values_list('balance', flat=True))
+
+    def test_batches_apply_per_account_in_order(self):
+        a, b, c = self.accounts
+        operations = [
+            self.operation(b, 'DEPOSIT', 10, 'k1'),
+            self.operation(a, 'WITHDRAW', 150, 'k2'),
+            self.operation(a, 'DEPOSIT', 60, 'k3'),
+            self.operation(a, 'WITHDRAW', 150, 'k4'),
+            self.operation(c, 'DEPOSIT', -5, 'k5'),
+            {'iban': 'GR99', 'action': 'DEPOSIT', 'amount': 1, 'idempotency_key': 'k6'},
+            self.operation(b, 'DEPOSIT', 10, 'k1'),
+        ]
+        results = self.service.apply_balance_changes(operations, batch_size=2)
+        self.assertEqual([result['status'] for result in results],
+                         ['success', 'error', 'success', 'success', 'error', 'error', 'duplicate'])
+        self.assertEqual(results[1]['error'], "Insufficient balance")
+        self.assertEqual(results[3]['balance_after'], 10)
+        self.assertEqual(results[6]['transaction_id'], results[0]['transaction_id'])
+        self.assertEqual(self.balances(), [10, 110, 100])
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_replayed_request_is_not_applied_twice(self):
+        operations = [self.operation(account, 'DEPOSIT', 5, f"interest-{account.id}") for account in self.accounts]
+        self.service.apply_balance_changes(operations)
+        results = self.service.apply_balance_changes(operations)
+        self.assertTrue(all(result['status'] == 'duplicate' for result in results))
+        self.assertEqual(self.balances(), [105, 105, 105])
+
+    def test_endpoint(self):
+        client = APIClient()
+        response = client.post('/api/users/bulk_balance/', {'operations': [
+            self.operation(self.accounts[0], 'DEPOSIT', 5, 'a'),
+            self.operation(self.accounts[1], 'REFUND', 5, 'b'),
+        ]}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (1, 1))
+        self.assertEqual(client.post('/api/users/bulk_balance/', [], format='json').status_code, 400)
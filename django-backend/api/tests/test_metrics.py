@@ -0,0 +1,92 @@
+from unittest import IsolatedAsyncioTestCase, mock
+from django.test import SimpleTestCase
+import httpx
+from openai import APIConnectionError, AsyncOpenAI
+from ..services import metrics
+from ..services.fake_openai import FakeOpenAIServer
+from ..services.metrics import Counter, Histogram, MetricsRegistry
+from ..services.openai_service import OpenAIService, system_prompt
+from ..services.timing import StageTimings
+
+
+class TestMetricsRegistry(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', "Latency", ('span',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, 'a"b')
+        samples = dict(histogram.samples())
+        self.assertEqual(samples['latency_seconds_bucket{span="a\\"b",le="0.1"}'], 2)
+        self.assertEqual(samples['latency_seconds_bucket{span="a\\"b",le="1.0"}'], 3)
+        self.assertEqual(samples['latency_seconds_bucket{span="a\\"b",le="+Inf"}'], 4)
+        self.assertEqual(samples['latency_seconds_count{span="a\\"b"}'], 4)
+        self.assertAlmostEqual(samples['latency_seconds_sum{span="a\\"b"}'], 3.65)
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.counter('errors', "Failures", ('source',)).inc(2, 'parse')
+        registry.collector('cache', lambda: {'hits': 3, 'hit_rate': 0.75, 'by_kind': {'x': 1}, 'name': 'lru'},
+                           counters=('hits',))
+        registry.collector('missing', lambda: None)
+        text = registry.render()
+        self.assertIn('# TYPE errors counter\nerrors_total{source="parse"} 2\n', text)
+        self.assertIn('# TYPE cache_hits counter\ncache_hits_total 3\n', text)
+        self.assertIn('cache_hit_rate 0.75\n', text)
+        self.assertIn('cache_by_kind{key="x"} 1\n', text)
+        self.assertNotIn('lru', text)
+        self.assertNotIn('missing', text)
+
+    def test_stages_and_timed_functions_are_spans(self):
+        before = metrics.spans.count('test_stage')
+        with StageTimings().stage('test_stage'):
+            pass
+        self.assertEqual(metrics.spans.count('test_stage'), before + 1)
+
+        @metrics.timed('test_function')
+        def function():
+            return 1
+
+        self.assertEqual(function(), 1)
+        self.assertEqual(metrics.spans.count('test_function'), 1)
+        with self.settings(METRICS_ENABLED=False):
+            function()
+        self.assertEqual(metrics.spans.count('test_function'), 1)
+
+
+class TestMetricsView(SimpleTestCase):
+    def test_prometheus_text(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE span_seconds histogram', body)
+        self.assertIn('chat_queue_queued_total', body)
+
+
+class TestTokenCounting(IsolatedAsyncioTestCase):
+    async def test_streamed_completion_usage(self):
+        async with FakeOpenAIServer(latency_scale=0) as server:
+            client = AsyncOpenAI(api_key='test', base_url=server.base_url, max_retries=0)
+            tokens = Counter('openai_tokens', "Tokens", ('model', 'kind'))
+            with mock.patch.object(OpenAIService, 'client', property(lambda self: client)), \
+                    mock.patch.object(metrics, 'tokens', tokens):
+                content = await OpenAIService()._stream_completion([
+                    {'role': 'system', 'content': system_prompt('')},
+                    {'role': 'user', 'content': 'Deposit 20'},
+                ], on_delta=mock.AsyncMock())
+            await client.close()
+        self.assertIn('DEPOSIT', content)
+        self.assertGreater(tokens.value('gpt-4o-mini', 'prompt'), 0)
+        self.assertGreater(tokens.value('gpt-4o-mini', 'completion'), 0)
+
+
+class TestRetrievalErrors(IsolatedAsyncioTestCase):
+    async def test_failed_retrieval_returns_an_error(self):
+        service = OpenAIService()
+        failure = APIConnectionError(request=httpx.Request('POST', 'http://test/v1/embeddings'))
+        errors = Counter('errors', "Failures", ('source',))
+        with mock.patch.object(service.rag_service, 'retrieve_context', mock.AsyncMock(side_effect=failure)), \
+                mock.patch.object(metrics, 'errors', errors):
+            result = await service.process_message("When are you open?")
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(result['error'], "OpenAI API error: Connection error.")
+        self.assertEqual(errors.value('retrieval'), 1)
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase
+from django.test import SimpleTestCase, override_settings
+from ..management.commands.profile_worker import top_functions
+from ..services.profiler import LoopLagMonitor, SamplingProfiler, profile
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class TestSamplingProfiler(IsolatedAsyncioTestCase):
+    async def test_collapsed_stacks_of_every_thread(self):
+        task = asyncio.get_running_loop().run_in_executor(None, busy_wait, 0.3)
+        stacks, samples = await profile(0.2, interval=0.005)
+        await task
+        self.assertGreater(samples, 5)
+        lines = stacks.splitlines()
+        self.assertTrue(all(line.rpartition(' ')[2].isdigit() for line in lines))
+        self.assertTrue(any('busy_wait (tests/test_profiler.py:' in line for line in lines))
+        self.assertIn('busy_wait', top_functions(stacks, 1)[0][1])
+
+    async def test_one_profile_at_a_time(self):
+        profiler = SamplingProfiler().start()
+        try:
+            with self.assertRaises(RuntimeError):
+                SamplingProfiler().start()
+        finally:
+            profiler.stop()
+
+
+class TestLoopLagMonitor(IsolatedAsyncioTestCase):
+    async def test_logs_the_blocking_call(self):
+        monitor = LoopLagMonitor(threshold=0.05).start()
+        await asyncio.sleep(0.05)
+
+        async def blocking_handler():
+            time.sleep(0.2)
+
+        with self.assertLogs('api.services.profiler', 'WARNING') as logs:
+            await asyncio.create_task(blocking_handler(), name='slow-turn')
+            await asyncio.sleep(0.05)
+        await monitor.stop()
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('in task slow-turn (', logs.output[0])
+        self.assertNotIn('manage.py', logs.output[0])
+        self.assertIn('time.sleep(0.2)', logs.output[0])
+        self.assertGreaterEqual(monitor.stats()['stalls'], 1)
+
+
+class TestProfileView(SimpleTestCase):
+    def test_disabled_by_default(self):
+        self.assertEqual(self.client.get('/debug/profile').status_code, 404)
+
+    @override_settings(PROFILER_ENABLED=True, PROFILER_TOKEN='secret')
+    def test_token_required(self):
+        self.assertEqual(self.client.get('/debug/profile?seconds=0.1').status_code, 403)
+        response = self.client.get('/debug/profile?seconds=0.1', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/debug/profile?seconds=0.1&interval=0.005',
+                                   headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-Profile-Samples']), 0)
+        response = self.client.get('/debug/profile?seconds=3600', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,93 @@
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+from openai import AsyncOpenAI
+from ..services.fake_openai import FakeOpenAIServer
+from ..services.openai_service import OpenAIService
+from ..services.response_cache import ResponseCache
+
+ANSWER = {'type': 'general_inquiry', 'response': 'We are open 9:00 to 17:00.'}
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_size=2, threshold=0.9, ttl=60)
+
+    def test_similar_query_with_same_context_hits(self):
+        self.cache.set([1.0, 0.0], "opening hours", ANSWER, document_ids=[1])
+        self.assertEqual(self.cache.get([0.99, 0.05], "opening hours"), ANSWER)
+        self.assertIsNone(self.cache.get([0.0, 1.0], "opening hours"))
+        self.assertIsNone(self.cache.get([1.0, 0.0], "fees"))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 1 / 3)
+
+    def test_scopes_are_separate(self):
+        self.cache.set([1.0, 0.0], "opening hours", ANSWER, scope='session-a')
+        self.assertIsNone(self.cache.get([1.0, 0.0], "opening hours"))
+        self.assertIsNone(self.cache.get([1.0, 0.0], "opening hours", 'session-b'))
+        self.assertEqual(self.cache.get([1.0, 0.0], "opening hours", 'session-a'), ANSWER)
+
+    def test_banking_operations_are_not_cached(self):
+        self.cache.set([1.0, 0.0], "", {'type': 'banking_operation', 'operation': {'action': 'BALANCE'}})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        self.cache.set([1.0, 0.0], "a", ANSWER)
+        self.cache.set([1.0, 0.0], "b", ANSWER)
+        self.cache.get([1.0, 0.0], "a")
+        self.cache.set([1.0, 0.0], "c", ANSWER)
+        self.assertIsNone(self.cache.get([1.0, 0.0], "b"))
+        self.assertEqual(self.cache.get([1.0, 0.0], "a"), ANSWER)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        self.cache.ttl = 0.01
+        self.cache.set([1.0, 0.0], "a", ANSWER)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get([1.0, 0.0], "a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_document(self):
+        self.cache.set([1.0, 0.0], "a", ANSWER, document_ids=[7])
+        self.cache.set([0.0, 1.0], "b", ANSWER, document_ids=[8])
+        self.cache.invalidate_document(7)
+        self.assertIsNone(self.cache.get([1.0, 0.0], "a"))
+        self.assertEqual(self.cache.get([0.0, 1.0], "b"), ANSWER)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+
+class TestResponseCacheSessions(IsolatedAsyncioTestCase):
+    GREETING = {'role': 'assistant', 'content': 'Register by typing your full name and your current account balance'}
+
+    async def asyncSetUp(self):
+        self.server = await FakeOpenAIServer(latency_scale=0).start()
+        self.client = AsyncOpenAI(api_key='test', base_url=self.server.base_url, max_retries=0)
+        self.service = OpenAIService()
+        self.service.response_cache = ResponseCache(threshold=0.9)
+        self.service.rag_service = mock.Mock(retrieve_context=mock.AsyncMock(
+            return_value=([1.0, 0.0], "We are open 9:00 to 17:00.", [1])))
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.close()
+
+    async def ask(self, history, session):
+        with mock.patch.object(OpenAIService, 'client', property(lambda service: self.client)):
+            response = await self.service.process_message("When are you open?", history, session=session)
+        self.assertEqual(response['status'], 'success')
+        return self.server.stats()['requests'].get('completions', 0)
+
+    async def test_personal_answers_stay_in_their_session(self):
+        maria = [self.GREETING, {'role': 'user', 'content': 'Register Maria with 500 euros'},
+                 {'role': 'assistant', 'content': 'Successfully registered user Maria'}]
+        nikos = [self.GREETING, {'role': 'user', 'content': 'Register Nikos with 20 euros'},
+                 {'role': 'assistant', 'content': 'Successfully registered user Nikos'}]
+        self.assertEqual(await self.ask(maria, 'a'), 1)
+        self.assertEqual(await self.ask(nikos, 'b'), 2)
+        self.assertEqual(await self.ask(maria, 'a'), 2)
+        # Without a session a personal history isn't cached at all
+        self.assertEqual(await self.ask(maria, None), 3)
+
+    async def test_answers_to_fresh_sessions_are_shared(self):
+        self.assertEqual(await self.ask([self.GREETING], 'a'), 1)
+        self.assertEqual(await self.ask([self.GREETING], 'b'), 1)
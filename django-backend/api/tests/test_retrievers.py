@@ -0,0 +1,311 @@
+import os
+import tempfile
+import threading
+import numpy as np
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+from django.test import TestCase as DatabaseTestCase, override_settings
+from ..models import Document
+from ..services.rag_service import RAGService, select_chunks
+from ..services.retrievers import BM25Index, BruteForceRetriever, IVFRetriever, HNSWRetriever, reciprocal_rank_fusion
+
+
+class TestBruteForceRetriever(TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+        self.index = BruteForceRetriever(initial_capacity=2)
+        self.vectors = {doc_id: self.rng.normal(size=16).tolist() for doc_id in range(1, 11)}
+        for doc_id, vector in self.vectors.items():
+            self.index.add(doc_id, vector)
+
+    def brute_force(self, query, k):
+        """Reference ranking computed the way RAGService used to"""
+        scored = []
+        for doc_id, vector in self.vectors.items():
+            a, b = np.array(query), np.array(vector)
+            scored.append((np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)), doc_id))
+        scored.sort(reverse=True)
+        return [doc_id for _, doc_id in scored[:k]]
+
+    def test_search_matches_brute_force(self):
+        for _ in range(5):
+            query = self.rng.normal(size=16).tolist()
+            for k in (1, 3, 10, 20):
+                result = [doc_id for doc_id, _ in self.index.search(query, k)]
+                self.assertEqual(result, self.brute_force(query, k))
+
+    def test_scores_are_cosine_similarities(self):
+        doc_id, score = self.index.search(self.vectors[4], 1)[0]
+        self.assertEqual(doc_id, 4)
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_remove_and_replace(self):
+        self.index.remove(4)
+        del self.vectors[4]
+        self.index.remove(4)
+        self.assertEqual(len(self.index), 9)
+
+        self.vectors[10] = self.rng.normal(size=16).tolist()
+        self.index.add(10, self.vectors[10])
+        self.assertEqual(len(self.index), 9)
+
+        query = self.rng.normal(size=16).tolist()
+        result = [doc_id for doc_id, _ in self.index.search(query, 9)]
+        self.assertEqual(result, self.brute_force(query, 9))
+
+    def test_empty_index(self):
+        self.assertEqual(BruteForceRetriever().search([1.0, 0.0], 3), [])
+
+    def test_accepts_binary_embeddings(self):
+        data = Document.encode_embedding(self.vectors[3])
+        self.assertEqual(len(data), 16 * 4)
+        np.testing.assert_allclose(Document.decode_embedding(data), self.vectors[3], rtol=1e-6)
+
+        index = BruteForceRetriever()
+        index.add(3, memoryview(data))
+        self.assertEqual(index.search(self.vectors[3], 1)[0][0], 3)
+
+
+class TestApproximateRetrievers(TestCase):
+    """Recall of the ANN backends against exact search on clustered data"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(11)
+        centers = rng.normal(size=(20, 32))
+        cls.vectors = {
+            doc_id: (centers[doc_id % 20] + 0.3 * rng.normal(size=32)).astype(np.float32)
+            for doc_id in range(1, 1001)
+        }
+        cls.queries = [centers[i % 20] + 0.3 * rng.normal(size=32) for i in range(30)]
+        cls.exact = BruteForceRetriever()
+        for doc_id, vector in cls.vectors.items():
+            cls.exact.add(doc_id, vector)
+
+    def recall(self, retriever, k=10):
+        hits = 0
+        for query in self.queries:
+            expected = {doc_id for doc_id, _ in self.exact.search(query, k)}
+            hits += len(expected & {doc_id for doc_id, _ in retriever.search(query, k)})
+        return hits / (k * len(self.queries))
+
+    def build(self, retriever):
+        for doc_id, vector in self.vectors.items():
+            retriever.add(doc_id, vector)
+        return retriever
+
+    def test_ivf_recall(self):
+        retriever = self.build(IVFRetriever(nlist=16, nprobe=4))
+        retriever.train()
+        self.assertGreaterEqual(self.recall(retriever), 0.9)
+        retriever.nprobe = 16
+        self.assertEqual(self.recall(retriever), 1.0)
+
+    def test_ivf_retrains_in_the_background(self):
+        retriever = self.build(IVFRetriever(nlist=16, nprobe=4))
+        retriever.train()
+        old_centroids = retriever._centroids
+        kmeans = retriever._kmeans
+        started, release = threading.Event(), threading.Event()
+
+        def slow_kmeans(data):
+            started.set()
+            release.wait(5)
+            return kmeans(data)
+
+        for doc_id in range(1001, 2001):
+            retriever.add(doc_id, self.vectors[doc_id - 1000])
+        with mock.patch.object(retriever, '_kmeans', slow_kmeans):
+            retriever.maybe_train()
+            self.assertTrue(started.wait(5))
+            # Searches and updates go on with the old centroids meanwhile
+            self.assertEqual(len(retriever.search(self.queries[0], 5)), 5)
+            retriever.add(5000, self.vectors[1])
+            retriever.remove(1)
+            self.assertIs(retriever._centroids, old_centroids)
+            release.set()
+            retriever._training.join(5)
+        self.assertIsNot(retriever._centroids, old_centroids)
+        self.assertEqual(retriever._trained_size, 2000)
+        retriever.nprobe = 16
+        self.assertIn(5000, [doc_id for doc_id, _ in retriever.search(self.vectors[1], 2)])
+        expected = retriever._assign(retriever._matrix[:len(retriever)])
+        np.testing.assert_array_equal(retriever._labels[:len(retriever)], expected)
+
+    def test_hnsw_recall(self):
+        retriever = self.build(HNSWRetriever(m=8, ef_construction=64, ef_search=64))
+        self.assertGreaterEqual(self.recall(retriever), 0.9)
+
+    def test_hnsw_skips_removed_documents(self):
+        retriever = self.build(HNSWRetriever(m=8, ef_construction=32, ef_search=32))
+        top = retriever.search(self.vectors[5], 1)[0][0]
+        self.assertEqual(top, 5)
+        retriever.remove(5)
+        self.assertNotIn(5, [doc_id for doc_id, _ in retriever.search(self.vectors[5], 10)])
+        self.assertEqual(len(retriever), 999)
+
+    def test_save_and_load(self):
+        for retriever in (BruteForceRetriever(), IVFRetriever(nlist=16, nprobe=4),
+                          HNSWRetriever(m=8, ef_construction=32, ef_search=32)):
+            self.build(retriever)
+            if isinstance(retriever, IVFRetriever):
+                retriever.train()
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'index.npz')
+                retriever.save(path)
+                restored = type(retriever)(**retriever.params())
+                restored.nprobe = getattr(retriever, 'nprobe', None)
+                restored.ef_search = getattr(retriever, 'ef_search', None)
+                self.assertTrue(restored.load(path))
+                self.assertTrue(restored.is_loaded)
+                self.assertEqual(restored.doc_ids(), retriever.doc_ids())
+                for query in self.queries[:5]:
+                    self.assertEqual(restored.search(query, 5), retriever.search(query, 5))
+
+                self.assertFalse(HNSWRetriever(m=4).load(path))
+
+
+def document(doc_id, vector, content="A short chunk."):
+    return Document(id=doc_id, content=content, embedding=Document.encode_embedding(vector))
+
+
+class TestSelectChunks(TestCase):
+    def test_threshold_and_top_k(self):
+        candidates = [(document(1, [1, 0, 0]), 0.8), (document(2, [0, 1, 0]), 0.5),
+                      (document(3, [0, 0, 1]), 0.2)]
+        selected = select_chunks(candidates, top_k=5, min_similarity=0.3, token_budget=1000, mmr_lambda=1.0)
+        self.assertEqual([doc.id for doc in selected], [1, 2])
+        selected = select_chunks(candidates, top_k=1, min_similarity=0.3, token_budget=1000, mmr_lambda=1.0)
+        self.assertEqual([doc.id for doc in selected], [1])
+        self.assertEqual(select_chunks(candidates, top_k=5, min_similarity=0.9, token_budget=1000, mmr_lambda=1.0), [])
+
+    def test_mmr_prefers_novel_chunks_and_drops_duplicates(self):
+        candidates = [(document(1, [1, 0.1, 0]), 0.9), (document(2, [1, 0.12, 0]), 0.89),
+                      (document(3, [0.6, 0, 0.8]), 0.7), (document(4, [0.7, 0.7, 0]), 0.8)]
+        selected = select_chunks(candidates, top_k=3, min_similarity=0.0, token_budget=1000, mmr_lambda=0.5)
+        self.assertEqual([doc.id for doc in selected], [1, 3, 4])
+        # The near copy of the first chunk is never used, even with room to spare
+        selected = select_chunks(candidates, top_k=4, min_similarity=0.0, token_budget=1000, mmr_lambda=1.0)
+        self.assertEqual([doc.id for doc in selected], [1, 4, 3])
+
+    def test_token_budget_packs_chunks_that_fit(self):
+        long = "word " * 200
+        candidates = [(document(1, [1, 0], long), 0.9), (document(2, [0, 1]), 0.8), (document(3, [1, 1]), 0.7)]
+        selected = select_chunks(candidates, top_k=3, min_similarity=0.0, token_budget=50, mmr_lambda=1.0)
+        self.assertEqual([doc.id for doc in selected], [2, 3])
+
+
+class TestBM25Index(TestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        for doc_id, content in enumerate([
+            "The minimum deposit is 10 euros.",
+            "Transfers to another IBAN arrive the next working day.",
+            "Your IBAN is shown in the app. The IBAN has 27 characters.",
+            "Cards are delivered within a week.",
+        ], start=1):
+            self.index.add(doc_id, content)
+
+    def test_ranking(self):
+        self.assertEqual([doc_id for doc_id, _ in self.index.search("my IBAN", 5)], [3, 2])
+        self.assertEqual(self.index.search("minimum deposit", 1)[0][0], 1)
+        self.assertEqual(self.index.search("mortgage rates", 5), [])
+
+    def test_scores_are_normalized(self):
+        (_, full), = self.index.search("minimum deposit", 1)
+        (_, partial), = self.index.search("minimum deposit for a mortgage", 1)
+        self.assertGreater(full, 0.8)
+        self.assertLessEqual(full, 1.0)
+        self.assertLess(partial, 0.5)
+
+    def test_add_and_remove(self):
+        self.index.remove(1)
+        self.assertEqual(self.index.search("minimum deposit", 5), [])
+        self.index.add(2, "Minimum deposit rules changed.")
+        self.assertEqual(self.index.search("deposit", 5)[0][0], 2)
+        self.assertEqual([doc_id for doc_id, _ in self.index.search("IBAN", 5)], [3])
+        self.assertEqual(len(self.index), 3)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([1, 2, 3], [3, 1], k=60)
+        self.assertEqual(sorted(fused, key=fused.get, reverse=True), [1, 3, 2])
+        self.assertAlmostEqual(fused[1], 1 / 61 + 1 / 62)
+
+
+class TestBM25IndexSync(DatabaseTestCase):
+    def test_sync_follows_the_document_table(self):
+        kept = Document.objects.create(content="The minimum deposit is 10 euros.", embedding=Document.encode_embedding([1, 0]))
+        removed = Document.objects.create(content="Deposits are instant.", embedding=Document.encode_embedding([0, 1]))
+        Document.objects.create(content="Deposit limits, not embedded yet.")
+        index = BM25Index()
+        index.sync()
+        self.assertEqual(index.doc_ids(), {kept.id, removed.id})
+        removed.delete()
+        index.sync()
+        self.assertEqual([doc_id for doc_id, _ in index.search("deposit", 5)], [kept.id])
+
+    def test_sync_checks_the_table_at_most_every_max_age_seconds(self):
+        first = Document.objects.create(content="Deposits are instant.", embedding=Document.encode_embedding([1, 0]))
+        index = BM25Index()
+        index.sync(max_age=60)
+        # Rows written without signals, e.g. by another worker
+        second, = Document.objects.bulk_create([Document(content="Deposit limits.", embedding=Document.encode_embedding([0, 1]))])
+        with self.assertNumQueries(0):
+            index.sync(max_age=60)
+        self.assertEqual(index.doc_ids(), {first.id})
+        index.sync()
+        self.assertEqual(index.doc_ids(), {first.id, second.id})
+
+
+class TestRetrieveContext(IsolatedAsyncioTestCase):
+    async def retrieve(self, candidates, lexical=()):
+        service = RAGService()
+        self.create_embedding = mock.AsyncMock(return_value=[1.0, 0.0])
+        with mock.patch.object(service, 'create_embedding', self.create_embedding), \
+                mock.patch.object(service, 'get_similar_documents', mock.AsyncMock(return_value=candidates)), \
+                mock.patch.object(service, 'get_lexical_matches', mock.AsyncMock(return_value=list(lexical))):
+            return await service.retrieve_context("query")
+
+    @override_settings(RAG_RETRIEVAL_MODE='vector', RAG_TOP_K=2, RAG_MIN_SIMILARITY=0.3, RAG_CONTEXT_TOKEN_BUDGET=100,
+                       RAG_MMR_LAMBDA=0.7)
+    async def test_context_joins_selected_chunks(self):
+        _, context, document_ids = await self.retrieve([
+            (document(1, [1, 0], "Transfers are free."), 0.9),
+            (document(2, [0, 1], "Cards arrive in a week."), 0.6),
+            (document(3, [1, 1], "Branches open at 8."), 0.5),
+        ])
+        self.assertEqual(context, "Transfers are free.\n\nCards arrive in a week.")
+        self.assertEqual(document_ids, [1, 2])
+
+    @override_settings(RAG_RETRIEVAL_MODE='vector', RAG_MIN_SIMILARITY=0.3)
+    async def test_no_context_below_threshold(self):
+        _, context, document_ids = await self.retrieve([(document(1, [1, 0]), 0.1)])
+        self.assertEqual((context, document_ids), ("", []))
+
+    @override_settings(RAG_RETRIEVAL_MODE='hybrid', RAG_LEXICAL_CONFIDENCE=0.8, RAG_MIN_SIMILARITY=0.95,
+                       RAG_LEXICAL_MIN_SCORE=0.4, RAG_TOP_K=3, RAG_MMR_LAMBDA=1.0)
+    async def test_confident_lexical_match_skips_the_embedding(self):
+        query_embedding, context, document_ids = await self.retrieve([], lexical=[
+            (document(1, [1, 0], "Your IBAN is in the app."), 0.9),
+            (document(2, [0, 1], "IBANs have 27 characters."), 0.5),
+            (document(3, [1, 1], "Cards show the IBAN."), 0.2),
+        ])
+        self.create_embedding.assert_not_called()
+        # BM25 scores are held to RAG_LEXICAL_MIN_SCORE, not the cosine threshold
+        self.assertEqual(query_embedding, None)
+        self.assertEqual(document_ids, [1, 2])
+
+    @override_settings(RAG_RETRIEVAL_MODE='hybrid', RAG_LEXICAL_CONFIDENCE=0.8, RAG_MIN_SIMILARITY=0.3, RAG_TOP_K=2,
+                       RAG_MMR_LAMBDA=1.0)
+    async def test_hybrid_fuses_rankings(self):
+        first, second, lexical_only, unrelated = (
+            document(1, [1, 0.2], "First."), document(2, [1, 0.6], "Second."),
+            document(3, [1, 0.4], "Lexical."), document(4, [0, 1], "Unrelated."),
+        )
+        query_embedding, _, document_ids = await self.retrieve(
+            [(first, 0.95), (second, 0.9)],
+            lexical=[(lexical_only, 0.5), (second, 0.4), (unrelated, 0.3)])
+        self.create_embedding.assert_awaited_once()
+        self.assertIsNotNone(query_embedding)
+        # Second is ranked by both, the unrelated lexical hit fails the cosine threshold
+        self.assertEqual(document_ids, [2, 1])
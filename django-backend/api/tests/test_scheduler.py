@@ -0,0 +1,85 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase
+from openai import AsyncOpenAI
+from ..services.fake_openai import FakeOpenAIServer, hashed_embedding
+from ..services.scheduler import RequestScheduler, TokenBucket, BULK, INTERACTIVE
+
+
+class TestRequestScheduler(IsolatedAsyncioTestCase):
+    async def test_max_in_flight(self):
+        scheduler = RequestScheduler(max_in_flight=2)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            peak = max(peak, scheduler.in_flight)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(scheduler.run(call) for _ in range(6)))
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.stats()['completed'], 6)
+        self.assertEqual(scheduler.in_flight, 0)
+
+    async def test_interactive_runs_before_bulk(self):
+        scheduler = RequestScheduler(max_in_flight=1)
+        order = []
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        def call(name):
+            async def run():
+                order.append(name)
+            return run
+
+        first = asyncio.create_task(scheduler.run(blocker))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(scheduler.run(call('bulk'), priority=BULK))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.run(call('chat'), priority=INTERACTIVE)))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(first, *tasks)
+        self.assertEqual(order, ['chat', 'bulk'])
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(per_minute=600)
+        self.assertEqual(bucket.reserve(600), 0.0)
+        self.assertAlmostEqual(bucket.reserve(10), 1.0, places=1)
+        self.assertEqual(TokenBucket(per_minute=0).reserve(10 ** 6), 0.0)
+
+    async def test_retries_rate_limits_and_server_errors(self):
+        scheduler = RequestScheduler(max_retries=3, base_delay=0.01)
+        async with FakeOpenAIServer(latency_scale=0, retry_after=0) as server:
+            server.fail_next(429, 503)
+            client = AsyncOpenAI(api_key='test', base_url=server.base_url, max_retries=0)
+            response = await scheduler.run(lambda: client.embeddings.create(model='m', input='hi'))
+            await client.close()
+        self.assertEqual(response.data[0].embedding, hashed_embedding('hi'))
+        self.assertEqual(server.requests['embeddings'], 3)
+        self.assertEqual(scheduler.stats()['retries'], 2)
+
+    async def test_client_errors_are_not_retried(self):
+        scheduler = RequestScheduler(max_retries=3, base_delay=0.01)
+        async with FakeOpenAIServer(latency_scale=0) as server:
+            server.fail_next(400)
+            client = AsyncOpenAI(api_key='test', base_url=server.base_url, max_retries=0)
+            with self.assertRaises(Exception):
+                await scheduler.run(lambda: client.embeddings.create(model='m', input='hi'))
+            await client.close()
+        self.assertEqual(server.requests['embeddings'], 1)
+        self.assertEqual(scheduler.stats()['failures'], 1)
+
+    async def test_rate_limit_paces_requests(self):
+        scheduler = RequestScheduler(requests_per_minute=600)
+        scheduler.requests._available = 1
+
+        async def call():
+            pass
+
+        started = time.monotonic()
+        await asyncio.gather(*(scheduler.run(call) for _ in range(3)))
+        # Two calls over budget at 10 requests per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
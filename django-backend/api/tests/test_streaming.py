@@ -0,0 +1,39 @@
+import json
+from unittest import TestCase
+from ..services.streaming import IncrementalResponseParser
+
+
+class TestIncrementalResponseParser(TestCase):
+    def feed_in_pieces(self, text, size):
+        parser = IncrementalResponseParser()
+        deltas = [parser.feed(text[i:i + size]) for i in range(0, len(text), size)]
+        return parser, ''.join(deltas), deltas
+
+    def test_streams_general_inquiry_text(self):
+        payload = {"type": "general_inquiry", "response": "Line one\nSays \"hi\" \\ café \U0001F600 done"}
+        text = json.dumps(payload, indent=4)
+        for size in (1, 2, 3, 7, len(text)):
+            parser, streamed, _ = self.feed_in_pieces(text, size)
+            self.assertEqual(parser.response_type, "general_inquiry")
+            self.assertEqual(streamed, payload["response"])
+            self.assertEqual(json.loads(parser.buffer), payload)
+
+    def test_type_is_known_early(self):
+        parser = IncrementalResponseParser()
+        parser.feed('{\n  "type": "general_inquiry",\n  "resp')
+        self.assertEqual(parser.response_type, "general_inquiry")
+        self.assertEqual(parser.feed('onse": "Hel'), "Hel")
+        self.assertEqual(parser.feed('lo"}'), "lo")
+
+    def test_banking_operation_emits_nothing(self):
+        text = json.dumps({"type": "banking_operation", "operation": {"action": "DEPOSIT", "amount": 500}})
+        parser, streamed, _ = self.feed_in_pieces(text, 4)
+        self.assertEqual(parser.response_type, "banking_operation")
+        self.assertEqual(streamed, "")
+
+    def test_response_before_type_is_held_back(self):
+        text = '{"response": "Answer text", "type": "general_inquiry"}'
+        parser, streamed, deltas = self.feed_in_pieces(text, 5)
+        self.assertEqual(streamed, "Answer text")
+        # Nothing is released until the type has been seen
+        self.assertEqual(deltas[:-2], [''] * (len(deltas) - 2))
@@ -0,0 +1,33 @@
+from django.test import TestCase
+from ..models import User
+from ..services.user_service import UserService
+
+
+class TestTransfer(TestCase):
+    def setUp(self):
+        self.service = UserService()
+        self.alice = User.objects.create(name="Alice", iban="GR0000000000000000000000001", balance=100)
+        self.bob = User.objects.create(name="Bob", iban="GR0000000000000000000000002", balance=50)
+
+    def balances(self):
+        return list(User.objects.order_by('id').values_list('balance', flat=True))
+
+    def test_transfer_moves_money(self):
+        success, message = self.service.transfer(self.alice.id, 30, self.bob.iban)
+        self.assertTrue(success)
+        self.assertEqual(message, "Successfully transferred 30 to Bob")
+        self.assertEqual(self.balances(), [70, 80])
+
+    def test_balance_is_checked_on_the_current_row(self):
+        # The caller's copy is stale, the row is not
+        User.objects.filter(id=self.alice.id).update(balance=10)
+        success, message = self.service.transfer(self.alice.id, 30, self.bob.iban)
+        self.assertFalse(success)
+        self.assertEqual(message, "Insufficient balance")
+        self.assertEqual(self.balances(), [10, 50])
+
+    def test_rejected_transfers(self):
+        self.assertEqual(self.service.transfer(self.alice.id, 0, self.bob.iban), (False, "Amount must be positive"))
+        self.assertEqual(self.service.transfer(self.alice.id, 5, "GR00"), (False, "Recipient IBAN not found"))
+        self.assertEqual(self.service.transfer(self.alice.id, 5, self.alice.iban), (False, "Cannot transfer to self"))
+        self.assertEqual(self.balances(), [100, 50])
@@ -9,7 +9,9 @@ from .views import (
     DocumentViewSet,
     IndexView,
     ChatRoomView,
-    WSCheckView
+    WSCheckView,
+    MetricsView,
+    ProfileView
 )
 from app.metadata import PROJECT_NAME
 
@@ -22,6 +24,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('chat/<str:room_name>/', ChatRoomView.as_view(), name='chat_room'),
     path('ws-check/', WSCheckView.as_view(), name='ws_check'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('debug/profile', ProfileView.as_view(), name='profile'),
 ]
 
 if settings.DEV_DOCS:
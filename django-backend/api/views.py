@@ -1,14 +1,24 @@
+import hmac
+import json
 from rest_framework import generics, permissions, viewsets, filters, status
 from rest_framework.schemas.openapi import AutoSchema
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from api.serializers.metadata import ApiMetadataSerializer
 from app.metadata import PROJECT_NAME
-from rest_framework.pagination import PageNumberPagination
-from django.views.generic import TemplateView
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.utils.dateparse import parse_datetime
+from django.views.generic import TemplateView, View
 from .models import User, Document
-from api.serializers.api import UserSerializer, DocumentSerializer
+from api.serializers.api import UserSerializer, DocumentSerializer, TransactionSerializer
 from api.services.rag_service import RAGService
+from api.services.ledger_service import ledger_service
+from api.services.metrics import registry
+from api.services.profiler import profile
+from api.services.user_service import UserService
 
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.all()
@@ -43,6 +53,83 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @staticmethod
+    def _parse_ndjson(lines) -> list:
+        items = []
+        for number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise ParseError(f'Invalid JSON on line {number}')
+        return items
+
+    def _bulk_payload(self, request):
+        """
+        Read documents from an NDJSON upload or body, or a JSON array.
+        Returns (items, options) where options holds any body-level settings.
+        """
+        if request.content_type.startswith('application/x-ndjson'):
+            return self._parse_ndjson(request.body.splitlines()), {}
+        if 'file' in request.FILES:
+            return self._parse_ndjson(request.FILES['file']), request.data
+        data = request.data
+        if isinstance(data, list):
+            return data, {}
+        if isinstance(data, dict) and isinstance(data.get('documents'), list):
+            return data['documents'], data
+        raise ParseError('Expected a JSON array of documents or an NDJSON upload')
+
+    @staticmethod
+    def _bulk_option(request, options, name):
+        value = request.query_params.get(name, options.get(name))
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ParseError(f'{name} must be an integer')
+        if value < 0:
+            raise ParseError(f'{name} must not be negative')
+        return value
+
+    @action(detail=False, methods=['post'])
+    def bulk_ingest(self, request):
+        """
+        Add many documents at once. Accepts a JSON array (or {"documents": [...]})
+        of strings or {"content": ...} objects, or an NDJSON body or file upload.
+        Long documents are split into chunks (chunk_size / chunk_overlap).
+        """
+        from asgiref.sync import async_to_sync
+
+        items, options = self._bulk_payload(request)
+        if not items:
+            return Response(
+                {'error': 'At least one document is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        chunk_size = self._bulk_option(request, options, 'chunk_size')
+        chunk_overlap = self._bulk_option(request, options, 'chunk_overlap')
+
+        contents = []
+        for item in items:
+            content = item.get('content') if isinstance(item, dict) else item
+            contents.append(content if isinstance(content, str) else '')
+
+        rag_service = RAGService()
+        results = async_to_sync(rag_service.add_documents)(contents, chunk_size, chunk_overlap)
+
+        succeeded = sum(1 for result in results if result['status'] == 'success')
+        return Response({
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }, status=status.HTTP_201_CREATED if succeeded == len(results) else status.HTTP_207_MULTI_STATUS)
+
 class IndexView(generics.RetrieveAPIView):
     permission_classes = (permissions.AllowAny,)
     serializer_class = ApiMetadataSerializer
@@ -58,6 +145,13 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class LedgerPagination(CursorPagination):
+    # Cursor pages stay stable while new entries are appended
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', '-id')
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -65,6 +159,61 @@ class UserViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['username', 'iban']
 
+    def perform_create(self, serializer):
+        # Opens empty: a non-zero opening balance needs its ledger entry (UserService.register)
+        serializer.save(balance=0)
+
+    @staticmethod
+    def _datetime_param(request, name):
+        value = request.query_params.get(name)
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ParseError(f'{name} must be an ISO 8601 datetime')
+        return parsed
+
+    @action(detail=False, methods=['post'])
+    def bulk_balance(self, request):
+        """
+        Post many deposits and withdrawals at once. Accepts a JSON array (or
+        {"operations": [...]}) of {"iban", "action": "DEPOSIT"|"WITHDRAW",
+        "amount", "idempotency_key"} objects. Replayed keys are reported as
+        duplicates and not applied again.
+        """
+        data = request.data
+        operations = data.get('operations') if isinstance(data, dict) else data
+        if not isinstance(operations, list) or not operations:
+            return Response(
+                {'error': 'Expected a non-empty JSON array of operations'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = UserService().apply_balance_changes(operations)
+        succeeded = sum(1 for result in results if result['status'] != 'error')
+        return Response({
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }, status=status.HTTP_200_OK if succeeded == len(results) else status.HTTP_207_MULTI_STATUS)
+
+    @action(detail=True, methods=['get'])
+    def transactions(self, request, pk=None):
+        """
+        Ledger of an account, newest first, with cursor pagination.
+        Optional since / until (ISO 8601) limit the time range.
+        """
+        user = self.get_object()
+        entries = ledger_service.history(
+            user.id,
+            since=self._datetime_param(request, 'since'),
+            until=self._datetime_param(request, 'until')
+        )
+        paginator = LedgerPagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        return paginator.get_paginated_response(TransactionSerializer(page, many=True).data)
+
 class ChatRoomView(TemplateView):
     template_name = 'chat_room.html'
     
@@ -81,3 +230,47 @@ class WSCheckView(TemplateView):
         context = super().get_context_data(**kwargs)
         context['ws_url'] = self.request.build_absolute_uri('/')[:-1].replace('http', 'ws')
         return context
+
+class MetricsView(View):
+    """Metrics of this worker process in the Prometheus text format"""
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class ProfileView(View):
+    """
+    Sample every thread of this worker for ?seconds= every ?interval=
+    seconds and return the collapsed stacks, for flamegraph.pl or
+    speedscope. Only when PROFILER_ENABLED, for staff or PROFILER_TOKEN.
+    """
+
+    async def get(self, request):
+        if not settings.PROFILER_ENABLED:
+            raise Http404
+        if not await self._allowed(request):
+            return HttpResponseForbidden("Staff or profiler token required\n")
+        try:
+            seconds = float(request.GET.get('seconds', 10))
+            interval = float(request.GET.get('interval', 0.01))
+        except ValueError:
+            return HttpResponseBadRequest("seconds and interval must be numbers\n")
+        if not 0 < seconds <= settings.PROFILER_MAX_SECONDS or not 0.001 <= interval <= 1:
+            return HttpResponseBadRequest(
+                f"seconds must be in (0, {settings.PROFILER_MAX_SECONDS:g}] and interval in [0.001, 1]\n"
+            )
+        try:
+            stacks, samples = await profile(seconds, interval)
+        except RuntimeError as e:
+            return HttpResponse(f"{e}\n", status=409)
+        response = HttpResponse(stacks, content_type='text/plain; charset=utf-8')
+        response['X-Profile-Samples'] = str(samples)
+        return response
+
+    @staticmethod
+    async def _allowed(request) -> bool:
+        token = settings.PROFILER_TOKEN
+        header = request.headers.get('Authorization', '').encode()
+        if token and hmac.compare_digest(header, f"Bearer {token}".encode()):
+            return True
+        user = await request.auser()
+        return user.is_active and user.is_staff
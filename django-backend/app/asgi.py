@@ -12,9 +12,11 @@ django_asgi_app = get_asgi_application()
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from api.routing import websocket_urlpatterns
+from app.lifespan import lifespan
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
+    "lifespan": lifespan,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
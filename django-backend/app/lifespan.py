@@ -0,0 +1,24 @@
+from api.services.account_events import get_account_events
+from api.services.clients import openai_clients
+from api.services.embedding_cache import get_embedding_cache
+from api.services.profiler import start_loop_monitor, stop_loop_monitor
+from django.conf import settings
+
+
+async def lifespan(scope, receive, send):
+    """
+    ASGI lifespan handler: starts the event loop lag monitor and releases
+    pooled connections when the worker stops
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await start_loop_monitor(settings.LOOP_LAG_THRESHOLD)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await stop_loop_monitor()
+            await openai_clients.aclose()
+            await get_embedding_cache().aclose()
+            await get_account_events().aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -34,16 +34,27 @@ INSTALLED_APPS = [
 # Add ASGI configuration
 ASGI_APPLICATION = 'app.asgi.application'
 
-# Add Channel Layers configuration
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [(config('REDIS_HOST', default='127.0.0.1'), 
-                      config('REDIS_PORT', default=6379, cast=int))],
+REDIS_HOST = config('REDIS_HOST', default='127.0.0.1')
+REDIS_PORT = config('REDIS_PORT', default=6379, cast=int)
+
+# Add Channel Layers configuration: redis, or memory for a single worker
+# without Redis (benchmark_chat runs its worker this way)
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='redis')
+if CHANNEL_LAYER_BACKEND == 'memory':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                "hosts": [(REDIS_HOST, REDIS_PORT)],
+            },
+        },
+    }
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
@@ -155,9 +166,137 @@ LOGGING = {
             'handlers': ['console'],
             'level':  config('DJANGO_LOG_LEVEL', default='INFO'),
         },
+        'api': {
+            'handlers': ['console'],
+            'level':  config('API_LOG_LEVEL', default='INFO'),
+        },
     },
 }
 
 DEV_DOCS = config('DEV_DOCS', default=False, cast=bool)
 
-OPENAI_API_KEY = config('OPENAI_API_KEY')
\ No newline at end of file
+OPENAI_API_KEY = config('OPENAI_API_KEY')
+# Connection pool of the OpenAI client shared by the whole process
+OPENAI_MAX_CONNECTIONS = config('OPENAI_MAX_CONNECTIONS', default=100, cast=int)
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = config('OPENAI_MAX_KEEPALIVE_CONNECTIONS', default=20, cast=int)
+OPENAI_KEEPALIVE_EXPIRY = config('OPENAI_KEEPALIVE_EXPIRY', default=30.0, cast=float)
+OPENAI_TIMEOUT = config('OPENAI_TIMEOUT', default=60.0, cast=float)
+# Requires the optional h2 package
+OPENAI_HTTP2 = config('OPENAI_HTTP2', default=False, cast=bool)
+# Point the client at a compatible server instead of api.openai.com, e.g.
+# http://127.0.0.1:8001/v1 for the offline stand-in of manage.py fake_openai
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='') or None
+# Outbound request scheduler: calls in flight, per-minute request and token
+# budgets (0 disables) and retries of 429/5xx responses
+OPENAI_MAX_IN_FLIGHT = config('OPENAI_MAX_IN_FLIGHT', default=32, cast=int)
+OPENAI_REQUESTS_PER_MINUTE = config('OPENAI_REQUESTS_PER_MINUTE', default=0, cast=int)
+OPENAI_TOKENS_PER_MINUTE = config('OPENAI_TOKENS_PER_MINUTE', default=0, cast=int)
+OPENAI_MAX_RETRIES = config('OPENAI_MAX_RETRIES', default=4, cast=int)
+OPENAI_RETRY_BASE_DELAY = config('OPENAI_RETRY_BASE_DELAY', default=0.5, cast=float)
+OPENAI_RETRY_MAX_DELAY = config('OPENAI_RETRY_MAX_DELAY', default=20.0, cast=float)
+# Stream general inquiry answers to the WebSocket as they are generated
+OPENAI_STREAM_RESPONSES = config('OPENAI_STREAM_RESPONSES', default=True, cast=bool)
+
+# Messages a chat connection may have waiting while a reply is generated,
+# and what happens to one more: drop, reject (tell the user) or coalesce
+# (append it to the newest waiting message). A reply holds one banking
+# operation, so coalesce rejects instead when either message is a command
+# the fast path recognizes; commands only the model understands can still
+# be merged, and all but one of them are then lost.
+CHAT_QUEUE_SIZE = config('CHAT_QUEUE_SIZE', default=5, cast=int)
+CHAT_QUEUE_OVERFLOW = config('CHAT_QUEUE_OVERFLOW', default='reject')
+
+# IBANs of new accounts: GR + check digits + bank code + branch code + a
+# 16 digit account number; workers reserve IBAN_BLOCK_SIZE numbers at a time
+IBAN_BANK_CODE = config('IBAN_BANK_CODE', default='999')
+IBAN_BRANCH_CODE = config('IBAN_BRANCH_CODE', default='0001')
+IBAN_BLOCK_SIZE = config('IBAN_BLOCK_SIZE', default=100, cast=int)
+
+# Reuse general inquiry answers for near-duplicate questions (cosine
+# similarity of the query embeddings) over the same retrieved context.
+# Once the user has said something, answers are only reused in that session.
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_SIZE = config('RESPONSE_CACHE_SIZE', default=512, cast=int)
+RESPONSE_CACHE_THRESHOLD = config('RESPONSE_CACHE_THRESHOLD', default=0.95, cast=float)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=3600, cast=int)
+
+# Parse simple banking commands locally instead of calling the LLM
+FAST_PATH_ENABLED = config('FAST_PATH_ENABLED', default=True, cast=bool)
+
+# Token budget for the chat history sent with every message; older turns
+# are dropped, or folded into a summary when CHAT_HISTORY_SUMMARIZE is on
+CHAT_HISTORY_TOKEN_BUDGET = config('CHAT_HISTORY_TOKEN_BUDGET', default=2000, cast=int)
+CHAT_HISTORY_SUMMARIZE = config('CHAT_HISTORY_SUMMARIZE', default=False, cast=bool)
+CHAT_HISTORY_SUMMARY_MAX_WORDS = config('CHAT_HISTORY_SUMMARY_MAX_WORDS', default=120, cast=int)
+
+# Retrieval backend used by RAGService: brute_force (exact), ivf or hnsw
+RAG_RETRIEVER = config('RAG_RETRIEVER', default='brute_force')
+RAG_RETRIEVER_OPTIONS = {
+    'ivf': {
+        'nlist': config('RAG_IVF_NLIST', default=64, cast=int),
+        'nprobe': config('RAG_IVF_NPROBE', default=8, cast=int),
+    },
+    'hnsw': {
+        'm': config('RAG_HNSW_M', default=16, cast=int),
+        'ef_construction': config('RAG_HNSW_EF_CONSTRUCTION', default=100, cast=int),
+        'ef_search': config('RAG_HNSW_EF_SEARCH', default=50, cast=int),
+    },
+}
+# Optional .npz file the index is restored from at startup (see build_rag_index)
+RAG_INDEX_PATH = config('RAG_INDEX_PATH', default='')
+# Seconds between checks of the indexes against the Document table for rows
+# written by other workers; this process's own writes arrive through signals
+RAG_INDEX_SYNC_INTERVAL = config('RAG_INDEX_SYNC_INTERVAL', default=30, cast=float)
+
+# Context selection: up to RAG_TOP_K chunks with a cosine similarity to the
+# query of at least RAG_MIN_SIMILARITY (vector and hybrid retrieval), packed
+# into RAG_CONTEXT_TOKEN_BUDGET tokens. RAG_MMR_LAMBDA trades relevance
+# (1.0) against novelty over the chunks already picked (0.0).
+RAG_TOP_K = config('RAG_TOP_K', default=4, cast=int)
+RAG_MIN_SIMILARITY = config('RAG_MIN_SIMILARITY', default=0.3, cast=float)
+RAG_CONTEXT_TOKEN_BUDGET = config('RAG_CONTEXT_TOKEN_BUDGET', default=800, cast=int)
+RAG_MMR_LAMBDA = config('RAG_MMR_LAMBDA', default=0.7, cast=float)
+
+# Retrieval mode: vector (embeddings only), hybrid (embeddings and BM25 fused
+# by reciprocal rank) or lexical (BM25 only, never embeds the query). In hybrid
+# mode a BM25 match scoring RAG_LEXICAL_CONFIDENCE or more is used on its own
+# and the embedding request is skipped; 0 always embeds. Without an embedding,
+# chunks need a BM25 score of RAG_LEXICAL_MIN_SCORE instead of RAG_MIN_SIMILARITY.
+# Both are on the normalized BM25 scale, where 1.0 matches every query term.
+RAG_RETRIEVAL_MODE = config('RAG_RETRIEVAL_MODE', default='hybrid')
+RAG_LEXICAL_CONFIDENCE = config('RAG_LEXICAL_CONFIDENCE', default=0.8, cast=float)
+RAG_LEXICAL_MIN_SCORE = config('RAG_LEXICAL_MIN_SCORE', default=0.4, cast=float)
+RAG_BM25_K1 = config('RAG_BM25_K1', default=1.2, cast=float)
+RAG_BM25_B = config('RAG_BM25_B', default=0.75, cast=float)
+RAG_RRF_K = config('RAG_RRF_K', default=60, cast=int)
+
+# Query embedding cache: in-process LRU in front of the shared Redis
+EMBEDDING_CACHE_SIZE = config('EMBEDDING_CACHE_SIZE', default=1024, cast=int)
+EMBEDDING_CACHE_TTL = config('EMBEDDING_CACHE_TTL', default=86400, cast=int)
+EMBEDDING_CACHE_REDIS = config('EMBEDDING_CACHE_REDIS', default=True, cast=bool)
+
+# Chat sessions cache their account between turns; balance changes reach
+# sessions of other workers through this Redis pub/sub channel. Without
+# Redis only changes made by the same process are seen, so turn it off
+# only when running a single worker.
+ACCOUNT_EVENTS_CHANNEL = config('ACCOUNT_EVENTS_CHANNEL', default='account-changes')
+ACCOUNT_EVENTS_REDIS = config('ACCOUNT_EVENTS_REDIS', default=True, cast=bool)
+
+# Span histograms and token/error counters served on /metrics; the
+# service stats exported there are always available
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+
+# Opt-in sampling profiler on GET /debug/profile?seconds=N, for staff users
+# or requests with an "Authorization: Bearer PROFILER_TOKEN" header
+PROFILER_ENABLED = config('PROFILER_ENABLED', default=False, cast=bool)
+PROFILER_TOKEN = config('PROFILER_TOKEN', default='')
+PROFILER_MAX_SECONDS = config('PROFILER_MAX_SECONDS', default=60, cast=float)
+# Log the stack of whatever blocks the event loop for this many seconds, 0 disables
+LOOP_LAG_THRESHOLD = config('LOOP_LAG_THRESHOLD', default=0.0, cast=float)
+
+# Bulk document ingestion
+RAG_CHUNK_SIZE = config('RAG_CHUNK_SIZE', default=1000, cast=int)
+RAG_CHUNK_OVERLAP = config('RAG_CHUNK_OVERLAP', default=200, cast=int)
+EMBEDDING_BATCH_SIZE = config('EMBEDDING_BATCH_SIZE', default=2048, cast=int)
+EMBEDDING_BATCH_MAX_TOKENS = config('EMBEDDING_BATCH_MAX_TOKENS', default=300000, cast=int)
+EMBEDDING_BATCH_CONCURRENCY = config('EMBEDDING_BATCH_CONCURRENCY', default=4, cast=int)
@@ -50,6 +50,20 @@ export const chatApi = createApi({
             const message = JSON.parse(event.data);
             dispatch(
               chatApi.util.updateQueryData('getMessages', roomName, (draft) => {
+                // Streamed bot replies: partial frames append their delta,
+                // the final frame with the same message_id replaces the text
+                if (message.message_id) {
+                  const existing = draft.entities[message.message_id];
+                  messagesAdapter.upsertOne(draft, {
+                    username: message.username,
+                    message: message.partial ? (existing?.message || '') + message.delta : message.message,
+                    partial: Boolean(message.partial),
+                    id: message.message_id,
+                    timestamp: existing?.timestamp || new Date().toISOString(),
+                    room: roomName
+                  });
+                  return;
+                }
                 messagesAdapter.addOne(draft, {
                   ...message,
                   id: `${message.username}-${Date.now()}`,